@@ -21,10 +21,191 @@ class Settings(BaseSettings):
 
     REMOVEBG_API_KEY: str | None = None
 
+    # Gemini HTTP pool (one keep-alive client per worker)
+    GEMINI_MAX_CONNECTIONS: int = 100
+    GEMINI_MAX_KEEPALIVE: int = 20
+    GEMINI_KEEPALIVE_EXPIRY: float = 30.0
+    GEMINI_TIMEOUT: float = 60.0
+    GEMINI_CONNECT_TIMEOUT: float = 5.0
+
+    # Gemini model routing: full model for open-ended styling, light model for
+    # short/structured tasks; traffic moves off a model whose rolling error
+    # rate or p95 exceeds these limits
+    GEMINI_MODEL_FULL: str = "gemini-2.5-flash"
+    GEMINI_MODEL_LIGHT: str = "gemini-2.5-flash-lite"
+    GEMINI_ROUTER_MAX_ERROR_RATE: float = 0.2
+    GEMINI_ROUTER_MAX_P95_MS_FULL: float = 25000
+    GEMINI_ROUTER_MAX_P95_MS_LIGHT: float = 10000
+    GEMINI_ROUTER_MIN_SAMPLES: int = 10
+    GEMINI_ROUTER_PROBE_RATE: float = 0.05  # share still sent to a degraded model
+
+    # Upstream resilience (app/services/resilience.py): circuit breakers,
+    # bulkheads, hedged duplicates for cheap idempotent calls
+    UPSTREAM_FAILURE_THRESHOLD: int = 5  # consecutive failures that open a circuit
+    UPSTREAM_RESET_TIMEOUT: float = 30.0  # seconds before a trial call is let through
+    UPSTREAM_QUEUE_TIMEOUT: float = 2.0  # max wait for a bulkhead slot
+    UPSTREAM_HEDGING_ENABLED: bool = True
+    GEMINI_MAX_CONCURRENT: int = 32  # per model
+    FAL_MAX_CONCURRENT: int = 8  # per fal application
+    FAL_CALL_TIMEOUT: float = 120.0
+    FAL_VIDEO_MAX_CONCURRENT: int = 3
+    FAL_VIDEO_CALL_TIMEOUT: float = 360.0
+
+    # Gemini explicit context caching of the static consultant persona
+    GEMINI_CONTEXT_CACHE_ENABLED: bool = True
+    GEMINI_CONTEXT_CACHE_TTL: int = 3600
+
+    # Consultant response cache (first-turn questions) and [SEARCH:] image lists
+    CONSULTANT_CACHE_SIZE: int = 2000
+    CONSULTANT_CACHE_TTL: int = 6 * 3600
+    CONSULTANT_IMAGE_CACHE_SIZE: int = 1000
+    CONSULTANT_IMAGE_CACHE_TTL: int = 3600
+
+    # Image normalization before Gemini multimodal calls
+    IMAGE_MAX_EDGE: int = 1536
+    IMAGE_JPEG_QUALITY: int = 85
+    IMAGE_PASSTHROUGH_BYTES: int = 300 * 1024  # small JPEGs without EXIF/ICC/XMP are sent unchanged
+    IMAGE_WORKERS: int = 2
+
+    # Batch auto-tagging (/visual-search/auto-tag/batch)
+    AUTO_TAG_ITEMS_PER_REQUEST: int = 4  # images packed into one Gemini call
+    AUTO_TAG_CONCURRENCY: int = 4  # Gemini calls in flight per batch
+    AUTO_TAG_BATCH_MAX_ITEMS: int = 100
+    AUTO_TAG_MAX_FILE_BYTES: int = 10 * 1024 * 1024  # per image
+
+    # Style image search (/styles/search, consultant [SEARCH:]): Google CSE and
+    # DuckDuckGo run concurrently; first source with this many images wins,
+    # otherwise both are merged at the deadline
+    STYLE_SEARCH_GOOD_RESULTS: int = 10
+    STYLE_SEARCH_DEADLINE: float = 8.0
+
+    # Style detection in catalog search (app/search/style_taxonomy.json): up to
+    # STYLE_BOOST_TERMS heaviest tags of the detected styles are added to the query
+    STYLE_BOOST_TERMS: int = 10
+    STYLE_QUERY_CACHE_SIZE: int = 10000
+
+    # /search: catalog (Meilisearch) and internet (CSE) run concurrently, each
+    # with its own deadline; a branch that misses it comes back empty with an error
+    MEILI_TIMEOUT: float = 5.0
+    SEARCH_CATALOG_DEADLINE: float = 2.0
+    SEARCH_INTERNET_DEADLINE: float = 6.0
+
+    # Google CSE response cache (every CSE caller): fresh for CSE_CACHE_TTL,
+    # then served stale while a background refresh runs, for up to
+    # CSE_CACHE_STALE_TTL more
+    CSE_CACHE_ENABLED: bool = True
+    CSE_CACHE_TTL: int = 24 * 3600
+    CSE_CACHE_STALE_TTL: int = 6 * 24 * 3600
+    CSE_CACHE_MEMORY_ENTRIES: int = 2000
+    CSE_TIMEOUT: float = 20.0
+    # CSE quota budget: calls per quota day (Pacific) and per minute. Background
+    # work (warming, stale refreshes) stops once only CSE_BACKGROUND_RESERVE of
+    # the day is left; past the budget, requests degrade to cache / DuckDuckGo
+    CSE_DAILY_LIMIT: int = 100
+    CSE_PER_MINUTE: int = 60
+    CSE_BACKGROUND_RESERVE: float = 0.3
+    CSE_INTERACTIVE_WAIT: float = 1.0  # max wait for a per-minute token
+
+    # /suggest prefix index: catalog titles/brands/categories + style synonyms in
+    # memory; rebuilt when the Meili index changes (at most every
+    # SUGGEST_INDEX_REBUILD_INTERVAL), Meili answers prefixes it can't
+    SUGGEST_INDEX_ENABLED: bool = True
+    SUGGEST_INDEX_CHECK_INTERVAL: float = 30.0
+    SUGGEST_INDEX_REBUILD_INTERVAL: int = 600
+    SUGGEST_INDEX_MAX_PREFIX: int = 32  # longer prefixes go to Meili
+    SUGGEST_INDEX_TITLE_WORDS: int = 4  # words inside a title a prefix can start at
+
+    # Shop catalog sync (Supabase bot_products / bot_product_sizes -> Meili):
+    # rows changed since the updated_at watermark are pushed every
+    # CATALOG_SYNC_INTERVAL seconds; a periodic full id reconcile catches hard deletes
+    CATALOG_SYNC_ENABLED: bool = True  # also needs SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY
+    CATALOG_SYNC_INTERVAL: float = 2.0
+    CATALOG_SYNC_BATCH: int = 200
+    CATALOG_SYNC_OVERLAP: float = 5.0  # re-read window for rows committed late
+    CATALOG_SYNC_RECONCILE_INTERVAL: int = 3600
+
+    # Liveness probes for feed image URLs (/styles/search, /search/images,
+    # consultant feed): dead links and auto-blocked domains are dropped
+    IMAGE_LIVENESS_ENABLED: bool = True
+    IMAGE_LIVENESS_WAIT: float = 0.8  # max extra latency per response for fresh probes
+    IMAGE_LIVENESS_CONCURRENCY: int = 16
+    IMAGE_LIVENESS_TIMEOUT: float = 4.0
+    IMAGE_LIVENESS_MAX_PENDING: int = 500
+    IMAGE_LIVENESS_ALIVE_TTL: int = 6 * 3600
+    IMAGE_LIVENESS_DEAD_TTL: int = 24 * 3600
+    IMAGE_LIVENESS_BLOCK_MIN_PROBES: int = 10
+    IMAGE_LIVENESS_BLOCK_FAILURE_RATE: float = 0.6
+    IMAGE_LIVENESS_BLOCK_TTL: int = 24 * 3600
+
+    # Duplicate collapsing in image feeds: canonical URL, then pHash of the
+    # provider thumbnail plus its color signature (cached by URL); items not hashed within
+    # IMAGE_DEDUP_WAIT are kept
+    IMAGE_DEDUP_ENABLED: bool = True
+    IMAGE_DEDUP_MAX_DISTANCE: int = 8  # Hamming bits out of 64
+    IMAGE_DEDUP_MAX_COLOR_DISTANCE: float = 20.0  # as PHASH_MAX_COLOR_DISTANCE; looser for re-hosted crops
+    IMAGE_DEDUP_WAIT: float = 1.5
+    IMAGE_DEDUP_CONCURRENCY: int = 16
+    IMAGE_DEDUP_CACHE_TTL: int = 30 * 24 * 3600
+
+    # Thumbnail proxy (/api/v1/thumb): feed images as WebP at fixed widths.
+    # Only signed URLs (issued in search responses) are served; without
+    # THUMB_SIGNING_KEY a random key is generated at THUMB_SIGNING_KEY_PATH
+    THUMB_WIDTHS: List[int] = [160, 320, 640]
+    THUMB_DEFAULT_WIDTH: int = 320
+    THUMB_WEBP_QUALITY: int = 72
+    THUMB_CACHE_MAX_MB: int = 500
+    THUMB_MAX_AGE: int = 30 * 24 * 3600
+    THUMB_SIGNING_KEY: str = ""
+
+    # /styles/search pools: the app's style tabs (gender x category) are
+    # prebuilt in the background and served as random pages from memory
+    STYLE_POOL_ENABLED: bool = True
+    STYLE_POOL_GENDERS: List[str] = ["female", "male"]
+    STYLE_POOL_CATEGORIES: List[str] = [
+        "Trending", "Business", "Casual", "Smart Casual", "Streetwear", "Sport",
+        "Minimal", "Old Money", "Grunge", "Boho", "Military", "Event",
+    ]
+    STYLE_POOL_SIZE: int = 300
+    STYLE_POOL_REFRESH_INTERVAL: int = 6 * 3600
+    STYLE_POOL_PAUSE: float = 5.0  # between pool rebuilds (DuckDuckGo rate limits)
+    STYLE_POOL_VERIFY_WAIT: float = 30.0  # dedup/liveness budget per rebuild
+
+    # Shared image downloader (describe_image, remove-bg, MagicMirror)
+    IMAGE_FETCH_MAX_BYTES: int = 15 * 1024 * 1024
+    IMAGE_FETCH_TIMEOUT: float = 20.0
+    IMAGE_FETCH_MEMORY_ENTRIES: int = 64
+    IMAGE_FETCH_MEMORY_MAX_MB: int = 64  # total bytes held in memory (entries are up to IMAGE_FETCH_MAX_BYTES)
+    IMAGE_FETCH_CACHE_TTL: int = 24 * 3600
+    IMAGE_FETCH_DISK_MAX_MB: int = 200
+    IMAGE_FETCH_ALLOW_PRIVATE: bool = False  # local development only: skips the public-host check
+
+    # Perceptual-hash result cache for analyze/auto-tag (near-duplicate photos)
+    PHASH_CACHE_ENABLED: bool = True
+    PHASH_MAX_DISTANCE: int = 6  # Hamming bits out of 64
+    PHASH_MAX_COLOR_DISTANCE: float = 12.0  # largest mean RGB difference (0-255) of a 4x4 grid cell
+    PHASH_CACHE_TTL: int = 30 * 24 * 3600
+    PHASH_CACHE_MAX_ENTRIES: int = 20000  # per namespace (endpoint + language)
+
+    # Server-side consultant chat sessions
+    CHAT_SESSION_TTL: int = 2 * 3600  # idle expiry
+    CHAT_SESSION_MAX_SESSIONS: int = 5000
+    CHAT_SESSION_MAX_TURNS: int = 10  # compact once history grows past this
+    CHAT_SESSION_KEEP_TURNS: int = 4  # turns kept verbatim after compaction
+
     # Local static/temp (for local debug)
     BASE_DIR: str = str(Path(__file__).resolve().parents[1])
     STATIC_DIR: str = str(Path(BASE_DIR) / "static")
     TEMP_DIR: str = str(Path(STATIC_DIR) / "temp")
+    CACHE_DIR: str = str(Path(BASE_DIR) / "cache")
+    PHASH_CACHE_PATH: str = str(Path(CACHE_DIR) / "phash_cache.sqlite3")
+    IMAGE_FETCH_CACHE_DIR: str = str(Path(CACHE_DIR) / "images")
+    THUMB_CACHE_DIR: str = str(Path(STATIC_DIR) / "thumbs")
+    THUMB_SIGNING_KEY_PATH: str = str(Path(CACHE_DIR) / "thumb_signing.key")
+    IMAGE_DEDUP_CACHE_PATH: str = str(Path(CACHE_DIR) / "image_hashes.sqlite3")
+    STYLE_POOL_PATH: str = str(Path(CACHE_DIR) / "style_pools.json")
+    CSE_CACHE_PATH: str = str(Path(CACHE_DIR) / "cse_cache.sqlite3")
+    CATALOG_SYNC_PATH: str = str(Path(CACHE_DIR) / "catalog_sync.json")
+    STYLE_TAXONOMY_PATH: str = str(Path(BASE_DIR) / "app" / "search" / "style_taxonomy.json")
 
     # Optional: if you expose backend publicly (ngrok/domain), set this to that URL
     # Example: https://xxxxx.ngrok-free.app
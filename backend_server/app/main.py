@@ -10,10 +10,20 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 from app.config import settings
-from app.routes import nano_banana, remove_bg, ai_consultant, styles, visual_search, video_generation
+from app.routes import nano_banana, remove_bg, ai_consultant, styles, visual_search, video_generation, thumbnails
 from app.search.router import router as search_router
 from app.search.suggest_router import router as suggest_router
 from app.search.internet_images import router as internet_images_router
+from app.search.catalog_sync import catalog_sync
+from app.search.cse_cache import cse_cache
+from app.search.meili import meili_async
+from app.search.suggest_index import suggest_index
+from app.services.gemini_consultant_service import gemini_service
+from app.services.image_dedup import image_deduper
+from app.services.image_fetcher import image_fetcher
+from app.services.image_liveness import image_liveness
+from app.services.resilience import upstreams_summary
+from app.services.style_feed_warmer import style_feed_warmer
 
 # ... (rest of imports)
 
@@ -45,8 +55,19 @@ async def lifespan(app: FastAPI):
                 f"FAL_KEY_ID/SECRET loaded: {'YES' if (fal_id and fal_secret) else 'NO'}")
 
     Path(settings.TEMP_DIR).mkdir(parents=True, exist_ok=True)
+    style_feed_warmer.start()
+    suggest_index.start()
+    catalog_sync.start()
     yield
     logger.info("Shutting down Outfit Assistant Backend Server...")
+    await style_feed_warmer.stop()
+    await catalog_sync.stop()
+    await suggest_index.stop()
+    await gemini_service.aclose()
+    await image_fetcher.aclose()
+    await cse_cache.aclose()
+    await meili_async.aclose()
+    await image_liveness.aclose()
 
 
 app = FastAPI(
@@ -76,6 +97,7 @@ app.include_router(ai_consultant.router, prefix=settings.API_PREFIX, tags=["AI C
 app.include_router(styles.router, prefix=settings.API_PREFIX, tags=["Styles"])
 app.include_router(visual_search.router, prefix=settings.API_PREFIX, tags=["Visual Search"])
 app.include_router(video_generation.router, prefix=settings.API_PREFIX, tags=["Video Generation"])
+app.include_router(thumbnails.router, prefix=settings.API_PREFIX)
 
 @app.get("/")
 async def root():
@@ -89,6 +111,26 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/upstreams")
+async def upstreams_health():
+    """Circuit state, bulkhead usage and hedging counters per upstream (Gemini model / fal app)."""
+    return upstreams_summary()
+
+@app.get("/health/image-liveness")
+async def image_liveness_health():
+    """Feed image probe counters and the domains with the most dead links (blocked ones first)."""
+    return image_liveness.summary()
+
+@app.get("/health/image-dedup")
+async def image_dedup_health():
+    """Duplicate images collapsed by canonical URL / pHash, and hash cache counters."""
+    return image_deduper.summary()
+
+@app.get("/health/catalog-sync")
+async def catalog_sync_health():
+    """Supabase -> Meili shop catalog sync: watermarks, lag of the last change, counters."""
+    return catalog_sync.summary()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,17 +1,38 @@
 """AI Style Consultant API routes."""
+import asyncio
+import hashlib
+import json
 import logging
-from typing import List, Optional
-from fastapi import APIRouter, HTTPException
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, BackgroundTasks, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from app.services.gemini_consultant_service import GeminiConsultantService
+from app.config import settings
+from app.routes.sse import SSE_HEADERS, sse_event
+from app.services.chat_session_store import ChatSession, compact_session, session_store
+from app.services.gemini_consultant_service import EmptyAnswerError, gemini_service, is_outage
+from app.services.image_liveness import image_liveness
+from app.services.thumbnail_service import thumbnail_service
+from app.services.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/consultant", tags=["AI Consultant"])
 
-# Initialize Gemini service
-gemini_service = GeminiConsultantService()
+# Answers to first-turn questions: key -> (clean_answer, search_query)
+answer_cache = TTLCache(maxsize=settings.CONSULTANT_CACHE_SIZE, ttl=settings.CONSULTANT_CACHE_TTL)
+# Image lists for [SEARCH: ...] queries: query -> images
+image_cache = TTLCache(maxsize=settings.CONSULTANT_IMAGE_CACHE_SIZE, ttl=settings.CONSULTANT_IMAGE_CACHE_TTL)
+
+FALLBACK_MESSAGE = (
+    "Не могу обработать этот вопрос прямо сейчас. 😔\n\n"
+    "Попробуйте переформулировать или спросите что-то другое."
+)
+IMAGE_FALLBACK_MESSAGE = (
+    "Не могу проанализировать это изображение. 😔\n\n"
+    "Попробуйте другое фото или задайте вопрос текстом."
+)
 
 
 class WardrobeItem(BaseModel):
@@ -33,9 +54,11 @@ class MarketplaceItem(BaseModel):
 class ConsultantRequest(BaseModel):
     """AI Consultant request model."""
     question: str
-    context: dict
-    history: List[dict] = [] # Chat history
+    context: dict = {} # wardrobe/marketplace/gender; optional once a session exists
+    history: List[dict] = [] # Chat history (ignored when session_id is known)
     language: str = "ru" # Language code (ru, en, kk)
+    session_id: Optional[str] = None # Server-side chat session from a previous response
+    wardrobe_delta: Optional[dict] = None # {"add": [items], "remove": [ids]} for the session wardrobe
 
 
 class ProductRecommendation(BaseModel):
@@ -54,6 +77,7 @@ class ConsultantResponse(BaseModel):
     images: List[dict] = [] # Visual suggestions
     error: Optional[str] = None
     fallback: Optional[str] = None
+    session_id: Optional[str] = None # Send back to continue the conversation
 
 
 # Helper function for word extraction
@@ -66,6 +90,219 @@ def extract_words(text: str) -> set:
     return set(re.findall(r'\b\w+\b', text.lower()))
 
 
+def _answer_cache_key(question: str, language: str, gender: str, wardrobe: list) -> Optional[str]:
+    """
+    Cache key for a first-turn question: the question's words in order
+    (case, punctuation and spacing insensitive) + language + gender +
+    wardrobe hash. Word order stays: "black or navy" and "navy or black"
+    are different questions.
+    """
+    words = re.findall(r'\b\w+\b', question.lower()) if question else []
+    if not words:
+        return None
+    wardrobe_sig = json.dumps(
+        sorted((str(w.get('name', '')), str(w.get('category', ''))) for w in wardrobe[:15]),
+        ensure_ascii=False,
+    )
+    raw = "|".join([
+        " ".join(words),
+        language,
+        str(gender).lower(),
+        hashlib.sha1(wardrobe_sig.encode("utf-8")).hexdigest(),
+    ])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _is_first_turn(question: str, history: list) -> bool:
+    """True if the history carries nothing besides (possibly) the current question."""
+    return not any(m.get("text") and m.get("text") != question for m in history)
+
+
+async def _search_images(query: str) -> list:
+    """Image feed for a [SEARCH: ...] query, cached by query."""
+    images = image_cache.get(query)
+    if images is not None:
+        return images
+
+    from app.services.style_search_service import style_search_service
+    # Increase limit to 30 to provide a "feed-like" experience
+    images = await style_search_service.search_by_query(query, 30)
+    images = await image_liveness.filter(images, url_key="imageUrl")
+    thumbnail_service.with_thumbnails(images, url_key="imageUrl", thumb_key="thumbUrl")
+    if images:
+        image_cache.set(query, images)
+    return images
+
+
+def _resolve_session(
+    session_id: Optional[str],
+    context: dict,
+    history: list,
+    language: str,
+    wardrobe_delta: Optional[dict],
+) -> ChatSession:
+    """
+    Load the chat session, or start one seeded from the request if the id is
+    missing/expired. Context fields sent explicitly override the stored ones.
+    """
+    session = session_store.get(session_id)
+    if session is None:
+        if session_id:
+            logger.info(f"Chat session {session_id[:8]} not found, starting a new one")
+        session = session_store.create(context, history, language)
+    else:
+        if 'wardrobe' in context:
+            session.set_wardrobe(context['wardrobe'])
+        if 'marketplace' in context:
+            session.marketplace = context['marketplace']
+        if 'gender' in context:
+            session.gender = context['gender']
+        session.language = language
+
+    session.apply_wardrobe_delta(wardrobe_delta)
+    return session
+
+
+def _record_turn(session: ChatSession, question: str, answer: str, background_tasks: BackgroundTasks) -> None:
+    """Append the question/answer pair and schedule digest compaction if needed."""
+    last = session.history[-1] if session.history else None
+    if not (last and last.get("isUser") and last.get("text") == question):
+        session.append(question, is_user=True)
+    session.append(answer, is_user=False)
+
+    if session.needs_compaction():
+        background_tasks.add_task(compact_session, session, gemini_service.summarize_turns)
+
+
+SEARCH_TAG_RE = re.compile(r'\[SEARCH: (.*?)\]')
+SEARCH_TAG_PREFIX = "[SEARCH:"
+
+
+def split_search_tag(answer: str) -> Tuple[str, Optional[str]]:
+    """Return (answer without the [SEARCH: ...] tag, query or None)."""
+    search_match = SEARCH_TAG_RE.search(answer)
+    if not search_match:
+        return answer, None
+    return answer.replace(search_match.group(0), "").strip(), search_match.group(1)
+
+
+class SearchTagFilter:
+    """
+    Removes the [SEARCH: ...] tag from a streamed answer and exposes its
+    query as soon as the closing "]" arrives.
+
+    The prompt puts the tag on the first line, so `query` is usually known
+    after the first chunk or two and the image search can run while the
+    rest of the answer is generated. A tag at the end (older habit of the
+    model) still works. Text is released as soon as it cannot be part of
+    the tag.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._tag = None  # text from "[SEARCH:" while the tag is open
+        self._strip_leading = True  # drop the newline after a leading tag
+        self.query: Optional[str] = None
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        self._pending = ""
+        out = []
+
+        while text:
+            if self._tag is not None:
+                end = text.find("]")
+                if end == -1:
+                    self._tag += text
+                    break
+                _, query = split_search_tag(self._tag + text[:end + 1])
+                if self.query is None:
+                    self.query = query
+                self._tag = None
+                text = text[end + 1:]
+                continue
+
+            idx = text.find(SEARCH_TAG_PREFIX)
+            if idx != -1:
+                out.append(text[:idx])
+                self._tag = text[idx:idx + len(SEARCH_TAG_PREFIX)]
+                text = text[idx + len(SEARCH_TAG_PREFIX):]
+                continue
+
+            # Hold back a possible partial prefix ("[", "[SEA", ...) at the end
+            cut = text.rfind("[")
+            if cut != -1 and SEARCH_TAG_PREFIX.startswith(text[cut:]):
+                self._pending = text[cut:]
+                text = text[:cut]
+            out.append(text)
+            break
+
+        visible = "".join(out)
+        if self._strip_leading:
+            visible = visible.lstrip()
+            if visible:
+                self._strip_leading = False
+        return visible
+
+    def flush(self) -> str:
+        # An unterminated tag is not a tag: give the text back
+        rest = (self._tag or "") + self._pending
+        self._tag, self._pending = None, ""
+        return rest
+
+
+async def _answer_with_early_search(stream, fallback) -> Tuple[str, Optional[str], Optional[asyncio.Task]]:
+    """
+    Consume a streamed consultant answer and start the image search for its
+    [SEARCH: ...] query as soon as the tag is complete, so the lookup overlaps
+    with generation. `fallback()` is the non-streaming call, used when the
+    stream fails or ends without any answer text (not during an outage,
+    where a second call would only add load). Returns (clean_answer,
+    query, search_task); raises EmptyAnswerError if there is still no text.
+    """
+    tag_filter = SearchTagFilter()
+    search_task = None
+    parts = []
+    try:
+        async for chunk in stream:
+            parts.append(tag_filter.feed(chunk))
+            if search_task is None and tag_filter.query:
+                search_task = asyncio.create_task(_search_images(tag_filter.query))
+        parts.append(tag_filter.flush())
+        clean_answer, query = "".join(parts).strip(), tag_filter.query
+        if not clean_answer:
+            raise EmptyAnswerError("Empty answer from Gemini")
+    except Exception as e:
+        if is_outage(e):
+            if search_task is not None:
+                search_task.cancel()
+            raise
+        logger.warning(f"Gemini stream failed ({e}), retrying without streaming")
+        try:
+            clean_answer, query = split_search_tag(await fallback())
+            if not clean_answer:
+                raise EmptyAnswerError("Empty answer from Gemini")
+        except Exception:
+            if search_task is not None:
+                search_task.cancel()
+            raise
+
+    if search_task is None and query:
+        search_task = asyncio.create_task(_search_images(query))
+    return clean_answer, query, search_task
+
+
+async def _search_result(search_task: Optional[asyncio.Task]) -> list:
+    """Images from a search task started by `_answer_with_early_search` ([] on failure)."""
+    if search_task is None:
+        return []
+    try:
+        return await search_task
+    except Exception as e:
+        logger.error(f"Image search failed: {e}")
+        return []
+
+
 @router.get("/status")
 async def get_status():
     """Check AI consultant service status."""
@@ -74,12 +311,17 @@ async def get_status():
     return {
         "status": "configured" if is_configured else "not_configured",
         "message": "AI Consultant is ready" if is_configured else "Gemini API key not configured",
-        "service": "gemini-2.5-flash (REST API v1)"
+        "service": f"{settings.GEMINI_MODEL_FULL} / {settings.GEMINI_MODEL_LIGHT} (REST API v1beta)",
+        "models": gemini_service.router.summary(),
+        "prompt_cache": gemini_service.context_cache.summary(),
+        "answer_cache": answer_cache.stats(),
+        "image_cache": image_cache.stats(),
+        "sessions": session_store.stats(),
     }
 
 
 @router.post("/ask", response_model=ConsultantResponse)
-async def ask_consultant(request: ConsultantRequest):
+async def ask_consultant(request: ConsultantRequest, background_tasks: BackgroundTasks):
     """
     Ask the AI style consultant a question.
     
@@ -89,46 +331,66 @@ async def ask_consultant(request: ConsultantRequest):
     try:
         logger.info(f"Received consultant question: {request.question[:50]}...")
         
-        # Extract context
-        wardrobe = request.context.get('wardrobe', [])
-        marketplace = request.context.get('marketplace', [])
-        gender = request.context.get('gender', 'unknown') # Default to unknown if not provided
+        # Extract context (kept server-side in the chat session)
+        session = _resolve_session(
+            request.session_id, request.context, request.history, request.language, request.wardrobe_delta
+        )
+        wardrobe = session.wardrobe_items
+        marketplace = session.marketplace
+        gender = session.gender # Default to unknown if not provided
         
-        logger.info(f"Context: {len(wardrobe)} wardrobe items, {len(marketplace)} marketplace items, gender: {gender}")
+        logger.info(f"Context: {len(wardrobe)} wardrobe items, {len(marketplace)} marketplace items, gender: {gender}, session: {session.id[:8]}")
         
         # NOTE: Marketplace context and product recommendation logic REMOVED as per user request.
         # We now focus solely on AI advice.
+
+        # Repeated first-turn questions are served from cache
+        cache_key = None
+        if not session.digest and _is_first_turn(request.question, session.history):
+            cache_key = _answer_cache_key(request.question, request.language, gender, wardrobe)
+        cached = answer_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            clean_answer, query = cached
+            _record_turn(session, request.question, clean_answer, background_tasks)
+            images = []
+            if query:
+                try:
+                    images = await _search_images(query)
+                except Exception as e:
+                    logger.error(f"Image search failed: {e}")
+            logger.info("Consultant answer served from cache")
+            return ConsultantResponse(
+                success=True,
+                answer=clean_answer,
+                source="cache",
+                products=[],
+                images=images,
+                session_id=session.id
+            )
         
-        # Get answer from Gemini
-        answer = await gemini_service.ask(
+        # Get answer from Gemini; the image search starts as soon as the
+        # [SEARCH: ...] line arrives and runs while the answer is generated
+        chat_args = dict(
             question=request.question,
             wardrobe=wardrobe,
             marketplace=marketplace,
             gender=gender,
-            history=request.history,
-            language=request.language
+            history=session.history,
+            language=request.language,
+            digest=session.digest
         )
-        
-        # Parse [SEARCH: ...] tag
-        images = []
-        clean_answer = answer
-        
-        try:
-            import re
-            search_match = re.search(r'\[SEARCH: (.*?)\]', answer)
-            if search_match:
-                query = search_match.group(1)
-                # Remove tag from user-facing text
-                clean_answer = answer.replace(search_match.group(0), "").strip()
-                
-                # Execute search
-                from app.services.style_search_service import StyleSearchService
-                search_service = StyleSearchService()
-                # Increase limit to 30 to provide a "feed-like" experience
-                images = search_service.search_by_query(query, limit=30)
-                logger.info(f"Found {len(images)} images for query '{query}'")
-        except Exception as e:
-            logger.error(f"Image search failed: {e}")
+        clean_answer, query, search_task = await _answer_with_early_search(
+            gemini_service.ask_stream(**chat_args),
+            lambda: gemini_service.ask(**chat_args),
+        )
+
+        if cache_key and clean_answer:
+            answer_cache.set(cache_key, (clean_answer, query))
+        _record_turn(session, request.question, clean_answer, background_tasks)
+
+        images = await _search_result(search_task)
+        if query:
+            logger.info(f"Found {len(images)} images for query '{query}'")
 
         logger.info(f"AI Response: {clean_answer[:200]}...")
         
@@ -137,7 +399,8 @@ async def ask_consultant(request: ConsultantRequest):
             answer=clean_answer,
             source="gemini",
             products=[], # Legacy field
-            images=images # New field
+            images=images, # New field
+            session_id=session.id
         )
         
     except Exception as e:
@@ -147,22 +410,123 @@ async def ask_consultant(request: ConsultantRequest):
         return ConsultantResponse(
             success=False,
             error=str(e),
-            fallback=(
-                "Не могу обработать этот вопрос прямо сейчас. 😔\n\n"
-                "Попробуйте переформулировать или спросите что-то другое."
-            )
+            fallback=FALLBACK_MESSAGE,
         )
 
 
-import json
+@router.post("/ask/stream")
+async def ask_consultant_stream(request: ConsultantRequest):
+    """
+    Streaming variant of /ask (text/event-stream).
+
+    Events:
+    - `chunk`  {"text": "..."}            answer text, [SEARCH: ...] tag removed
+    - `images` {"query": ..., "images": [...]}  visual suggestions, sent once the
+      search finishes (usually before the answer does; exactly once)
+    - `done`   {"success": true, "source": ..., "session_id": ...}
+    - `error`  {"error": "...", "fallback": "..."}
+    """
+    logger.info(f"Received streaming consultant question: {request.question[:50]}...")
+
+    session = _resolve_session(
+        request.session_id, request.context, request.history, request.language, request.wardrobe_delta
+    )
+    wardrobe = session.wardrobe_items
+    marketplace = session.marketplace
+    gender = session.gender
+    background_tasks = BackgroundTasks()
+
+    cache_key = None
+    if not session.digest and _is_first_turn(request.question, session.history):
+        cache_key = _answer_cache_key(request.question, request.language, gender, wardrobe)
+
+    async def event_stream():
+        tag_filter = SearchTagFilter()
+        try:
+            cached = answer_cache.get(cache_key) if cache_key else None
+            if cached is not None:
+                clean_answer, query = cached
+                _record_turn(session, request.question, clean_answer, background_tasks)
+                yield sse_event("chunk", {"text": clean_answer})
+                images = []
+                if query:
+                    try:
+                        images = await _search_images(query)
+                    except Exception as e:
+                        logger.error(f"Image search failed: {e}")
+                yield sse_event("images", {"query": query, "images": images})
+                yield sse_event("done", {"success": True, "source": "cache", "session_id": session.id})
+                return
+
+            answer_parts = []
+            search_task = None
+            images_sent = False
+            async for chunk in gemini_service.ask_stream(
+                question=request.question,
+                wardrobe=wardrobe,
+                marketplace=marketplace,
+                gender=gender,
+                history=session.history,
+                language=request.language,
+                digest=session.digest
+            ):
+                visible = tag_filter.feed(chunk)
+                if visible:
+                    answer_parts.append(visible)
+                    yield sse_event("chunk", {"text": visible})
+                if search_task is None and tag_filter.query:
+                    # Image lookup runs while the rest of the answer streams
+                    search_task = asyncio.create_task(_search_images(tag_filter.query))
+                if search_task is not None and not images_sent and search_task.done():
+                    images_sent = True
+                    yield sse_event("images", {"query": tag_filter.query, "images": await _search_result(search_task)})
+
+            tail = tag_filter.flush()
+            if tail:
+                answer_parts.append(tail)
+                yield sse_event("chunk", {"text": tail})
+
+            clean_answer = "".join(answer_parts).strip()
+            if not clean_answer:
+                raise EmptyAnswerError("Empty answer from Gemini")
+            if cache_key and clean_answer:
+                answer_cache.set(cache_key, (clean_answer, tag_filter.query))
+            _record_turn(session, request.question, clean_answer, background_tasks)
+
+            if not images_sent:
+                images = await _search_result(search_task)
+                if tag_filter.query:
+                    logger.info(f"Found {len(images)} images for query '{tag_filter.query}'")
+                yield sse_event("images", {"query": tag_filter.query, "images": images})
+
+            yield sse_event("done", {"success": True, "source": "gemini", "session_id": session.id})
+
+        except Exception as e:
+            logger.error(f"Error in AI consultant (stream): {str(e)}")
+            yield sse_event("error", {
+                "error": str(e),
+                "fallback": FALLBACK_MESSAGE,
+            })
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+        background=background_tasks,
+    )
+
+
 from fastapi import UploadFile, File, Form
 
 @router.post("/ask_with_image", response_model=ConsultantResponse)
 async def ask_with_image_endpoint(
+    background_tasks: BackgroundTasks,
     question: str = Form(...),
-    context: str = Form(...), # JSON string
+    context: str = Form(default="{}"), # JSON string
     history: str = Form(default="[]"), # JSON string
     language: str = Form(default="ru"),
+    session_id: Optional[str] = Form(default=None),
+    wardrobe_delta: str = Form(default=""), # JSON string
     file: UploadFile = File(...)
 ):
     """
@@ -176,13 +540,15 @@ async def ask_with_image_endpoint(
         try:
             context_dict = json.loads(context)
             history_list = json.loads(history)
+            delta_dict = json.loads(wardrobe_delta) if wardrobe_delta else None
         except json.JSONDecodeError as e:
             raise HTTPException(status_code=400, detail=f"Invalid JSON in form data: {e}")
         
         # Extract context
-        wardrobe = context_dict.get('wardrobe', [])
-        marketplace = context_dict.get('marketplace', [])
-        gender = context_dict.get('gender', 'unknown')
+        session = _resolve_session(session_id, context_dict, history_list, language, delta_dict)
+        wardrobe = session.wardrobe_items
+        marketplace = session.marketplace
+        gender = session.gender
         
         logger.info(f"Context: {len(wardrobe)} wardrobe items, gender: {gender}, image: {file.filename}")
         
@@ -190,41 +556,33 @@ async def ask_with_image_endpoint(
         contents = await file.read()
         mime_type = file.content_type or "image/jpeg"
         
-        # Get answer from Gemini
-        answer = await gemini_service.ask_with_image(
+        # Get answer from Gemini (image search overlaps with generation, as in /ask)
+        chat_args = dict(
             question=question,
             image_data=contents,
             mime_type=mime_type,
             wardrobe=wardrobe,
             marketplace=marketplace,
             gender=gender,
-            history=history_list,
-            language=language
+            history=session.history,
+            language=language,
+            digest=session.digest
         )
-        
-        # Parse [SEARCH: ...] tag (Same logic as text-only)
-        images = []
-        clean_answer = answer
-        
-        try:
-            import re
-            search_match = re.search(r'\[SEARCH: (.*?)\]', answer)
-            if search_match:
-                query = search_match.group(1)
-                clean_answer = answer.replace(search_match.group(0), "").strip()
-                
-                from app.services.style_search_service import StyleSearchService
-                search_service = StyleSearchService()
-                images = search_service.search_by_query(query, limit=30)
-        except Exception as e:
-            logger.error(f"Image search failed: {e}")
+        clean_answer, query, search_task = await _answer_with_early_search(
+            gemini_service.ask_with_image_stream(**chat_args),
+            lambda: gemini_service.ask_with_image(**chat_args),
+        )
+        _record_turn(session, question, clean_answer, background_tasks)
+
+        images = await _search_result(search_task)
 
         return ConsultantResponse(
             success=True,
             answer=clean_answer,
             source="gemini",
             products=[],
-            images=images
+            images=images,
+            session_id=session.id
         )
         
     except Exception as e:
@@ -233,10 +591,7 @@ async def ask_with_image_endpoint(
         return ConsultantResponse(
             success=False,
             error=str(e),
-            fallback=(
-                "Не могу проанализировать это изображение. 😔\n\n"
-                "Попробуйте другое фото или задайте вопрос текстом."
-            )
+            fallback=IMAGE_FALLBACK_MESSAGE,
         )
 
 
@@ -46,6 +46,8 @@ async def edit(req: NanaBananaEditRequest):
             detail="user_image_url and clothing_image_url are required",
         )
 
+    nano_banana_service.check_available()
+
     # Deduct 2 credits if user_id provided
     new_balance = None
     if req.user_id:
@@ -79,6 +81,8 @@ async def video_tryon(req: NanaBananaEditRequest):
             detail="user_image_url and clothing_image_url are required",
         )
 
+    nano_banana_service.check_available(video=True)
+
     # Deduct 10 credits if user_id provided
     new_balance = None
     if req.user_id:
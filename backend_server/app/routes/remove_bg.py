@@ -1,6 +1,9 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException
-import httpx
+from fastapi.responses import Response
 from app.config import settings
+from app.services.fal_gateway import fal_run, fal_upload
+from app.services.image_fetcher import image_fetcher
+from app.services.resilience import UpstreamUnavailable
 
 router = APIRouter(prefix="/remove-bg", tags=["RemoveBG"])
 
@@ -12,9 +15,7 @@ async def remove_bg(file: UploadFile = File(...)):
     Использует fal-ai/birefnet (через fal_client), так как remove.bg требует отдельный ключ.
     """
     # Используем FAL_KEY из переменных окружения (он уже есть)
-    import fal_client
     import os
-    import requests
 
     if not os.getenv("FAL_KEY"):
          # Если ключа нет, попробуем вернуть файл как есть (fallback), 
@@ -24,10 +25,10 @@ async def remove_bg(file: UploadFile = File(...)):
     try:
         # 1. Загружаем файл во временное хранилище fal
         data = await file.read()
-        url = fal_client.upload(data, content_type=file.content_type or "image/jpeg")
+        url = await fal_upload(data, content_type=file.content_type or "image/jpeg")
 
         # 2. Обрабатываем через BiRefNet (SOTA background removal)
-        result = fal_client.run("fal-ai/birefnet", arguments={"image_url": url})
+        result = await fal_run("fal-ai/birefnet", arguments={"image_url": url})
         
         # Result format: {'image': {'url': '...', ...}}
         out_url = result.get("image", {}).get("url")
@@ -35,10 +36,11 @@ async def remove_bg(file: UploadFile = File(...)):
              raise Exception(f"No result url from BiRefNet: {result}")
 
         # 3. Скачиваем результат и отдаем байты
-        # (Frontend ждет bytes, не URL)
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(out_url)
-            return resp.content
+        # (Frontend ждет bytes, не URL). Результат одноразовый — без кэша.
+        content, mime_type = await image_fetcher.fetch(out_url, use_cache=False)
+        return Response(content=content, media_type=mime_type)
 
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"fal-ai/birefnet unavailable: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"fal-ai/birefnet error: {e}")
\ No newline at end of file
@@ -1,21 +1,39 @@
 from fastapi import APIRouter, Query, HTTPException
 from typing import List, Optional
-from app.services.style_search_service import StyleSearchService
+from app.services.style_search_service import style_search_service as search_service
+from app.services.image_liveness import image_liveness
+from app.services.style_feed_warmer import style_feed_warmer
+from app.services.thumbnail_service import thumbnail_service
 
 router = APIRouter(tags=["Styles"])
-search_service = StyleSearchService()
+
+@router.get("/styles/pools")
+async def style_pools():
+    """Prebuilt /styles/search pools: size and age per gender/category."""
+    return style_feed_warmer.summary()
+
 
 @router.get("/styles/search")
 async def search_styles(
     gender: str = Query(..., description="Gender (male/female)"),
     category: str = Query(..., description="Style category (e.g. Streetwear, Business)"),
-    limit: int = Query(20, description="Max results")
+    limit: int = Query(20, description="Max results"),
+    seed: Optional[int] = Query(None, description="Stable shuffle for paging through a prebuilt pool"),
+    page: int = Query(0, ge=0, description="Page within the `seed` shuffle"),
 ):
     """
     Search for inspiration styles in the internet.
+    Style tabs are served from prebuilt pools (random page per call); other categories are searched live.
     """
     try:
-        results = search_service.search_styles(gender, category, limit)
+        results = style_feed_warmer.page(gender, category, limit, seed=seed, page=page)
+        if results is not None:
+            # Pool is verified at build time: only drop links found dead since
+            results = await image_liveness.filter(results, url_key="imageUrl", wait=0)
+        else:
+            results = await search_service.search_styles(gender, category, limit)
+            results = await image_liveness.filter(results, url_key="imageUrl")
+        thumbnail_service.with_thumbnails(results, url_key="imageUrl", thumb_key="thumbUrl")
         return {"items": results}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
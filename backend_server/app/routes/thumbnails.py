@@ -0,0 +1,48 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response
+
+from app.config import settings
+from app.services.image_fetcher import ImageFetchError, UnsafeURLError
+from app.services.thumbnail_service import ThumbnailError, thumbnail_service
+
+router = APIRouter(tags=["Thumbnails"])
+
+
+@router.get("/thumb")
+async def get_thumbnail(
+    request: Request,
+    url: str = Query(..., description="External image URL"),
+    w: Optional[int] = Query(None, ge=1, description="Width; snapped to the nearest fixed width"),
+    sig: Optional[str] = Query(None, description="Signature from the search response; valid for every width"),
+):
+    """
+    WebP thumbnail of an external image, for feed tiles.
+    Thumbnails never change for a given url+width, so clients may cache them for good.
+    """
+    width = thumbnail_service.snap_width(w)
+    if not thumbnail_service.check_signature(url, sig):
+        raise HTTPException(status_code=403, detail="Invalid thumbnail signature")
+
+    etag = f'"{thumbnail_service.etag(url, width)}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.THUMB_MAX_AGE}, immutable",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        path = await thumbnail_service.get(url, width)
+    except (ThumbnailError, UnsafeURLError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ImageFetchError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+
+@router.get("/thumb/stats")
+async def thumbnail_stats():
+    return thumbnail_service.summary()
@@ -1,8 +1,17 @@
 from fastapi import APIRouter, File, UploadFile, HTTPException, Form
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
 from pydantic import BaseModel
+import asyncio
 import base64
+import json
+import logging
+from app.config import settings
+from app.routes.sse import SSE_HEADERS, sse_event
 from app.services.gemini_consultant_service import gemini_service
+from app.services.perceptual_cache import phash_cache
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["Visual Search"])
 
@@ -77,3 +86,92 @@ async def auto_tag_clothing(
         import traceback
         print(f"Auto-Tag Error: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/visual-search/auto-tag/batch")
+async def auto_tag_clothing_batch(
+    files: List[UploadFile] = File(default=[]),
+    images_b64: Optional[str] = Form(None), # JSON array of base64 strings
+    language: Optional[str] = Form('ru')
+):
+    """
+    Auto-tag many clothing items (wardrobe import).
+    Images are packed several per Gemini request and groups run with bounded
+    concurrency. Results stream back as server-sent events as groups finish:
+    - `item` {"index": i, "filename": ..., "tags": {...same as /auto-tag...}}
+      or, when the Gemini call for the item's group failed or the model
+      could not tag the item, {"index": i, "filename": ..., "error": "..."}
+    - `done` {"count": n, "tagged": ..., "failed": ...}
+    """
+    max_bytes = settings.AUTO_TAG_MAX_FILE_BYTES
+    items: List[tuple] = []  # (filename, b64)
+    for f in files:
+        content = await f.read(max_bytes + 1)
+        if len(content) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"{f.filename}: image larger than {max_bytes} bytes")
+        if content:
+            items.append((f.filename, base64.b64encode(content).decode('utf-8')))
+
+    if images_b64:
+        try:
+            raw_list = json.loads(images_b64)
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"images_b64 must be a JSON array: {e}")
+        if not isinstance(raw_list, list) or not all(isinstance(b64, str) for b64 in raw_list):
+            raise HTTPException(status_code=400, detail="images_b64 must be a JSON array of base64 strings")
+        for n, b64 in enumerate(raw_list):
+            if "," in b64:
+                b64 = b64.split(",")[1]
+            if len(b64) * 3 // 4 > max_bytes:
+                raise HTTPException(status_code=413, detail=f"images_b64[{n}]: image larger than {max_bytes} bytes")
+            if b64:
+                items.append((None, b64))
+
+    if not items:
+        raise HTTPException(status_code=400, detail="Images required")
+    if len(items) > settings.AUTO_TAG_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many images (max {settings.AUTO_TAG_BATCH_MAX_ITEMS})")
+
+    group_size = max(1, settings.AUTO_TAG_ITEMS_PER_REQUEST)
+    groups = [list(range(i, min(i + group_size, len(items)))) for i in range(0, len(items), group_size)]
+    semaphore = asyncio.Semaphore(settings.AUTO_TAG_CONCURRENCY)
+
+    async def run_group(indices: List[int]):
+        try:
+            async with semaphore:
+                results = await gemini_service.auto_tag_items([items[i][1] for i in indices], language=language)
+        except Exception as e:
+            logger.exception(f"Auto-Tag Batch Error for items {indices}")
+            return indices, None, str(e) or type(e).__name__
+        return indices, results, None
+
+    async def event_stream():
+        tasks = [asyncio.create_task(run_group(g)) for g in groups]
+        tagged = failed = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                indices, results, error = await finished
+                if error is not None:
+                    for i in indices:
+                        yield sse_event("item", {"index": i, "filename": items[i][0], "error": error})
+                    failed += len(indices)
+                    continue
+                for i, tags_data in zip(indices, results):
+                    if tags_data is None:
+                        yield sse_event("item", {"index": i, "filename": items[i][0], "error": "Item could not be tagged"})
+                        failed += 1
+                    else:
+                        yield sse_event("item", {"index": i, "filename": items[i][0], "tags": tags_data})
+                        tagged += 1
+            yield sse_event("done", {"count": len(items), "tagged": tagged, "failed": failed})
+        finally:
+            for t in tasks:
+                t.cancel()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/visual-search/cache/stats")
+async def visual_search_cache_stats():
+    """Perceptual-hash cache hit rate and Gemini latency saved, per endpoint/language."""
+    return phash_cache.summary()
@@ -0,0 +1,358 @@
+"""Incremental sync of shop products (Supabase bot_products / bot_product_sizes) into the Meilisearch index."""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from supabase import Client, create_client
+
+from app.config import settings
+from .meili import AsyncMeili, meili_async
+from .suggest_index import suggest_index
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+PRODUCTS = "bot_products"
+SIZES = "bot_product_sizes"
+DOC_PREFIX = "bot_"  # Meili ids of shop products, next to the seeded catalog ids
+_EPOCH = "1970-01-01T00:00:00+00:00"
+_IN_CHUNK = 100  # ids per `in` filter (they go into the URL)
+
+Cursor = Tuple[str, str]  # (updated_at, id) of the last row handled
+
+
+def document_id(product_id: str) -> str:
+    return f"{DOC_PREFIX}{product_id}"
+
+
+def product_document(product: Dict[str, Any], sizes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Meili document for an active product; `sizes` are its bot_product_sizes rows."""
+    store = (product.get("bot_stores") or {}).get("name") or ""
+    return {
+        "id": document_id(product["id"]),
+        "title": product.get("name") or "",
+        "description": product.get("description") or "",
+        "category": product.get("category") or "",
+        "price": float(product.get("price") or 0),
+        "currency": "KZT",
+        "sizes": [s["size"] for s in sizes if (s.get("quantity") or 0) > 0],
+        "image_url": product.get("photo_url") or "",
+        "store": store,
+        "store_id": product.get("store_id"),
+        "source": "bot",
+        "updated_at": product.get("updated_at"),
+    }
+
+
+def _parse_ts(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class CatalogSync:
+    """
+    Keeps the shop products in Meili within seconds of Supabase.
+
+    Every `interval` seconds rows of both tables with `updated_at` past the
+    table's watermark are read in keyset pages of `batch_size`; the
+    products they touch are re-read with their sizes and
+
+    - upserted when active and at least one size is in stock (`sizes`
+      lists only sizes with quantity > 0),
+    - deleted from the index when deactivated (`delete_product`), sold
+      out or gone.
+
+    Watermarks move only after Meili has applied the batch and are saved to
+    disk, so a restart continues where it stopped (an empty watermark means
+    a full initial load). Each cycle re-reads the last `overlap` seconds to
+    catch rows committed late with an older `updated_at`; rows already
+    handled at that version are skipped.
+
+    Hard deletes aren't visible through `updated_at`, so every
+    `reconcile_interval` the ids in Meili are compared with the sellable
+    ids in Supabase and both sides are fixed up.
+    """
+
+    def __init__(
+        self,
+        supabase_url: str,
+        supabase_key: str,
+        meili: AsyncMeili,
+        interval: float,
+        batch_size: int,
+        overlap: float,
+        reconcile_interval: float,
+        path: str,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled and bool(supabase_url and supabase_key)
+        self.supabase_url = supabase_url
+        self.supabase_key = supabase_key
+        self.meili = meili
+        self.interval = interval
+        self.batch_size = batch_size
+        self.overlap = overlap
+        self.reconcile_interval = reconcile_interval
+        self.path = Path(path) if path else None
+        self._db: Optional[Client] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watermarks: Dict[str, str] = {}
+        self._seen: Dict[Tuple[str, str], str] = {}  # (table, row id) -> updated_at already synced
+        self._reconciled_at = 0.0
+        self._last_error: Optional[str] = None
+
+        self.stats: Dict[str, Any] = {
+            "cycles": 0,
+            "rows_read": 0,
+            "upserted": 0,
+            "deleted": 0,
+            "reconciles": 0,
+            "reconcile_upserted": 0,
+            "reconcile_deleted": 0,
+            "errors": 0,
+            "last_lag_s": None,  # updated_at of the newest change -> applied in Meili
+        }
+
+    def _get_db(self) -> Client:
+        if self._db is None:
+            self._db = create_client(self.supabase_url, self.supabase_key)
+        return self._db
+
+    # --- persistence ---------------------------------------------------------
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            self._watermarks = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Catalog sync watermarks not loaded: {e}")
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._watermarks), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Catalog sync watermarks not saved: {e}")
+
+    # --- supabase (sync SDK, called via asyncio.to_thread) --------------------
+
+    def _changed_page(self, table: str, columns: str, cursor: Cursor) -> List[Dict[str, Any]]:
+        """Next `batch_size` rows after `cursor` in (updated_at, id) order."""
+        ts, row_id = cursor
+        query = self._get_db().from_(table).select(columns)
+        if row_id:
+            query = query.or_(f'updated_at.gt."{ts}",and(updated_at.eq."{ts}",id.gt.{row_id})')
+        else:
+            query = query.gt("updated_at", ts)
+        return query.order("updated_at").order("id").limit(self.batch_size).execute().data or []
+
+    def _load_products(self, ids: List[str]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, List[Dict[str, Any]]]]:
+        db = self._get_db()
+        products: Dict[str, Dict[str, Any]] = {}
+        sizes: Dict[str, List[Dict[str, Any]]] = {}
+        for i in range(0, len(ids), _IN_CHUNK):
+            chunk = ids[i:i + _IN_CHUNK]
+            for row in db.from_(PRODUCTS).select("*, bot_stores(name)").in_("id", chunk).execute().data or []:
+                products[row["id"]] = row
+            for row in db.from_(SIZES).select("product_id, size, quantity").in_("product_id", chunk).execute().data or []:
+                sizes.setdefault(row["product_id"], []).append(row)
+        return products, sizes
+
+    def _sellable_ids(self) -> Set[str]:
+        """Ids of active products with at least one size in stock."""
+        db = self._get_db()
+        active: Set[str] = set()
+        in_stock: Set[str] = set()
+        for table, column, target, filters in (
+            (PRODUCTS, "id", active, lambda q: q.eq("is_active", True)),
+            (SIZES, "product_id", in_stock, lambda q: q.gt("quantity", 0)),
+        ):
+            last = ""
+            while True:
+                query = filters(db.from_(table).select("id" if column == "id" else f"id, {column}")).order("id").limit(1000)
+                if last:
+                    query = query.gt("id", last)
+                rows = query.execute().data or []
+                target.update(r[column] for r in rows)
+                if len(rows) < 1000:
+                    break
+                last = rows[-1]["id"]
+        return active & in_stock
+
+    # --- meili ---------------------------------------------------------------
+
+    async def _apply(self, upserts: List[Dict[str, Any]], deletes: List[str]) -> None:
+        index = self.meili.index
+        tasks = []
+        if upserts:
+            task = await self.meili.request("POST", f"/indexes/{index}/documents", params={"primaryKey": "id"}, json=upserts)
+            tasks.append(task["taskUid"])
+        if deletes:
+            task = await self.meili.request("POST", f"/indexes/{index}/documents/delete-batch", json=deletes)
+            tasks.append(task["taskUid"])
+        for uid in tasks:
+            await self.meili.wait_task(uid)
+        suggest_index.apply(upserts, deletes)
+
+    async def _meili_ids(self) -> Set[str]:
+        ids: Set[str] = set()
+        offset = 0
+        while True:
+            page = await self.meili.request(
+                "GET", f"/indexes/{self.meili.index}/documents", params={"fields": "id", "limit": 1000, "offset": offset}
+            )
+            results = page.get("results") or []
+            ids.update(str(d["id"]) for d in results if str(d.get("id", "")).startswith(DOC_PREFIX))
+            offset += len(results)
+            if not results or offset >= page.get("total", 0):
+                return ids
+
+    # --- sync ----------------------------------------------------------------
+
+    async def push(self, product_ids: Iterable[str]) -> Tuple[int, int]:
+        """Re-read `product_ids` from Supabase and upsert/delete them in Meili."""
+        ids = sorted(set(product_ids))
+        if not ids:
+            return 0, 0
+        products, sizes = await asyncio.to_thread(self._load_products, ids)
+        upserts, deletes = [], []
+        for pid in ids:
+            product = products.get(pid)
+            doc = product_document(product, sizes.get(pid, [])) if product and product.get("is_active") else None
+            if doc and doc["sizes"]:
+                upserts.append(doc)
+            else:
+                deletes.append(document_id(pid))
+        await self._apply(upserts, deletes)
+        self.stats["upserted"] += len(upserts)
+        self.stats["deleted"] += len(deletes)
+        return len(upserts), len(deletes)
+
+    async def _sync_table(self, table: str) -> int:
+        columns = "id, updated_at" if table == PRODUCTS else "id, product_id, updated_at"
+        watermark = self._watermarks.get(table) or _EPOCH
+        since = (_parse_ts(watermark) - timedelta(seconds=self.overlap)).isoformat()
+        cursor: Cursor = (since, "")
+        changed = 0
+
+        while True:
+            rows = await asyncio.to_thread(self._changed_page, table, columns, cursor)
+            if not rows:
+                break
+            self.stats["rows_read"] += len(rows)
+            fresh = [r for r in rows if self._seen.get((table, r["id"])) != r["updated_at"]]
+            if fresh:
+                await self.push(r["id"] if table == PRODUCTS else r["product_id"] for r in fresh)
+                newest = max(_parse_ts(r["updated_at"]) for r in fresh)
+                self.stats["last_lag_s"] = round(time.time() - newest.timestamp(), 2)
+                for r in fresh:
+                    self._seen[(table, r["id"])] = r["updated_at"]
+                changed += len(fresh)
+
+            last = rows[-1]
+            cursor = (last["updated_at"], last["id"])
+            if _parse_ts(last["updated_at"]) > _parse_ts(watermark):
+                watermark = last["updated_at"]
+                self._watermarks[table] = watermark
+                await asyncio.to_thread(self._save)
+            if len(rows) < self.batch_size:
+                break
+
+        # Forget versions that fell out of the overlap window
+        horizon = _parse_ts(watermark) - timedelta(seconds=2 * self.overlap)
+        self._seen = {
+            k: v for k, v in self._seen.items() if k[0] != table or _parse_ts(v) >= horizon
+        }
+        return changed
+
+    async def reconcile(self) -> Tuple[int, int]:
+        """Full id comparison: index what's missing, drop what's no longer sellable."""
+        expected = await asyncio.to_thread(self._sellable_ids)
+        indexed = await self._meili_ids()
+        missing = [pid for pid in expected if document_id(pid) not in indexed]
+        extra = sorted(indexed - {document_id(pid) for pid in expected})
+
+        for i in range(0, len(missing), self.batch_size):
+            await self.push(missing[i:i + self.batch_size])
+        for i in range(0, len(extra), 1000):
+            await self._apply([], extra[i:i + 1000])
+
+        self.stats["reconciles"] += 1
+        self.stats["reconcile_upserted"] += len(missing)
+        self.stats["reconcile_deleted"] += len(extra)
+        self._reconciled_at = time.time()
+        if missing or extra:
+            logger.info(f"Catalog reconcile: {len(missing)} indexed, {len(extra)} removed")
+        return len(missing), len(extra)
+
+    async def sync_once(self) -> int:
+        changed = 0
+        for table in (PRODUCTS, SIZES):
+            changed += await self._sync_table(table)
+        self.stats["cycles"] += 1
+        return changed
+
+    async def _run(self) -> None:
+        self._load()
+        backoff = self.interval
+        while True:
+            try:
+                await self.sync_once()
+                if self.reconcile_interval and time.time() - self._reconciled_at > self.reconcile_interval:
+                    await self.reconcile()
+                self._last_error = None
+                backoff = self.interval
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                self._last_error = f"{type(e).__name__}: {e}"
+                logger.warning(f"Catalog sync failed: {self._last_error}")
+                backoff = min(backoff * 2, 60.0)
+            await asyncio.sleep(backoff)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "watermarks": dict(self._watermarks),
+            "reconciled_ago_s": round(time.time() - self._reconciled_at) if self._reconciled_at else None,
+            "last_error": self._last_error,
+        }
+
+
+catalog_sync = CatalogSync(
+    supabase_url=os.getenv("SUPABASE_URL", ""),
+    supabase_key=os.getenv("SUPABASE_SERVICE_ROLE_KEY", ""),
+    meili=meili_async,
+    interval=settings.CATALOG_SYNC_INTERVAL,
+    batch_size=settings.CATALOG_SYNC_BATCH,
+    overlap=settings.CATALOG_SYNC_OVERLAP,
+    reconcile_interval=settings.CATALOG_SYNC_RECONCILE_INTERVAL,
+    path=settings.CATALOG_SYNC_PATH,
+    enabled=settings.CATALOG_SYNC_ENABLED,
+)
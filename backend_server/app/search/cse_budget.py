@@ -0,0 +1,143 @@
+"""Google CSE quota budget: daily + per-minute token buckets with priority classes."""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict
+from zoneinfo import ZoneInfo
+
+# CSE daily quota resets at midnight Pacific time
+QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+
+INTERACTIVE = "interactive"  # a user is waiting: feeds, /search/*, consultant
+BACKGROUND = "background"    # warming, stale-while-revalidate refreshes
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+
+def quota_day() -> str:
+    return datetime.now(QUOTA_TZ).date().isoformat()
+
+
+def _seconds_to_quota_reset() -> float:
+    now = datetime.now(QUOTA_TZ)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+class CSEBudget:
+    """
+    Decides whether a CSE call may be made now.
+
+    - daily bucket: `daily_limit` calls per quota day; background calls stop
+      once only `background_reserve` (fraction) of the day is left, so
+      user-facing requests keep the rest
+    - minute bucket: refills at `per_minute` tokens/minute; interactive calls
+      wait up to `interactive_wait` seconds for a token, background calls
+      don't wait and stop at half the bucket
+    - `exhausted(...)`: Google said the quota is gone (429/403) — no calls
+      until the minute/day window resets, whatever the local count says
+
+    A denied call is the caller's cue to degrade (stale cache, DuckDuckGo).
+    """
+
+    def __init__(self, daily_limit: int, per_minute: int, background_reserve: float, interactive_wait: float):
+        self.daily_limit = daily_limit
+        self.per_minute = per_minute
+        self.background_reserve = background_reserve
+        self.interactive_wait = interactive_wait
+
+        self.day = quota_day()
+        self.used_today = 0
+        self._tokens = float(per_minute)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0  # monotonic
+        self._blocked_reason = ""
+
+        self.stats: Dict[str, Dict[str, int]] = {p: {"granted": 0, "denied": 0} for p in PRIORITIES}
+
+    # --- buckets -------------------------------------------------------------
+
+    def _roll_day(self) -> None:
+        today = quota_day()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(float(self.per_minute), self._tokens + (now - self._refilled_at) * self.per_minute / 60.0)
+        self._refilled_at = now
+
+    def remaining_today(self) -> int:
+        self._roll_day()
+        return max(0, self.daily_limit - self.used_today)
+
+    def _daily_floor(self, priority: str) -> int:
+        if priority == BACKGROUND:
+            return int(self.daily_limit * self.background_reserve)
+        return 0
+
+    def _minute_floor(self, priority: str) -> float:
+        return self.per_minute / 2 if priority == BACKGROUND else 0.0
+
+    def _denied(self, priority: str) -> bool:
+        self.stats[priority]["denied"] += 1
+        return False
+
+    # --- api -----------------------------------------------------------------
+
+    async def acquire(self, priority: str = INTERACTIVE) -> bool:
+        """Take one call from the budget; False means: don't call CSE now."""
+        if time.monotonic() < self._blocked_until:
+            return self._denied(priority)
+        if self.remaining_today() <= self._daily_floor(priority):
+            return self._denied(priority)
+
+        self._refill()
+        floor = self._minute_floor(priority)
+        if self._tokens - 1 < floor:
+            if priority == BACKGROUND:
+                return self._denied(priority)
+            wait = (1 - (self._tokens - floor)) * 60.0 / self.per_minute
+            if wait > self.interactive_wait:
+                return self._denied(priority)
+            await asyncio.sleep(wait)
+            self._refill()
+            if self._tokens - 1 < floor:
+                return self._denied(priority)
+
+        self._tokens -= 1
+        self.used_today += 1
+        self.stats[priority]["granted"] += 1
+        return True
+
+    def exhausted(self, daily: bool, reason: str) -> None:
+        """Google rejected a call for quota: stop until its window resets."""
+        window = _seconds_to_quota_reset() if daily else 60.0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + window)
+        self._blocked_reason = reason
+        if daily:
+            self.used_today = max(self.used_today, self.daily_limit)
+
+    def restore(self, day: str, used: int) -> None:
+        """Usage persisted by a previous process (same quota day only)."""
+        if day == quota_day():
+            self.day = day
+            self.used_today = max(self.used_today, used)
+
+    def summary(self) -> Dict[str, Any]:
+        self._refill()
+        blocked_for = max(0.0, self._blocked_until - time.monotonic())
+        remaining = self.remaining_today()
+        return {
+            "quota_day": self.day,
+            "daily_limit": self.daily_limit,
+            "used_today": self.used_today,
+            "remaining_today": remaining,
+            "remaining_for_background": max(0, remaining - self._daily_floor(BACKGROUND)),
+            "per_minute": self.per_minute,
+            "minute_tokens": round(self._tokens, 1),
+            "blocked_for_s": round(blocked_for),
+            "blocked_reason": self._blocked_reason if blocked_for else None,
+            "seconds_to_reset": round(_seconds_to_quota_reset()),
+            "priorities": self.stats,
+        }
@@ -0,0 +1,425 @@
+"""Shared Google CSE client: persistent response cache (memory + SQLite, stale-while-revalidate), quota budget, DuckDuckGo fallback."""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpx
+from duckduckgo_search import DDGS
+
+from app.config import settings
+from app.search.cse_budget import BACKGROUND, INTERACTIVE, CSEBudget
+from app.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CSE_URL = "https://www.googleapis.com/customsearch/v1"
+
+# Never part of the cache key (and never written to disk)
+_SECRET_PARAMS = {"key"}
+
+Entry = Tuple[float, Dict[str, Any]]  # (fetched_at, response json)
+
+
+class CSERequestError(Exception):
+    """CSE answered with an error (or could not be reached) and nothing cached could stand in."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Google CSE error: {status_code} {message}")
+        self.status_code = status_code
+        self.message = message
+
+    @property
+    def is_quota(self) -> bool:
+        text = self.message.lower()
+        return self.status_code == 429 or (
+            self.status_code == 403 and ("ratelimitexceeded" in text or "dailylimitexceeded" in text or "quota" in text)
+        )
+
+    @property
+    def is_daily_quota(self) -> bool:
+        text = self.message.lower()
+        return "dailylimitexceeded" in text or "per day" in text
+
+
+class CSEBudgetExceeded(CSERequestError):
+    """The local quota budget refused the call (see CSEBudget)."""
+
+    def __init__(self, priority: str):
+        super().__init__(429, f"CSE budget exhausted for {priority} calls")
+
+
+def _ddg_search(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    DuckDuckGo results in the shape of a CSE response (items / searchInformation /
+    queries.nextPage), so callers' parsing works unchanged. Blocking: run in a thread.
+    """
+    query = str(params.get("q") or "")
+    exclude = str(params.get("excludeTerms") or "").split()
+    if exclude:
+        query += " " + " ".join(f"-{term}" for term in exclude)
+    start = int(params.get("start") or 1)
+    num = int(params.get("num") or 10)
+    safesearch = "on" if params.get("safe") == "active" else "moderate"
+
+    items = []
+    with DDGS() as ddgs:
+        if params.get("searchType") == "image":
+            for r in ddgs.images(query, region="wt-wt", safesearch=safesearch, max_results=start - 1 + num):
+                items.append({
+                    "link": r.get("image"),
+                    "title": r.get("title"),
+                    "displayLink": urlparse(r.get("url") or "").netloc,
+                    "image": {
+                        "thumbnailLink": r.get("thumbnail"),
+                        "contextLink": r.get("url"),
+                        "width": r.get("width"),
+                        "height": r.get("height"),
+                    },
+                })
+        else:
+            for r in ddgs.text(query, region="wt-wt", safesearch=safesearch, max_results=start - 1 + num):
+                items.append({
+                    "title": r.get("title"),
+                    "link": r.get("href"),
+                    "snippet": r.get("body"),
+                    "displayLink": urlparse(r.get("href") or "").netloc,
+                })
+
+    page = items[start - 1:start - 1 + num]
+    data: Dict[str, Any] = {
+        "items": page,
+        "searchInformation": {"totalResults": str(len(items))},
+        "queries": {},
+        "degraded": "duckduckgo",
+    }
+    if len(page) == num:
+        data["queries"]["nextPage"] = [{"startIndex": start + num}]
+    return data
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """
+    Stable key for a CSE request: API key dropped, empty params dropped,
+    the rest sorted; `q` lower-cased with whitespace collapsed so
+    "Red  Dress" and "red dress" share one entry.
+    """
+    norm: Dict[str, str] = {}
+    for name, value in params.items():
+        if name in _SECRET_PARAMS or value is None or value == "":
+            continue
+        value = str(value).strip()
+        if name == "q":
+            value = " ".join(value.lower().split())
+        norm[name] = value
+    raw = json.dumps(norm, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class CSECache:
+    """
+    Every Google CSE call in the app goes through `get(params)`.
+
+    - fresh for `ttl`: served from memory, then from SQLite (survives restarts)
+    - stale for `stale_ttl` after that: served immediately while one
+      background request refreshes the entry
+    - older or missing: fetched inline; concurrent identical requests share
+      one upstream call
+    - upstream errors (quota exhausted, 5xx, timeouts) fall back to a stale
+      entry when there is one
+    - calls are metered by a CSEBudget: background refreshes only spend
+      the part of the quota user-facing requests don't need; a call the
+      budget refuses is served from a stale entry or, failing that, from
+      DuckDuckGo (`fallback=True`), marked with "degraded"
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        ttl: float,
+        stale_ttl: float,
+        memory_entries: int,
+        timeout: float,
+        budget: CSEBudget,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.budget = budget
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self._memory = TTLCache(maxsize=memory_entries, ttl=ttl + stale_ttl)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path = db_path
+
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "fresh_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "deduplicated": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "api_calls": 0,
+            "api_errors": 0,
+            "quota_errors": 0,
+            "served_stale_on_error": 0,
+            "budget_denied": 0,
+            "ddg_fallbacks": 0,
+        }
+        self._quota_loaded = False
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout, connect=5.0))
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    # --- disk tier -----------------------------------------------------------
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and self._db_path:
+            try:
+                Path(self._db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS cse_cache ("
+                    " key TEXT PRIMARY KEY, params TEXT NOT NULL,"
+                    " response TEXT NOT NULL, fetched_at REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS cse_cache_fetched_at ON cse_cache (fetched_at)")
+                self._db.execute("CREATE TABLE IF NOT EXISTS cse_quota (day TEXT PRIMARY KEY, used INTEGER NOT NULL)")
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"CSE cache disk tier disabled: {e}")
+                self._db_path = ""
+                self._db = None
+        return self._db
+
+    def _disk_read(self, key: str) -> Optional[Entry]:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT fetched_at, response FROM cse_cache WHERE key = ? AND fetched_at > ?",
+                (key, time.time() - self.ttl - self.stale_ttl),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def _disk_write(self, key: str, params: Dict[str, Any], entry: Entry) -> None:
+        public = {k: v for k, v in params.items() if k not in _SECRET_PARAMS}
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO cse_cache (key, params, response, fetched_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(public, ensure_ascii=False), json.dumps(entry[1], ensure_ascii=False), entry[0]),
+                )
+                db.execute("DELETE FROM cse_cache WHERE fetched_at < ?", (time.time() - self.ttl - self.stale_ttl,))
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"CSE cache write failed: {e}")
+
+    def _quota_read(self) -> Optional[Tuple[str, int]]:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return None
+            return db.execute("SELECT day, used FROM cse_quota ORDER BY day DESC LIMIT 1").fetchone()
+
+    def _quota_write(self, day: str, used: int) -> None:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute("INSERT OR REPLACE INTO cse_quota (day, used) VALUES (?, ?)", (day, used))
+                db.execute("DELETE FROM cse_quota WHERE day < ?", (day,))
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"CSE quota write failed: {e}")
+
+    async def _load_quota(self) -> None:
+        """Today's usage from before a restart, so the budget isn't reset by deploys."""
+        if self._quota_loaded:
+            return
+        self._quota_loaded = True
+        row = await asyncio.to_thread(self._quota_read)
+        if row is not None:
+            self.budget.restore(*row)
+
+    def _disk_count(self) -> int:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return 0
+            return db.execute("SELECT COUNT(*) FROM cse_cache").fetchone()[0]
+
+    # --- upstream ------------------------------------------------------------
+
+    async def _request(self, params: Dict[str, Any], priority: str) -> Dict[str, Any]:
+        await self._load_quota()
+        if not await self.budget.acquire(priority):
+            self.stats["budget_denied"] += 1
+            raise CSEBudgetExceeded(priority)
+        self.stats["api_calls"] += 1
+        await asyncio.to_thread(self._quota_write, self.budget.day, self.budget.used_today)
+
+        try:
+            r = await self._get_client().get(GOOGLE_CSE_URL, params=params)
+        except httpx.HTTPError as e:
+            self.stats["api_errors"] += 1
+            raise CSERequestError(0, f"{type(e).__name__}: {e}") from e
+
+        if r.status_code != 200:
+            self.stats["api_errors"] += 1
+            error = CSERequestError(r.status_code, r.text)
+            if error.is_quota:
+                self.stats["quota_errors"] += 1
+                self.budget.exhausted(daily=error.is_daily_quota, reason=f"HTTP {r.status_code}")
+                await asyncio.to_thread(self._quota_write, self.budget.day, self.budget.used_today)
+                logger.warning(f"Google CSE quota exhausted ({self.budget.used_today} calls today)")
+            raise error
+        return r.json()
+
+    async def _ddg_fallback(self, params: Dict[str, Any], error: CSERequestError) -> Dict[str, Any]:
+        try:
+            data = await asyncio.to_thread(_ddg_search, params)
+        except Exception as e:
+            logger.warning(f"DuckDuckGo fallback failed: {e}")
+            raise error
+        self.stats["ddg_fallbacks"] += 1
+        return data
+
+    async def _fetch(self, key: str, params: Dict[str, Any], priority: str) -> Entry:
+        data = await self._request(params, priority)
+        entry = (time.time(), data)
+        self._memory.set(key, entry)
+        await asyncio.to_thread(self._disk_write, key, params, entry)
+        return entry
+
+    def _start_fetch(self, key: str, params: Dict[str, Any], priority: str) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, params, priority))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.stats["deduplicated"] += 1
+        return task
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        # Mark the error as retrieved even if nobody awaited (background refresh)
+        if not task.cancelled():
+            task.exception()
+
+    def _refresh_in_background(self, key: str, params: Dict[str, Any]) -> None:
+        if key in self._inflight:
+            return
+        self.stats["refreshes"] += 1
+        task = self._start_fetch(key, params, BACKGROUND)
+        task.add_done_callback(self._log_refresh)
+
+    def _log_refresh(self, task: asyncio.Task) -> None:
+        if task.cancelled() or isinstance(task.exception(), CSEBudgetExceeded):
+            return
+        if task.exception() is not None:
+            self.stats["refresh_errors"] += 1
+            logger.warning(f"CSE background refresh failed: {task.exception()}")
+
+    # --- api -----------------------------------------------------------------
+
+    async def _lookup(self, key: str) -> Optional[Entry]:
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._disk_read, key)
+            if entry is not None:
+                self._memory.set(key, entry, ttl=max(1.0, entry[0] + self.ttl + self.stale_ttl - time.time()))
+        return entry
+
+    async def get(self, params: Dict[str, Any], priority: str = INTERACTIVE, fallback: bool = True) -> Dict[str, Any]:
+        """
+        CSE response json for `params` (the full request, API key included).
+
+        `priority` is INTERACTIVE when a user waits for the answer, BACKGROUND
+        otherwise. With `fallback=False` the caller gets CSERequestError
+        instead of DuckDuckGo results (e.g. when it already queries DDG itself).
+        """
+        if not self.enabled:
+            return await self._request(params, priority)
+
+        self.stats["requests"] += 1
+        key = cache_key(params)
+        entry = await self._lookup(key)
+
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age < self.ttl:
+                self.stats["fresh_hits"] += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._refresh_in_background(key, params)
+                return entry[1]
+
+        self.stats["misses"] += 1
+        try:
+            # shield: one cancelled caller must not abort the call for the others
+            return (await asyncio.shield(self._start_fetch(key, params, priority)))[1]
+        except CSERequestError as e:
+            if entry is not None:
+                self.stats["served_stale_on_error"] += 1
+                return entry[1]
+            if fallback and (isinstance(e, CSEBudgetExceeded) or e.is_quota):
+                return await self._ddg_fallback(params, e)
+            raise
+
+    async def summary(self) -> Dict[str, Any]:
+        lookups = self.stats["fresh_hits"] + self.stats["stale_hits"] + self.stats["misses"]
+        hits = self.stats["fresh_hits"] + self.stats["stale_hits"]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "api_calls_today": self.budget.used_today,
+            "inflight": len(self._inflight),
+            "memory_entries": len(self._memory),
+            "disk_entries": await asyncio.to_thread(self._disk_count),
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+        }
+
+
+cse_cache = CSECache(
+    db_path=settings.CSE_CACHE_PATH,
+    ttl=settings.CSE_CACHE_TTL,
+    stale_ttl=settings.CSE_CACHE_STALE_TTL,
+    memory_entries=settings.CSE_CACHE_MEMORY_ENTRIES,
+    timeout=settings.CSE_TIMEOUT,
+    budget=CSEBudget(
+        daily_limit=settings.CSE_DAILY_LIMIT,
+        per_minute=settings.CSE_PER_MINUTE,
+        background_reserve=settings.CSE_BACKGROUND_RESERVE,
+        interactive_wait=settings.CSE_INTERACTIVE_WAIT,
+    ),
+    enabled=settings.CSE_CACHE_ENABLED,
+)
@@ -4,7 +4,7 @@ import os
 from typing import Any, Dict, List, Optional
 
 from dotenv import load_dotenv
-import httpx
+from app.search.cse_cache import cse_cache, CSERequestError
 
 load_dotenv()
 
@@ -21,9 +21,6 @@ FASHION_SITES: List[str] = [d.strip() for d in FASHION_SITES_RAW.split(",") if d
 BLOCK_SITES_RAW = os.getenv("BLOCK_SITES", "") or ""
 BLOCK_SITES: List[str] = [d.strip() for d in BLOCK_SITES_RAW.split(",") if d.strip()]
 
-GOOGLE_CSE_URL = "https://www.googleapis.com/customsearch/v1"
-
-
 class GoogleCSEError(RuntimeError):
     pass
 
@@ -68,11 +65,10 @@ async def _call_cse(params: Dict[str, Any]) -> Dict[str, Any]:
             "Google CSE is not configured. Set GOOGLE_CSE_API_KEY and GOOGLE_CSE_CX in .env"
         )
 
-    async with httpx.AsyncClient(timeout=25) as client:
-        r = await client.get(GOOGLE_CSE_URL, params=params)
-        if r.status_code != 200:
-            raise GoogleCSEError(f"Google CSE error: {r.status_code} {r.text}")
-        return r.json()
+    try:
+        return await cse_cache.get(params)
+    except CSERequestError as e:
+        raise GoogleCSEError(str(e)) from e
 
 
 def _next_start(data: Dict[str, Any]) -> Optional[int]:
@@ -144,6 +140,7 @@ async def google_cse_search(q: str, start: int = 1, num: int = 10) -> Dict[str,
         "items": items_out,
         "next_start": ns,
         "has_more": ns is not None and len(data.get("items") or []) > 0,
+        "degraded": data.get("degraded"),
     }
 
 
@@ -233,4 +230,5 @@ async def google_cse_image_search(q: str, start: int = 1, num: int = 10) -> Dict
         "items": items,
         "next_start": ns,
         "has_more": ns is not None and len(raw_items) > 0,
+        "degraded": data.get("degraded"),
     }
\ No newline at end of file
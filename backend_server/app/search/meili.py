@@ -1,7 +1,13 @@
+import asyncio
 import os
+from typing import Any, Dict, Optional
+
 from dotenv import load_dotenv
+import httpx
 import meilisearch
 
+from app.config import settings
+
 MEILI_URL = os.getenv("MEILI_URL", "http://localhost:7700")
 MEILI_MASTER_KEY = os.getenv("MEILI_MASTER_KEY", "12345628")
 MEILI_INDEX = os.getenv("MEILI_INDEX", "products")
@@ -11,6 +17,77 @@ client = meilisearch.Client(MEILI_URL, MEILI_MASTER_KEY)
 def get_index():
     return client.index(MEILI_INDEX)
 
+
+class MeiliError(RuntimeError):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Meilisearch error: {status_code} {message}")
+        self.status_code = status_code
+
+
+class MeiliTaskError(RuntimeError):
+    """An enqueued task (documents, settings, index) failed or was canceled in Meili."""
+
+
+class AsyncMeili:
+    """
+    Async Meilisearch access over one pooled keep-alive client, so catalog
+    search doesn't block the event loop (the `meilisearch` SDK is sync-only).
+    """
+
+    def __init__(self, url: str, api_key: str, index: str, timeout: float):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.index = index
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            self._client = httpx.AsyncClient(
+                base_url=self.url,
+                headers=headers,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+                timeout=httpx.Timeout(self.timeout, connect=2.0),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> Any:
+        try:
+            r = await self._get_client().request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            raise MeiliError(0, f"{type(e).__name__}: {e}") from e
+        if r.status_code >= 400:
+            raise MeiliError(r.status_code, r.text)
+        return r.json() if r.content else None
+
+    async def wait_task(self, uid: int, poll_interval: float = 0.05, max_interval: float = 1.0) -> Dict[str, Any]:
+        """Poll /tasks/{uid} until Meili has processed it; MeiliTaskError if it didn't succeed."""
+        interval = poll_interval
+        while True:
+            task = await self.request("GET", f"/tasks/{uid}")
+            status = task.get("status")
+            if status == "succeeded":
+                return task
+            if status in ("failed", "canceled"):
+                error = (task.get("error") or {}).get("message") or status
+                raise MeiliTaskError(f"Meili task {uid} {status}: {error}")
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, max_interval)
+
+    async def search(self, query: str, params: Dict[str, Any], index: Optional[str] = None) -> Dict[str, Any]:
+        """Same params as `Index.search` in the sync SDK (limit, offset, filter, attributesToRetrieve, ...)."""
+        body = {"q": query, **{k: v for k, v in params.items() if v is not None}}
+        return await self.request("POST", f"/indexes/{index or self.index}/search", json=body)
+
+
+meili_async = AsyncMeili(MEILI_URL, MEILI_MASTER_KEY, MEILI_INDEX, timeout=settings.MEILI_TIMEOUT)
+
 def build_filter(filters: dict) -> str | None:
     parts = []
 
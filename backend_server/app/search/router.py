@@ -1,8 +1,14 @@
+import asyncio
 from fastapi import APIRouter, Query, HTTPException
-from typing import Optional, Any
+from typing import Optional, Any, Awaitable
 
-from .meili import get_index, build_filter
-from .style_map import detect_style, normalize_query
+from app.config import settings
+from .meili import meili_async, build_filter, MeiliError
+from .style_map import expand_query, normalize_query, taxonomy
+from .cse_cache import cse_cache
+from app.services.image_dedup import image_deduper
+from app.services.image_liveness import image_liveness
+from app.services.thumbnail_service import thumbnail_service
 
 # было:
 # from .internet_google_cse import google_cse_search, GoogleCSEError
@@ -16,7 +22,7 @@ from .internet_google_cse import (
 router = APIRouter(prefix="", tags=["search"])
 
 
-def catalog_search_sync(
+async def catalog_search(
     q: str,
     limit: int,
     offset: int,
@@ -28,11 +34,8 @@ def catalog_search_sync(
     price_max: Optional[float],
 ) -> dict[str, Any]:
     nq = normalize_query(q)
-    style_key, boosted_terms = detect_style(nq)
-
-    expanded_query = nq
-    if boosted_terms:
-        expanded_query = nq + " " + " ".join(boosted_terms)
+    styles, boosted_terms, expanded_query = expand_query(nq)
+    style_key = styles[0] if styles else None
 
     filters = {
         "gender": gender,
@@ -44,9 +47,7 @@ def catalog_search_sync(
     }
     meili_filter = build_filter(filters)
 
-    index = get_index()
-
-    res = index.search(
+    res = await meili_async.search(
         expanded_query,
         {
             "limit": limit,
@@ -77,13 +78,13 @@ def catalog_search_sync(
     total = res.get("estimatedTotalHits", len(hits))
 
     for item in hits:
-        item["_meta"] = {"detected_style": style_key, "expanded_query": expanded_query}
+        item["_meta"] = {"detected_style": style_key, "detected_styles": styles, "expanded_query": expanded_query}
 
     return {"source": "catalog", "q": nq, "total": total, "items": hits}
 
 
 @router.get("/search/catalog")
-def search_catalog(
+async def search_catalog(
     q: str = Query(..., min_length=1),
     limit: int = Query(20, ge=1, le=50),
     offset: int = Query(0, ge=0),
@@ -94,7 +95,10 @@ def search_catalog(
     price_min: Optional[float] = None,
     price_max: Optional[float] = None,
 ) -> dict[str, Any]:
-    return catalog_search_sync(q, limit, offset, gender, category, brand, color, price_min, price_max)
+    try:
+        return await catalog_search(q, limit, offset, gender, category, brand, color, price_min, price_max)
+    except MeiliError as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
 
 # ✅ НОВОЕ: именно “картинки”, как вкладка Images в CSE-сайте
@@ -106,9 +110,32 @@ async def search_images(
 ) -> dict[str, Any]:
     nq = normalize_query(q)
     try:
-        return await google_cse_image_search(nq, start=start, num=num)
+        res = await google_cse_image_search(nq, start=start, num=num)
     except GoogleCSEError as e:
         raise HTTPException(status_code=500, detail=str(e))
+    res["items"] = await image_deduper.dedupe(res["items"], url_key="image_url", thumb_key="thumbnail_url")
+    res["items"] = await image_liveness.filter(res["items"], url_key="image_url")
+    # thumbnail_url — превью Google (gstatic), thumb_url — наш WebP-прокси
+    thumbnail_service.with_thumbnails(res["items"], url_key="image_url", thumb_key="thumb_url")
+    return res
+
+
+@router.get("/search/cse/budget")
+async def cse_budget_status() -> dict[str, Any]:
+    """Remaining CSE quota (today / this minute), reserve for user-facing calls, grants and denials per priority."""
+    return cse_cache.budget.summary()
+
+
+@router.get("/search/cse/stats")
+async def cse_cache_stats() -> dict[str, Any]:
+    """Hit/miss/stale counters and today's CSE API calls (quota day is Pacific time)."""
+    return await cse_cache.summary()
+
+
+@router.get("/search/styles/stats")
+async def style_taxonomy_stats() -> dict[str, Any]:
+    """Size of the compiled style taxonomy and the expanded-query cache counters."""
+    return taxonomy.summary()
 
 
 # оставляем твой старый интернет-поиск (ссылки/страницы), вдруг нужен
@@ -141,12 +168,35 @@ async def search_both(
     start: int = Query(1, ge=1),
     num: int = Query(10, ge=1, le=10),
 ) -> dict[str, Any]:
-    catalog = catalog_search_sync(q, limit, offset, gender, category, brand, color, price_min, price_max)
+    nq = normalize_query(q)
 
-    try:
-        # можешь поменять на google_cse_image_search, если хочешь чтобы /search тоже был “картинками”
-        internet = await google_cse_search(normalize_query(q), start=start, num=num)
-    except GoogleCSEError as e:
-        internet = {"source": "internet", "q": q, "total": 0, "items": [], "error": str(e)}
+    # Обе ветки параллельно, у каждой свой дедлайн: медленный источник
+    # отдаёт пустой блок с ошибкой, а не держит весь ответ
+    catalog, internet = await asyncio.gather(
+        _branch(
+            "catalog",
+            nq,
+            catalog_search(q, limit, offset, gender, category, brand, color, price_min, price_max),
+            settings.SEARCH_CATALOG_DEADLINE,
+        ),
+        _branch(
+            "internet",
+            nq,
+            # можешь поменять на google_cse_image_search, если хочешь чтобы /search тоже был “картинками”
+            google_cse_search(nq, start=start, num=num),
+            settings.SEARCH_INTERNET_DEADLINE,
+        ),
+    )
+
+    return {"q": nq, "catalog": catalog, "internet": internet}
 
-    return {"q": normalize_query(q), "catalog": catalog, "internet": internet}
\ No newline at end of file
+
+async def _branch(source: str, q: str, coro: Awaitable[dict[str, Any]], deadline: float) -> dict[str, Any]:
+    """One /search branch under its own deadline; failures become an empty result with `error`."""
+    try:
+        return await asyncio.wait_for(coro, timeout=deadline)
+    except asyncio.TimeoutError:
+        error = f"{source} search timed out after {deadline:.1f}s"
+    except (GoogleCSEError, MeiliError) as e:
+        error = str(e)
+    return {"source": source, "q": q, "total": 0, "items": [], "error": error, "partial": True}
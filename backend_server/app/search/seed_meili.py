@@ -1,52 +1,357 @@
-import os
+"""
+Bulk (re)indexing of the catalog into Meilisearch.
+
+    python -m app.search.seed_meili                                   # sample_catalog.json
+    python -m app.search.seed_meili catalog.ndjson --batch-size 5000 --in-flight 4
+
+Input is a JSON array or NDJSON (one product per line, format is detected
+from the first character) and is read as a stream, so the catalog never
+has to fit in memory. Documents go out in batches; up to `--in-flight`
+batches are enqueued in Meili at once and each one is confirmed by its
+task uid (a failed task stops the run with Meili's error message).
+
+Progress is checkpointed next to the input file (`<input>.checkpoint`):
+after a failure, running the same command again skips the documents Meili
+has already accepted. `--restart` ignores the checkpoint.
+
+Index settings are compared with what the index already has and only the
+changed ones are sent, so a re-run doesn't trigger a full reindex.
+"""
+import argparse
+import asyncio
+import codecs
 import json
+import os
+import sys
+import time
 from pathlib import Path
-from .meili import client, MEILI_INDEX
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-def main():
-    # 1) индекс
-    try:
-        client.get_index(MEILI_INDEX)
-        print(f"Index '{MEILI_INDEX}' already exists")
-    except Exception:
-        client.create_index(MEILI_INDEX, {"primaryKey": "id"})
-        print(f"Created index '{MEILI_INDEX}'")
+from .meili import MEILI_INDEX, MEILI_MASTER_KEY, MEILI_URL, AsyncMeili, MeiliError, MeiliTaskError
 
-    index = client.index(MEILI_INDEX)
+SAMPLE_PATH = Path(__file__).resolve().parent / "sample_catalog.json"
 
-    # 2) какие поля ищем
-    index.update_searchable_attributes([
+INDEX_SETTINGS: Dict[str, Any] = {
+    # какие поля ищем
+    "searchableAttributes": [
         "title", "brand", "category", "gender", "color", "material",
-        "tags", "style_tags"
-    ])
+        "tags", "style_tags",
+    ],
+    # по чему фильтруем
+    "filterableAttributes": ["brand", "category", "gender", "color", "price", "style_tags"],
+    # сортировки
+    "sortableAttributes": ["price"],
+    # синонимы (минимум для старта)
+    "synonyms": {
+        "кроссы": ["кроссовки", "кеды", "sneakers"],
+        "кроссовки": ["sneakers"],
+        "худи": ["hoodie", "толстовка"],
+        "толстовка": ["hoodie", "sweatshirt"],
+        "пальто": ["coat", "overcoat"],
+        "coat": ["пальто"],
+        "куртка": ["jacket"],
+        "джинсы": ["jeans", "denim"],
+    },
+}
 
-    # 3) по чему фильтруем
-    index.update_filterable_attributes([
-        "brand", "category", "gender", "color", "price", "style_tags"
-    ])
+# Settings where Meili doesn't care about order
+_UNORDERED_SETTINGS = {"filterableAttributes", "sortableAttributes"}
 
-    # 4) сортировки
-    index.update_sortable_attributes(["price"])
+_CHUNK = 1 << 16
+
+
+class IndexingError(RuntimeError):
+    pass
+
+
+# --- input -------------------------------------------------------------------
+
+
+class DocumentReader:
+    """
+    Streams product dicts from a JSON array or NDJSON file.
+    `bytes_read` tracks how far into the file the reader is (for progress).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.size = path.stat().st_size
+        self.bytes_read = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with self.path.open("rb") as f:
+            head = f.read(_CHUNK)
+            self.bytes_read = len(head)
+            if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"["):
+                yield from self._iter_array(f, head)
+            else:
+                yield from self._iter_lines(f, head)
+
+    def _iter_lines(self, f, head: bytes) -> Iterator[Dict[str, Any]]:
+        pending = b""
+        chunk = head
+        lineno = 0
+        while chunk:
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                lineno += 1
+                if line.strip():
+                    yield self._object(json.loads(line), f"line {lineno}")
+            chunk = f.read(_CHUNK)
+            self.bytes_read += len(chunk)
+        if pending.strip():
+            yield self._object(json.loads(pending), f"line {lineno + 1}")
+
+    def _iter_array(self, f, head: bytes) -> Iterator[Dict[str, Any]]:
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+        buf = utf8.decode(head)
+        pos = buf.index("[") + 1
+        eof = False
+        count = 0
+
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf):
+                if buf[pos] != "{":
+                    raise IndexingError(f"{self.path}: item {count + 1} is not an object")
+                try:
+                    doc, pos = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # the object continues in the next chunk
+                    if eof:
+                        raise
+                else:
+                    count += 1
+                    yield doc
+                    continue
+            if eof:
+                raise IndexingError(f"{self.path}: unexpected end of JSON array")
+            chunk = f.read(_CHUNK)
+            self.bytes_read += len(chunk)
+            eof = not chunk
+            buf = buf[pos:] + utf8.decode(chunk, final=eof)
+            pos = 0
+
+    def _object(self, value: Any, where: str) -> Dict[str, Any]:
+        if not isinstance(value, dict):
+            raise IndexingError(f"{self.path}: {where} is not an object")
+        return value
+
+
+# --- checkpoint ----------------------------------------------------------------
+
+
+class Checkpoint:
+    """
+    Number of leading documents of `source` that Meili has accepted.
+    Tied to the file's size and mtime: a changed file starts from zero.
+    """
+
+    def __init__(self, path: Path, source: Path):
+        self.path = path
+        st = source.stat()
+        self.identity = {"source": str(source.resolve()), "size": st.st_size, "mtime": st.st_mtime}
+
+    def load(self) -> int:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return 0
+        if any(data.get(k) != v for k, v in self.identity.items()):
+            return 0
+        return int(data.get("done", 0))
+
+    def save(self, done: int) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({**self.identity, "done": done, "saved_at": time.time()}), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+# --- indexing ------------------------------------------------------------------
+
+
+def _comparable(key: str, value: Any) -> Any:
+    if key in _UNORDERED_SETTINGS:
+        return sorted(value or [])
+    if key == "synonyms":
+        return {k: sorted(v) for k, v in (value or {}).items()}
+    return value
+
+
+class BulkIndexer:
+    def __init__(self, meili: AsyncMeili, index: str, batch_size: int, in_flight: int, poll_interval: float = 0.05):
+        self.meili = meili
+        self.index = index
+        self.batch_size = batch_size
+        self.in_flight = in_flight
+        self.poll_interval = poll_interval
+
+    async def ensure_index(self, primary_key: str = "id") -> bool:
+        """Create the index if missing; True if it was created."""
+        try:
+            await self.meili.request("GET", f"/indexes/{self.index}")
+            return False
+        except MeiliError as e:
+            if e.status_code != 404:
+                raise
+        task = await self.meili.request("POST", "/indexes", json={"uid": self.index, "primaryKey": primary_key})
+        await self.meili.wait_task(task["taskUid"], poll_interval=self.poll_interval)
+        return True
+
+    async def apply_settings(self, wanted: Dict[str, Any]) -> List[str]:
+        """PATCH only the settings that differ from the index; returns the changed keys."""
+        current = await self.meili.request("GET", f"/indexes/{self.index}/settings") or {}
+        changed = {k: v for k, v in wanted.items() if _comparable(k, current.get(k)) != _comparable(k, v)}
+        if changed:
+            task = await self.meili.request("PATCH", f"/indexes/{self.index}/settings", json=changed)
+            await self.meili.wait_task(task["taskUid"], poll_interval=self.poll_interval)
+        return sorted(changed)
+
+    async def _send(self, batch: List[Dict[str, Any]]) -> int:
+        body = json.dumps(batch, ensure_ascii=False).encode("utf-8")
+        task = await self.meili.request(
+            "POST",
+            f"/indexes/{self.index}/documents",
+            params={"primaryKey": "id"},
+            content=body,
+            headers={"Content-Type": "application/json"},
+        )
+        return task["taskUid"]
+
+    @staticmethod
+    def _batches(docs: Iterator[Dict[str, Any]], size: int, skip: int) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        """(offset of the first document, batch), after skipping `skip` documents."""
+        offset = 0
+        batch: List[Dict[str, Any]] = []
+        for doc in docs:
+            if offset < skip:
+                offset += 1
+                continue
+            batch.append(doc)
+            if len(batch) >= size:
+                yield offset, batch
+                offset += len(batch)
+                batch = []
+        if batch:
+            yield offset, batch
+
+    async def index_documents(self, reader: DocumentReader, checkpoint: Optional[Checkpoint] = None) -> int:
+        """
+        Stream `reader` into the index. Batches are enqueued in order (Meili
+        applies tasks in enqueue order, so later duplicates of an id win);
+        the checkpoint only moves past a batch once every batch before it
+        has succeeded too.
+        """
+        skip = checkpoint.load() if checkpoint else 0
+        if skip:
+            print(f"Resuming after {skip} documents already indexed")
+
+        done = skip         # contiguous prefix confirmed by Meili
+        finished: Dict[int, int] = {}  # offset -> end of finished batches past `done`
+        slots = asyncio.Semaphore(self.in_flight)
+        pending: set = set()
+        failure: List[BaseException] = []
+        started = time.monotonic()
+
+        async def confirm(offset: int, batch_len: int, uid: int) -> None:
+            nonlocal done
+            try:
+                await self.meili.wait_task(uid, poll_interval=self.poll_interval)
+            except BaseException as e:
+                failure.append(IndexingError(f"documents {offset + 1}-{offset + batch_len}: {e}"))
+                return
+            finally:
+                slots.release()
+            finished[offset] = offset + batch_len
+            while done in finished:
+                done = finished.pop(done)
+            if checkpoint:
+                try:
+                    checkpoint.save(done)
+                except OSError as e:
+                    print(f"Checkpoint not saved: {e}", file=sys.stderr)
+            rate = (done - skip) / max(time.monotonic() - started, 1e-6)
+            percent = 100.0 * reader.bytes_read / reader.size if reader.size else 100.0
+            print(f"  {done} documents indexed  ({rate:.0f} docs/s, ~{min(percent, 100.0):.0f}% of input read)")
+
+        try:
+            for offset, batch in self._batches(iter(reader), self.batch_size, skip):
+                await slots.acquire()
+                if failure:
+                    slots.release()
+                    break
+                try:
+                    uid = await self._send(batch)
+                except BaseException:
+                    slots.release()
+                    raise
+                task = asyncio.create_task(confirm(offset, len(batch), uid))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        finally:
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if failure:
+            raise failure[0]
+        return done - skip
+
+
+async def run(args: argparse.Namespace) -> int:
+    source = Path(args.input)
+    meili = AsyncMeili(args.url, args.api_key, args.index, timeout=args.timeout)
+    indexer = BulkIndexer(meili, args.index, batch_size=args.batch_size, in_flight=args.in_flight)
+    checkpoint = Checkpoint(Path(f"{source}.checkpoint"), source)
+    if args.restart:
+        checkpoint.clear()
+
+    try:
+        if await indexer.ensure_index():
+            print(f"Created index '{args.index}'")
+        else:
+            print(f"Index '{args.index}' already exists")
+
+        if not args.skip_settings:
+            changed = await indexer.apply_settings(INDEX_SETTINGS)
+            print(f"Settings updated: {', '.join(changed)}" if changed else "Settings unchanged")
+
+        started = time.monotonic()
+        count = await indexer.index_documents(DocumentReader(source), checkpoint)
+        checkpoint.clear()
+        print(f"Done: {count} documents in {time.monotonic() - started:.1f}s")
+        return 0
+    except (IndexingError, MeiliError, MeiliTaskError, ValueError) as e:
+        print(f"Indexing stopped: {e}", file=sys.stderr)
+        print("Run the same command again to resume from the last confirmed batch.", file=sys.stderr)
+        return 1
+    finally:
+        await meili.aclose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", default=str(SAMPLE_PATH), help="JSON array or NDJSON file")
+    parser.add_argument("--index", default=MEILI_INDEX)
+    parser.add_argument("--url", default=MEILI_URL)
+    parser.add_argument("--api-key", default=MEILI_MASTER_KEY)
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per add-documents task")
+    parser.add_argument("--in-flight", type=int, default=4, help="batches enqueued in Meili at once")
+    parser.add_argument("--timeout", type=float, default=60.0, help="HTTP timeout per request, seconds")
+    parser.add_argument("--skip-settings", action="store_true", help="don't touch index settings")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and index from the start")
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.in_flight < 1:
+        parser.error("--batch-size and --in-flight must be positive")
+    sys.exit(asyncio.run(run(args)))
 
-    # 5) синонимы (минимум для старта)
-    index.update_synonyms({
-        "кроссы": ["кроссовки", "кеды", "sneakers"],
-    	"кроссовки": ["sneakers"],
-    	"худи": ["hoodie", "толстовка"],
-   	"толстовка": ["hoodie", "sweatshirt"],
-    	"пальто": ["coat", "overcoat"],
-    	"coat": ["пальто"],
-    	"куртка": ["jacket"],
-    	"джинсы": ["jeans", "denim"],
-    })
-
-    # 6) загрузка данных (положи свой json рядом, или замени на БД)
-    sample_path = Path(__file__).resolve().parent / "sample_catalog.json"
-    data = json.loads(sample_path.read_text(encoding="utf-8"))
-
-    task = index.add_documents(data)
-    print("Add documents task:", task)
-    print("Done.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,42 +1,181 @@
+import json
 import re
-from typing import Dict, List, Tuple
-
-STYLE_SYNONYMS = {
-    "old money": "old_money",
-    "олд мани": "old_money",
-    "тихая роскошь": "old_money",
-    "quiet luxury": "old_money",
-
-    "streetwear": "streetwear",
-    "стритвир": "streetwear",
-    "стрит": "streetwear",
-
-    "y2k": "y2k",
-    "гранж": "grunge",
-    "gorpcore": "gorpcore",
-}
-
-STYLE_TO_TAGS: Dict[str, List[str]] = {
-    "old_money": ["wool", "cashmere", "blazer", "trench", "loafers", "minimal", "neutral"],
-    "streetwear": ["hoodie", "sneakers", "oversize", "logo", "cargo", "denim"],
-    "y2k": ["low-rise", "baggy", "glossy", "cropped", "denim", "metallic"],
-    "grunge": ["flannel", "distressed", "boots", "dark", "oversize"],
-    "gorpcore": ["shell", "outdoor", "gore-tex", "hiking", "technical"],
-}
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from app.config import settings
+
 
 def normalize_query(q: str) -> str:
     q = q.strip().lower()
     q = re.sub(r"\s+", " ", q)
     return q
 
-def detect_style(q: str) -> Tuple[str | None, List[str]]:
-    nq = normalize_query(q)
 
-    style_key = None
-    for syn, key in STYLE_SYNONYMS.items():
-        if syn in nq:
-            style_key = key
-            break
+_FOLD_RE = re.compile(r"[\s\-_/]+")
+
+
+def fold(text: str) -> str:
+    """Matching form of queries and synonyms: lower case, ё -> е, hyphens/spaces collapsed."""
+    return _FOLD_RE.sub(" ", text.lower().replace("ё", "е")).strip()
+
+
+class StyleMatch(NamedTuple):
+    style: str
+    synonym: str
+    start: int
+
+
+class StyleTaxonomy:
+    """
+    Styles from a taxonomy file (`style_taxonomy.json`): every style has
+    multilingual synonyms and boost tags with weights.
+
+    All synonyms are compiled into one Aho-Corasick automaton, so a query
+    is scanned once whatever the size of the taxonomy. A synonym matches
+    at the start of a word and may continue into it ("гранж" finds
+    "гранжевый"); overlapping matches resolve to the leftmost-longest
+    ("smart casual" wins over "casual"). `expand()` results are cached.
+    """
+
+    def __init__(self, styles: Dict[str, Dict[str, Any]], max_boost_terms: int, cache_size: int):
+        self.max_boost_terms = max_boost_terms
+        self.synonyms: Dict[str, str] = {}              # synonym as written -> style
+        self.tags: Dict[str, List[Tuple[str, float]]] = {}  # style -> (tag, weight), heaviest first
+
+        patterns: Dict[str, Tuple[str, str]] = {}      # folded synonym -> (style, synonym)
+        for style, spec in styles.items():
+            synonyms = spec.get("synonyms") or []
+            if not synonyms:
+                raise ValueError(f"Style taxonomy: '{style}' has no synonyms")
+            for synonym in synonyms:
+                key = fold(synonym)
+                other = patterns.get(key, (style,))[0]
+                if other != style:
+                    raise ValueError(f"Style taxonomy: '{synonym}' is a synonym of both '{other}' and '{style}'")
+                patterns[key] = (style, synonym)
+                self.synonyms[synonym] = style
+            tags = spec.get("tags") or {}
+            self.tags[style] = sorted(((t, float(w)) for t, w in tags.items()), key=lambda tw: -tw[1])
+
+        self._patterns: List[Tuple[str, str, int]] = [(s, syn, len(key)) for key, (s, syn) in patterns.items()]
+        self._compile(list(patterns))
+        self.expand = lru_cache(maxsize=cache_size)(self._expand)
+
+    @classmethod
+    def load(cls, path: str, max_boost_terms: int, cache_size: int) -> "StyleTaxonomy":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(data["styles"], max_boost_terms, cache_size)
+
+    # --- automaton -----------------------------------------------------------
+
+    def _compile(self, keys: List[str]) -> None:
+        goto: List[Dict[str, int]] = [{}]
+        out: List[List[int]] = [[]]
+        for pid, key in enumerate(keys):
+            state = 0
+            for ch in key:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(pid)
 
-    boosted = STYLE_TO_TAGS.get(style_key, []) if style_key else []
-    return style_key, boosted
\ No newline at end of file
+        # Breadth-first failure links; outputs inherited along them
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue:
+            for ch, nxt in goto[state].items():
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                queue.append(nxt)
+
+        self._goto = goto
+        self._fail = fail
+        self._out = [tuple(o) for o in out]
+
+    def find(self, q: str) -> List[StyleMatch]:
+        """Every style mentioned in `q`, in order of appearance (one pass over the text)."""
+        text = fold(q)
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        hits: List[Tuple[int, int, int]] = []  # (start, -length, pattern)
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pid in out[state]:
+                start = i + 1 - patterns[pid][2]
+                if start == 0 or not text[start - 1].isalnum():
+                    hits.append((start, -patterns[pid][2], pid))
+
+        matches: List[StyleMatch] = []
+        seen = set()
+        covered = 0
+        for start, neg_len, pid in sorted(hits):
+            if start < covered:
+                continue
+            covered = start - neg_len
+            style, synonym, _ = patterns[pid]
+            if style not in seen:
+                seen.add(style)
+                matches.append(StyleMatch(style, synonym, start))
+        return matches
+
+    # --- query expansion -----------------------------------------------------
+
+    def _expand(self, nq: str) -> Tuple[Tuple[str, ...], Tuple[str, ...], str]:
+        styles = tuple(m.style for m in self.find(nq))
+        if not styles:
+            return (), (), nq
+
+        # A tag shared by several detected styles adds up its weights
+        scores: Dict[str, float] = {}
+        for style in styles:
+            for tag, weight in self.tags.get(style, []):
+                scores[tag] = scores.get(tag, 0.0) + weight
+        words = set(nq.split())
+        ranked = sorted((t for t in scores if t not in words), key=lambda t: -scores[t])
+        boosted = tuple(ranked[:self.max_boost_terms])
+        expanded = f"{nq} {' '.join(boosted)}" if boosted else nq
+        return styles, boosted, expanded
+
+    def summary(self) -> Dict[str, Any]:
+        info = self.expand.cache_info()
+        return {
+            "styles": len(self.tags),
+            "synonyms": len(self._patterns),
+            "automaton_states": len(self._goto),
+            "cache_hits": info.hits,
+            "cache_misses": info.misses,
+            "cache_size": info.currsize,
+        }
+
+
+taxonomy = StyleTaxonomy.load(
+    settings.STYLE_TAXONOMY_PATH,
+    max_boost_terms=settings.STYLE_BOOST_TERMS,
+    cache_size=settings.STYLE_QUERY_CACHE_SIZE,
+)
+
+# Kept for callers that only need the flat maps (e.g. /suggest)
+STYLE_SYNONYMS: Dict[str, str] = taxonomy.synonyms
+STYLE_TO_TAGS: Dict[str, List[str]] = {style: [t for t, _ in tags] for style, tags in taxonomy.tags.items()}
+
+
+def expand_query(nq: str) -> Tuple[List[str], List[str], str]:
+    """(detected styles, boost terms, expanded query) for a normalized query."""
+    styles, boosted, expanded = taxonomy.expand(nq)
+    return list(styles), list(boosted), expanded
+
+
+def detect_style(q: str) -> Tuple[str | None, List[str]]:
+    styles, boosted, _ = expand_query(normalize_query(q))
+    return (styles[0] if styles else None), boosted
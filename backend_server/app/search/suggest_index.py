@@ -0,0 +1,390 @@
+"""In-process prefix index for /suggest: catalog titles, brands, categories and style synonyms."""
+import asyncio
+import bisect
+import logging
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.config import settings
+from .meili import AsyncMeili, meili_async
+from .style_map import STYLE_SYNONYMS, normalize_query
+
+logger = logging.getLogger(__name__)
+
+PRODUCT, BRAND, CATEGORY, STYLE = "product", "brand", "category", "style"
+# Among facets matching the same way: styles, then categories, then brands
+_KIND_RANK = {STYLE: 0, CATEGORY: 1, BRAND: 2}
+_FIELDS = "id,title,brand,category"
+
+
+def normalize_prefix(text: str) -> str:
+    return normalize_query(text).replace("ё", "е")
+
+
+class _SortedKeys:
+    """Sorted `keys` with a parallel `refs` list; a prefix is one contiguous slice."""
+
+    __slots__ = ("keys", "refs")
+
+    def __init__(self, pairs: Optional[List[Tuple[str, int]]] = None):
+        pairs = sorted(pairs or [])
+        self.keys: List[str] = [k for k, _ in pairs]
+        self.refs: List[int] = [r for _, r in pairs]
+
+    def insert(self, key: str, ref: int) -> None:
+        pos = bisect.bisect_right(self.keys, key)
+        self.keys.insert(pos, key)
+        self.refs.insert(pos, ref)
+
+    def remove(self, key: str, ref: int) -> None:
+        pos = bisect.bisect_left(self.keys, key)
+        while pos < len(self.keys) and self.keys[pos] == key:
+            if self.refs[pos] == ref:
+                del self.keys[pos]
+                del self.refs[pos]
+                return
+            pos += 1
+
+    def prefixed(self, prefix: str) -> Iterator[int]:
+        """Refs of keys starting with `prefix`, in key order (shorter completions first)."""
+        pos = bisect.bisect_left(self.keys, prefix)
+        keys, refs = self.keys, self.refs
+        while pos < len(keys) and keys[pos].startswith(prefix):
+            yield refs[pos]
+            pos += 1
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class SuggestIndex:
+    """
+    Normalized keys in sorted arrays, searched with `bisect`.
+
+    - facets: brands and categories (weighted by product count) and style
+      synonyms, few enough to rank every match
+    - product titles: one array for title starts, one for the starts of
+      the next `title_words` words ("шерст" finds "Пальто шерстяное")
+
+    A lookup ranks the matching facets and then walks the product slices
+    only until `limit` distinct titles are found, so its cost doesn't grow
+    with the catalog (title starts before word matches, shorter titles
+    first).
+
+    The index is built from every document in Meili, and rebuilt when the
+    index's `updatedAt` changes (at most every `rebuild_interval`).
+    Between rebuilds, `apply()` (called by catalog_sync) patches single
+    documents in place. `lookup()` returns None when the index can't
+    answer (not built yet, prefix longer than `max_prefix`, or no match,
+    usually a typo); the caller then asks Meili.
+    """
+
+    def __init__(
+        self,
+        meili: AsyncMeili,
+        check_interval: float,
+        rebuild_interval: float,
+        max_prefix: int,
+        title_words: int,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.meili = meili
+        self.check_interval = check_interval
+        self.rebuild_interval = rebuild_interval
+        self.max_prefix = max_prefix
+        self.title_words = title_words
+
+        self._items: List[Optional[Dict[str, Any]]] = []
+        self._facets = _SortedKeys()
+        self._title_starts = _SortedKeys()
+        self._title_words = _SortedKeys()
+        self._doc_items: Dict[str, int] = {}                 # doc id -> item
+        self._facet_items: Dict[Tuple[str, str], int] = {}   # (kind, normalized value) -> item
+        self._ready = False
+        self._built_at = 0.0
+        self._index_updated_at: Optional[str] = None
+        self._replay: Optional[List[Tuple[List[Dict[str, Any]], List[str]]]] = None  # changes during a rebuild
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats: Dict[str, int] = {
+            "lookups": 0,
+            "index_answers": 0,
+            "fallbacks": 0,
+            "rebuilds": 0,
+            "rebuild_errors": 0,
+            "incremental_upserts": 0,
+            "incremental_deletes": 0,
+        }
+
+    # --- entries -------------------------------------------------------------
+
+    def _entry_keys(self, norm: str) -> List[Tuple[str, int]]:
+        """(key, from_word) pairs: the whole text, then suffixes at the next words."""
+        keys = [(norm[:self.max_prefix], 0)]
+        start = 0
+        for _ in range(self.title_words):
+            start = norm.find(" ", start) + 1
+            if start == 0:
+                break
+            if len(norm) - start >= 2:
+                keys.append((norm[start:start + self.max_prefix], 1))
+        return keys
+
+    def _placements(self, idx: int) -> Iterator[Tuple[_SortedKeys, str, int]]:
+        item = self._items[idx]
+        for key, from_word in self._entry_keys(item["norm"]):
+            if item["kind"] != PRODUCT:
+                yield self._facets, key, idx << 1 | from_word
+            else:
+                yield (self._title_words if from_word else self._title_starts), key, idx
+
+    def _new_item(self, item: Dict[str, Any]) -> int:
+        self._items.append(item)
+        return len(self._items) - 1
+
+    def _insert(self, idx: int) -> None:
+        for array, key, ref in self._placements(idx):
+            array.insert(key, ref)
+
+    def _remove(self, idx: int) -> None:
+        for array, key, ref in self._placements(idx):
+            array.remove(key, ref)
+        self._items[idx] = None
+
+    def _facet(self, kind: str, value: Any, delta: int, incremental: bool) -> None:
+        value = str(value or "").strip()
+        norm = normalize_prefix(value)
+        if not norm:
+            return
+        idx = self._facet_items.get((kind, norm))
+        if idx is None:
+            if delta <= 0:
+                return
+            idx = self._new_item({"kind": kind, "title": value, "norm": norm, "weight": 0, kind: value})
+            self._facet_items[(kind, norm)] = idx
+            if incremental:
+                self._insert(idx)
+        item = self._items[idx]
+        item["weight"] += delta
+        if item["weight"] <= 0 and incremental:
+            self._remove(idx)
+            del self._facet_items[(kind, norm)]
+
+    def _add_doc(self, doc: Dict[str, Any], incremental: bool) -> None:
+        doc_id = str(doc.get("id") or "")
+        title = (doc.get("title") or "").strip()
+        if not doc_id or not title:
+            return
+        idx = self._new_item({
+            "kind": PRODUCT,
+            "id": doc.get("id"),
+            "title": title,
+            "brand": doc.get("brand"),
+            "category": doc.get("category"),
+            "norm": normalize_prefix(title),
+        })
+        self._doc_items[doc_id] = idx
+        if incremental:
+            self._insert(idx)
+        self._facet(BRAND, doc.get("brand"), 1, incremental)
+        self._facet(CATEGORY, doc.get("category"), 1, incremental)
+
+    def _drop_doc(self, doc_id: str) -> None:
+        idx = self._doc_items.pop(doc_id, None)
+        if idx is None:
+            return
+        item = self._items[idx]
+        self._remove(idx)
+        self._facet(BRAND, item.get("brand"), -1, True)
+        self._facet(CATEGORY, item.get("category"), -1, True)
+
+    # --- build ---------------------------------------------------------------
+
+    def _build(self, docs: List[Dict[str, Any]]) -> "SuggestIndex":
+        """A fresh index over `docs` + style synonyms (runs in a worker thread)."""
+        fresh = SuggestIndex(self.meili, 0, 0, self.max_prefix, self.title_words, enabled=False)
+        for doc in docs:
+            fresh._add_doc(doc, incremental=False)
+        seen_styles = set()
+        for synonym, style in STYLE_SYNONYMS.items():
+            norm = normalize_prefix(synonym)
+            if norm not in seen_styles:
+                seen_styles.add(norm)
+                fresh._new_item({"kind": STYLE, "title": synonym, "norm": norm, "weight": 1, STYLE: style})
+
+        # One sort per array instead of an insort per key
+        pairs: Dict[int, List[Tuple[str, int]]] = {}
+        for idx in range(len(fresh._items)):
+            for array, key, ref in fresh._placements(idx):
+                pairs.setdefault(id(array), []).append((key, ref))
+        fresh._facets, fresh._title_starts, fresh._title_words = (
+            _SortedKeys(pairs.get(id(array)))
+            for array in (fresh._facets, fresh._title_starts, fresh._title_words)
+        )
+        return fresh
+
+    def _swap(self, fresh: "SuggestIndex") -> None:
+        # on the event loop, so lookups never see arrays and items from different builds
+        self._items = fresh._items
+        self._facets = fresh._facets
+        self._title_starts = fresh._title_starts
+        self._title_words = fresh._title_words
+        self._doc_items = fresh._doc_items
+        self._facet_items = fresh._facet_items
+        self._ready = True
+
+    async def _fetch_documents(self) -> List[Dict[str, Any]]:
+        docs: List[Dict[str, Any]] = []
+        while True:
+            page = await self.meili.request(
+                "GET",
+                f"/indexes/{self.meili.index}/documents",
+                params={"fields": _FIELDS, "limit": 1000, "offset": len(docs)},
+            )
+            results = page.get("results") or []
+            docs.extend(results)
+            if not results or len(docs) >= page.get("total", 0):
+                return docs
+
+    async def rebuild(self) -> int:
+        started = time.monotonic()
+        self._replay = []
+        try:
+            docs = await self._fetch_documents()
+            self._swap(await asyncio.to_thread(self._build, docs))
+            # catalog_sync changes that landed while the documents were being read
+            for upserts, deletes in self._replay:
+                self._apply(upserts, deletes)
+        finally:
+            self._replay = None
+        self._built_at = time.time()
+        self.stats["rebuilds"] += 1
+        logger.info(f"Suggest index: {len(docs)} documents in {time.monotonic() - started:.2f}s")
+        return len(docs)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                info = await self.meili.request("GET", f"/indexes/{self.meili.index}") or {}
+                updated_at = info.get("updatedAt")
+                due = not self._ready or time.time() - self._built_at >= self.rebuild_interval
+                if due and updated_at != self._index_updated_at:
+                    await self.rebuild()
+                    self._index_updated_at = updated_at
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["rebuild_errors"] += 1
+                logger.warning(f"Suggest index refresh failed: {e}")
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    # --- incremental updates -------------------------------------------------
+
+    def _apply(self, upserts: Iterable[Dict[str, Any]], deletes: Iterable[str]) -> None:
+        for doc_id in deletes:
+            self._drop_doc(str(doc_id))
+        for doc in upserts:
+            self._drop_doc(str(doc.get("id") or ""))
+            self._add_doc(doc, incremental=True)
+
+    def apply(self, upserts: List[Dict[str, Any]], deletes: List[str]) -> None:
+        """Documents just written to / deleted from Meili (at least id/title/brand/category)."""
+        if not self._ready:
+            return
+        if self._replay is not None:
+            self._replay.append((upserts, deletes))
+        self._apply(upserts, deletes)
+        self.stats["incremental_upserts"] += len(upserts)
+        self.stats["incremental_deletes"] += len(deletes)
+
+    # --- lookup --------------------------------------------------------------
+
+    def lookup(self, q: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """Suggestions for prefix `q`, or None when Meili should answer instead."""
+        self.stats["lookups"] += 1
+        prefix = normalize_prefix(q)
+        if not self._ready or not prefix or len(prefix) > self.max_prefix:
+            self.stats["fallbacks"] += 1
+            return None
+
+        # facet item -> 0 if the prefix matches its start, 1 if only a later word
+        matched: Dict[int, int] = {}
+        for ref in self._facets.prefixed(prefix):
+            idx, from_word = ref >> 1, ref & 1
+            if matched.get(idx, 2) > from_word:
+                matched[idx] = from_word
+
+        def rank(entry: Tuple[int, int]) -> Tuple[int, int, int, int]:
+            item = self._items[entry[0]]
+            return entry[1], _KIND_RANK[item["kind"]], -item["weight"], len(item["title"])
+
+        facets = [self._items[idx] for idx, _ in sorted(matched.items(), key=rank)]
+        # Facets take at most half the list while products keep matching
+        head = facets[:max(1, limit // 2)]
+
+        products: List[Dict[str, Any]] = []
+        seen = set()
+        wanted = limit - len(head)
+        for array in (self._title_starts, self._title_words):
+            for idx in array.prefixed(prefix):
+                if len(products) >= wanted:
+                    break
+                item = self._items[idx]
+                title = item["title"].lower()
+                if title not in seen:
+                    seen.add(title)
+                    products.append(item)
+
+        ordered = head + products + facets[len(head):]
+        if not ordered:
+            self.stats["fallbacks"] += 1
+            return None
+        self.stats["index_answers"] += 1
+        return [self._suggestion(item) for item in ordered[:limit]]
+
+    @staticmethod
+    def _suggestion(item: Dict[str, Any]) -> Dict[str, Any]:
+        suggestion = {
+            "id": item.get("id"),
+            "title": item["title"],
+            "brand": item.get("brand"),
+            "category": item.get("category"),
+            "type": item["kind"],
+        }
+        if item["kind"] == STYLE:
+            suggestion["style"] = item[STYLE]
+        return suggestion
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "ready": self._ready,
+            "documents": len(self._doc_items),
+            "facets": len(self._facet_items),
+            "keys": len(self._facets) + len(self._title_starts) + len(self._title_words),
+            "built_ago_s": round(time.time() - self._built_at) if self._built_at else None,
+        }
+
+
+suggest_index = SuggestIndex(
+    meili=meili_async,
+    check_interval=settings.SUGGEST_INDEX_CHECK_INTERVAL,
+    rebuild_interval=settings.SUGGEST_INDEX_REBUILD_INTERVAL,
+    max_prefix=settings.SUGGEST_INDEX_MAX_PREFIX,
+    title_words=settings.SUGGEST_INDEX_TITLE_WORDS,
+    enabled=settings.SUGGEST_INDEX_ENABLED,
+)
@@ -1,17 +1,22 @@
 from fastapi import APIRouter, Query
 from typing import Any
-from .meili import get_index
+from .meili import meili_async
 from .style_map import normalize_query
+from .suggest_index import suggest_index
 
 router = APIRouter(tags=["search"])
 
 @router.get("/suggest")
-def suggest(q: str = Query(..., min_length=1), limit: int = Query(8, ge=1, le=20)) -> dict[str, Any]:
+async def suggest(q: str = Query(..., min_length=1), limit: int = Query(8, ge=1, le=20)) -> dict[str, Any]:
     nq = normalize_query(q)
-    index = get_index()
+
+    # Сначала in-memory префиксный индекс; Meilisearch — для длинных запросов и опечаток
+    local = suggest_index.lookup(nq, limit)
+    if local is not None:
+        return {"q": nq, "suggestions": local, "source": "index"}
 
     # Просим Meilisearch вернуть только title/id для быстрых подсказок
-    res = index.search(nq, {
+    res = await meili_async.search(nq, {
         "limit": limit,
         "attributesToRetrieve": ["id", "title", "brand", "category"],
     })
@@ -30,6 +35,12 @@ def suggest(q: str = Query(..., min_length=1), limit: int = Query(8, ge=1, le=20
             "title": t,
             "brand": h.get("brand"),
             "category": h.get("category"),
+            "type": "product",
         })
 
-    return {"q": nq, "suggestions": suggestions}
\ No newline at end of file
+    return {"q": nq, "suggestions": suggestions, "source": "meili"}
+
+
+@router.get("/suggest/stats")
+async def suggest_stats():
+    return suggest_index.summary()
@@ -0,0 +1,145 @@
+"""Server-side consultant chat sessions (compacted history + wardrobe state)."""
+import asyncio
+import logging
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from app.config import settings
+from app.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSession:
+    """
+    One consultant conversation.
+
+    `history` keeps the most recent turns verbatim ({"text", "isUser"},
+    the same shape the app sends); older turns are folded into `digest`,
+    a short rolling summary produced by Gemini.
+    """
+
+    def __init__(self, session_id: str, gender: str = "unknown", language: str = "ru"):
+        self.id = session_id
+        self.gender = gender
+        self.language = language
+        self.wardrobe: Dict[str, Dict[str, Any]] = {}
+        self._next_anon = 0  # keys for items without an id; never reused
+        self.marketplace: List[Dict[str, Any]] = []
+        self.history: List[Dict[str, Any]] = []
+        self.digest: str = ""
+        self.updated_at = time.time()
+        self.lock = asyncio.Lock()
+
+    @property
+    def wardrobe_items(self) -> List[Dict[str, Any]]:
+        return list(self.wardrobe.values())
+
+    def _anon_key(self) -> str:
+        self._next_anon += 1
+        return f"_{self._next_anon}"
+
+    def set_wardrobe(self, items: List[Dict[str, Any]]) -> None:
+        self.wardrobe = {}
+        for item in items or []:
+            self.wardrobe[str(item.get("id") or self._anon_key())] = item
+
+    def apply_wardrobe_delta(self, delta: Optional[Dict[str, Any]]) -> None:
+        """
+        Apply {"add": [items], "remove": [ids]}; "add" replaces items with the
+        same id, items without an id are always added.
+        """
+        if not delta:
+            return
+        for item_id in delta.get("remove") or []:
+            self.wardrobe.pop(str(item_id), None)
+        for item in delta.get("add") or []:
+            item_id = item.get("id")
+            self.wardrobe[self._anon_key() if item_id is None else str(item_id)] = item
+
+    def append(self, text: str, is_user: bool) -> None:
+        if text:
+            self.history.append({"text": text, "isUser": is_user})
+        self.updated_at = time.time()
+
+    def needs_compaction(self) -> bool:
+        return len(self.history) > settings.CHAT_SESSION_MAX_TURNS
+
+
+class ChatSessionStore:
+    """
+    In-process session store (per worker), idle sessions expire after
+    CHAT_SESSION_TTL. A client whose session is gone gets a new one seeded
+    from the context/history it sent.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, session_id: Optional[str]) -> Optional[ChatSession]:
+        if not session_id:
+            return None
+        session = self._sessions.get(session_id)
+        if session is not None:
+            # Sliding expiry
+            self._sessions.set(session_id, session)
+        return session
+
+    def create(
+        self,
+        context: Dict[str, Any],
+        history: List[Dict[str, Any]],
+        language: str,
+    ) -> ChatSession:
+        session = ChatSession(
+            uuid.uuid4().hex,
+            gender=context.get("gender", "unknown"),
+            language=language,
+        )
+        session.set_wardrobe(context.get("wardrobe", []))
+        session.marketplace = context.get("marketplace", [])
+        session.history = [
+            {"text": m.get("text", ""), "isUser": bool(m.get("isUser", False))}
+            for m in (history or []) if m.get("text")
+        ]
+        self._sessions.set(session.id, session)
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        return self._sessions.stats()
+
+
+async def compact_session(session: ChatSession, summarize) -> None:
+    """
+    Fold all but the last CHAT_SESSION_KEEP_TURNS turns into the digest.
+
+    `summarize(digest, turns, language) -> str` is the Gemini call; on
+    failure the turns are kept and compaction is retried after the next turn.
+    """
+    if session.lock.locked():
+        return
+
+    async with session.lock:
+        if not session.needs_compaction():
+            return
+
+        keep = settings.CHAT_SESSION_KEEP_TURNS
+        old_turns = session.history[:-keep] if keep else list(session.history)
+        try:
+            digest = await summarize(session.digest, old_turns, session.language)
+        except Exception as e:
+            logger.warning(f"Chat session {session.id[:8]} compaction failed: {e}")
+            return
+
+        if digest:
+            session.digest = digest
+            # New turns may have been appended while we were summarizing
+            session.history = session.history[len(old_turns):]
+            logger.info(f"Chat session {session.id[:8]}: folded {len(old_turns)} turns into digest")
+
+
+session_store = ChatSessionStore(
+    maxsize=settings.CHAT_SESSION_MAX_SESSIONS,
+    ttl=settings.CHAT_SESSION_TTL,
+)
@@ -0,0 +1,53 @@
+"""Async fal.ai calls behind the shared resilience layer."""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+import fal_client
+
+from app.config import settings
+from app.services.resilience import upstream
+
+logger = logging.getLogger(__name__)
+
+# fal_client is blocking. Its calls get their own threads so long try-on /
+# video jobs never occupy the default pool used by asyncio.to_thread.
+# Sized above the bulkheads: a timed-out call keeps its thread until fal returns.
+_executor = ThreadPoolExecutor(
+    max_workers=2 * (settings.FAL_MAX_CONCURRENT + settings.FAL_VIDEO_MAX_CONCURRENT),
+    thread_name_prefix="fal",
+)
+
+
+async def _in_thread(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _submit_and_wait(application: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    handler = fal_client.submit(application, arguments=arguments)
+    logger.info(f"fal request {application}: {handler.request_id}")
+    return handler.get()
+
+
+async def fal_run(application: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """`fal_client.run` with a per-application circuit breaker, bulkhead and timeout."""
+    return await upstream(f"fal:{application}").call(
+        lambda: _in_thread(fal_client.run, application, arguments=arguments)
+    )
+
+
+async def fal_video(application: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Queue-based `submit` + `get` for long video jobs (separate, smaller bulkhead)."""
+    return await upstream(f"fal_video:{application}").call(
+        lambda: _in_thread(_submit_and_wait, application, arguments)
+    )
+
+
+async def fal_upload(data: bytes, content_type: str) -> str:
+    """Upload bytes to fal storage and return the public URL."""
+    return await upstream("fal:upload").call(
+        lambda: _in_thread(fal_client.upload, data, content_type=content_type)
+    )
@@ -1,12 +1,49 @@
 """Gemini AI service for style consultation using REST API."""
+import asyncio
+import base64
+import json
 import logging
 import os
-from typing import List, Dict, Any
-import requests
+import time
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+
+import httpx
+
+from app.config import settings
+from app.services.gemini_context_cache import GeminiContextCache
+from app.services.gemini_model_router import model_router
+from app.services.image_fetcher import ImageFetchError, image_fetcher
+from app.services.image_normalizer import normalize_image, normalize_image_b64
+from app.services.perceptual_cache import image_signature_b64, phash_cache
+from app.services.resilience import UpstreamUnavailable, upstream
 
 logger = logging.getLogger(__name__)
 
 
+class GeminiAPIError(Exception):
+    """Non-200 answer from the Gemini REST API."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"Gemini API returned {status_code}")
+        self.status_code = status_code
+
+
+# Statuses Gemini answers with when a cachedContents entry is gone or unusable
+CACHE_MISS_STATUSES = (400, 403, 404)
+
+
+def is_outage(error: BaseException) -> bool:
+    """Upstream is down or throttling (429/5xx, open circuit): retrying right away only adds load."""
+    if isinstance(error, UpstreamUnavailable):
+        return True
+    return isinstance(error, GeminiAPIError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+class EmptyAnswerError(Exception):
+    """Gemini answered without any text (empty or safety-blocked reply)."""
+
+
 class GeminiConsultantService:
     """Service for interacting with Gemini API for style consultation."""
     
@@ -14,6 +51,13 @@ class GeminiConsultantService:
         """Initialize Gemini service."""
         self.api_key = None
         self.base_url = "https://generativelanguage.googleapis.com/v1beta/models"  # Changed to v1beta for Flash
+        self._client: Optional[httpx.AsyncClient] = None
+        self.context_cache = GeminiContextCache(
+            base_url=self.base_url.rsplit("/models", 1)[0],
+            ttl_seconds=settings.GEMINI_CONTEXT_CACHE_TTL,
+            enabled=settings.GEMINI_CONTEXT_CACHE_ENABLED,
+        )
+        self.router = model_router
         self._initialize()
     
     def _initialize(self):
@@ -35,6 +79,138 @@ class GeminiConsultantService:
     def is_configured(self) -> bool:
         """Check if Gemini is properly configured."""
         return self.api_key is not None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared keep-alive HTTP client (created lazily on the running loop)."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.GEMINI_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.GEMINI_MAX_KEEPALIVE,
+                    keepalive_expiry=settings.GEMINI_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(settings.GEMINI_TIMEOUT, connect=settings.GEMINI_CONNECT_TIMEOUT),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close pooled connections (called from the app lifespan)."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    @staticmethod
+    def _model_ok(status_code: int) -> bool:
+        """Whether a response counts as healthy for the router (4xx other than 429 are our fault)."""
+        return status_code < 500 and status_code != 429
+
+    async def _generate_content(
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        timeout: float,
+        hedge: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        POST to `{model}:generateContent` on the pooled client and return the JSON body.
+
+        Runs behind the model's circuit breaker and bulkhead; `hedge=True`
+        (cheap idempotent calls only) sends a duplicate after the observed p95.
+        """
+        url = f"{self.base_url}/{model}:generateContent"
+
+        async def attempt() -> Dict[str, Any]:
+            started = time.perf_counter()
+            try:
+                response = await self._get_client().post(
+                    url,
+                    params={"key": self.api_key},
+                    json=payload,
+                    timeout=timeout,
+                )
+            except httpx.HTTPError:
+                self.router.record(model, (time.perf_counter() - started) * 1000, ok=False)
+                raise
+            self.router.record(model, (time.perf_counter() - started) * 1000, ok=self._model_ok(response.status_code))
+
+            if response.status_code != 200:
+                logger.error(f"Gemini API error: {response.status_code} - {response.text}")
+                raise GeminiAPIError(response.status_code)
+
+            return response.json()
+
+        return await upstream(f"gemini:{model}").call(attempt, hedge=hedge, is_failure=self._is_upstream_failure)
+
+    @classmethod
+    def _is_upstream_failure(cls, error: BaseException) -> bool:
+        """Errors that count against the circuit breaker (not our own bad requests)."""
+        if isinstance(error, GeminiAPIError):
+            return not cls._model_ok(error.status_code)
+        return True
+
+    @staticmethod
+    def _extract_text(data: Dict[str, Any]) -> Optional[str]:
+        """Return the first text part of the first candidate, if any."""
+        if "candidates" in data and len(data["candidates"]) > 0:
+            candidate = data["candidates"][0]
+            if "content" in candidate and "parts" in candidate["content"]:
+                parts = candidate["content"]["parts"]
+                if len(parts) > 0 and "text" in parts[0]:
+                    return parts[0]["text"]
+        return None
+
+    async def _consultant_payload(
+        self,
+        model: str,
+        contents: List[Dict[str, Any]],
+        gender: str,
+        language: str,
+    ) -> Tuple[Dict[str, Any], bool]:
+        """
+        Attach the static persona to `contents`: by reference to a Gemini
+        cachedContent when available, otherwise inline as systemInstruction.
+        Returns (payload, uses_cache).
+        """
+        key = self._persona_key(gender, language)
+        persona = self._build_persona_prompt(*key)
+
+        cache_name = await self.context_cache.get(self._get_client(), self.api_key, model, key, persona)
+        if cache_name:
+            return {"cachedContent": cache_name, "contents": contents}, True
+
+        return {"systemInstruction": {"parts": [{"text": persona}]}, "contents": contents}, False
+
+    async def _generate_consultant(
+        self,
+        model: str,
+        contents: List[Dict[str, Any]],
+        gender: str,
+        language: str,
+        timeout: float,
+    ) -> Dict[str, Any]:
+        """generateContent with the cached persona prefix; retries inline if the cache entry is gone."""
+        payload, cached = await self._consultant_payload(model, contents, gender, language)
+        started = time.perf_counter()
+        try:
+            data = await self._generate_content(model, payload, timeout=timeout)
+        except GeminiAPIError as e:
+            # Only a missing/invalid cache entry is worth a retry; 429/5xx would just double the load
+            if not cached or e.status_code not in CACHE_MISS_STATUSES:
+                raise
+            # Entry expired or was evicted on Gemini's side: drop it and send the persona inline
+            key = self._persona_key(gender, language)
+            self.context_cache.invalidate(model, key)
+            payload = {
+                "systemInstruction": {"parts": [{"text": self._build_persona_prompt(*key)}]},
+                "contents": contents,
+            }
+            cached = False
+            started = time.perf_counter()
+            data = await self._generate_content(model, payload, timeout=timeout)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.context_cache.record(cached, data.get("usageMetadata") or {}, elapsed_ms)
+        return data
     
     async def ask(
         self,
@@ -43,7 +219,8 @@ class GeminiConsultantService:
         marketplace: List[Dict[str, Any]],
         gender: str = "unknown",
         history: List[Dict[str, Any]] = [],
-        language: str = "ru"
+        language: str = "ru",
+        digest: str = ""
     ) -> str:
         """
         Ask Gemini for style advice using REST API with context history.
@@ -51,18 +228,38 @@ class GeminiConsultantService:
         if not self.api_key:
             raise Exception("Gemini API not configured")
         
-        # 1. Build System Prompt (Context + Persona)
-        system_prompt = self._build_system_prompt(wardrobe, marketplace, gender, language)
-        
-        # 2. Construct Chat History (Contents)
-        contents = []
-        
-        # System Message (as User) to prime the context
-        contents.append({
-            "role": "user",
-            "parts": [{"text": system_prompt}]
-        })
-        # REMOVED: Model "Ready" message to prevent "Reset" feeling
+        contents = self._build_chat_contents(question, wardrobe, marketplace, gender, history, language, digest)
+
+        try:
+            # Model comes from the router (consultant tier)
+            data = await self._generate_consultant(self.router.choose("consultant"), contents, gender, language, timeout=30)
+
+            text = self._extract_text(data)
+            if text is not None:
+                return text
+
+            raise Exception("Invalid response format from Gemini API")
+            
+        except Exception as e:
+            logger.error(f"Gemini API error: {e}")
+            raise
+    
+    def _build_chat_contents(
+        self,
+        question: str,
+        wardrobe: List[Dict[str, Any]],
+        marketplace: List[Dict[str, Any]],
+        gender: str,
+        history: List[Dict[str, Any]],
+        language: str,
+        digest: str = "",
+    ) -> List[Dict[str, Any]]:
+        """
+        Build the `contents` array for a text-only consultant turn.
+        The static persona is attached separately (see `_consultant_payload`).
+        """
+        # 1. Per-request context (wardrobe, session digest) as the first user turn
+        contents = self._context_contents(wardrobe, language, digest)
         
         # Append Conversation History
         # Limit to last 10 messages
@@ -87,38 +284,118 @@ class GeminiConsultantService:
             "role": "user",
             "parts": [{"text": question}]
         })
-        
+
+        return contents
+
+    async def ask_stream(
+        self,
+        question: str,
+        wardrobe: List[Dict[str, Any]],
+        marketplace: List[Dict[str, Any]],
+        gender: str = "unknown",
+        history: List[Dict[str, Any]] = [],
+        language: str = "ru",
+        digest: str = ""
+    ) -> AsyncIterator[str]:
+        """
+        Same as `ask`, but yields text chunks as Gemini produces them
+        (streamGenerateContent with alt=sse).
+        """
+        if not self.api_key:
+            raise Exception("Gemini API not configured")
+
+        contents = self._build_chat_contents(question, wardrobe, marketplace, gender, history, language, digest)
+        async for text in self._stream_consultant(self.router.choose("consultant"), contents, gender, language, timeout=30):
+            yield text
+
+    async def _stream_consultant(
+        self,
+        model: str,
+        contents: List[Dict[str, Any]],
+        gender: str,
+        language: str,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        """
+        streamGenerateContent with the cached persona prefix; yields text chunks.
+        Like `_generate_consultant`, retries once with the persona inline if
+        the cache entry is gone (400/403/404, and only before anything has
+        been yielded).
+        """
+        payload, cached = await self._consultant_payload(model, contents, gender, language)
+        yielded = False
         try:
-            # Use gemini-2.5-flash model
-            url = f"{self.base_url}/gemini-2.5-flash:generateContent"
-            
-            response = requests.post(
-                url,
-                params={"key": self.api_key},
-                json={"contents": contents},
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Gemini API error: {response.status_code} - {response.text}")
-                raise Exception(f"Gemini API returned {response.status_code}")
-            
-            data = response.json()
-            
-            # Extract text
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    parts = candidate["content"]["parts"]
-                    if len(parts) > 0 and "text" in parts[0]:
-                        return parts[0]["text"]
-            
-            raise Exception("Invalid response format from Gemini API")
-            
-        except Exception as e:
-            logger.error(f"Gemini API error: {e}")
+            async for text in self._stream_content(model, payload, cached, timeout):
+                yielded = True
+                yield text
+            return
+        except GeminiAPIError as e:
+            if not cached or yielded or e.status_code not in CACHE_MISS_STATUSES:
+                raise
+        # Entry expired or was evicted on Gemini's side: drop it and send the persona inline
+        key = self._persona_key(gender, language)
+        self.context_cache.invalidate(model, key)
+        payload = {
+            "systemInstruction": {"parts": [{"text": self._build_persona_prompt(*key)}]},
+            "contents": contents,
+        }
+        async for text in self._stream_content(model, payload, False, timeout):
+            yield text
+
+    async def _stream_content(
+        self,
+        model: str,
+        payload: Dict[str, Any],
+        cached: bool,
+        timeout: float,
+    ) -> AsyncIterator[str]:
+        url = f"{self.base_url}/{model}:streamGenerateContent"
+        started = time.perf_counter()
+        usage: Dict[str, Any] = {}
+
+        ok = called = False
+        try:
+            async with upstream(f"gemini:{model}").slot(self._is_upstream_failure):
+                # Past the breaker/bulkhead: from here on the model is really called
+                called = True
+                async with self._get_client().stream(
+                    "POST",
+                    url,
+                    params={"key": self.api_key, "alt": "sse"},
+                    json=payload,
+                    timeout=timeout,  # per read: bounds the gap between chunks, not the whole answer
+                ) as response:
+                    ok = self._model_ok(response.status_code)
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        logger.error(f"Gemini stream error: {response.status_code} - {body[:500]!r}")
+                        raise GeminiAPIError(response.status_code)
+
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        raw = line[len("data:"):].strip()
+                        if not raw:
+                            continue
+                        try:
+                            data = json.loads(raw)
+                        except ValueError:
+                            logger.warning(f"Skipping malformed Gemini stream line: {raw[:100]}")
+                            continue
+
+                        usage = data.get("usageMetadata") or usage
+                        text = self._extract_text(data)
+                        if text:
+                            yield text
+        except httpx.HTTPError:
+            ok = False
             raise
-    
+        finally:
+            if called:
+                self.router.record(model, (time.perf_counter() - started) * 1000, ok=ok)
+
+        self.context_cache.record(cached, usage, (time.perf_counter() - started) * 1000)
+
     async def ask_with_image(
         self,
         question: str,
@@ -128,27 +405,52 @@ class GeminiConsultantService:
         marketplace: List[Dict[str, Any]],
         gender: str = "unknown",
         history: List[Dict[str, Any]] = [],
-        language: str = "ru"
+        language: str = "ru",
+        digest: str = ""
     ) -> str:
         """
         Ask Gemini for style advice with an image using REST API.
         """
         if not self.api_key:
             raise Exception("Gemini API not configured")
+
+        contents = await self._build_image_contents(question, image_data, mime_type, wardrobe, history, language, digest)
+
+        try:
+            # Model comes from the router (multimodal consultant tier)
+            data = await self._generate_consultant(
+                self.router.choose("consultant_image"),
+                contents,
+                gender,
+                language,
+                timeout=60,  # Increased timeout for image processing
+            )
+
+            text = self._extract_text(data)
+            if text is not None:
+                return text
+
+            raise Exception("Invalid response format from Gemini API")
+            
+        except Exception as e:
+            logger.error(f"Gemini API error: {e}")
+            raise
+
+    async def _build_image_contents(
+        self,
+        question: str,
+        image_data: bytes,
+        mime_type: str,
+        wardrobe: List[Dict[str, Any]],
+        history: List[Dict[str, Any]],
+        language: str,
+        digest: str = "",
+    ) -> List[Dict[str, Any]]:
+        """Build the `contents` array for a consultant turn with a photo."""
+        # 1. Per-request context (wardrobe, session digest); the persona goes via `_consultant_payload`
+        contents = self._context_contents(wardrobe, language, digest)
         
-        # 1. Build System Prompt (Context + Persona)
-        system_prompt = self._build_system_prompt(wardrobe, marketplace, gender, language)
-        
-        # 2. Construct Chat History (Contents)
-        contents = []
-        
-        # System Message
-        contents.append({
-            "role": "user",
-            "parts": [{"text": system_prompt}]
-        })
-        
-        # Append Conversation History (Text Only for now to save tokens/complexity)
+        # 2. Append Conversation History (Text Only for now to save tokens/complexity)
         recent_history = history[-5:] if history else []
         for msg in recent_history:
             role = "user" if msg.get("isUser", False) else "model"
@@ -159,8 +461,8 @@ class GeminiConsultantService:
                     "parts": [{"text": text}]
                 })
         
-        # 3. Append Current Question WITH Image
-        import base64
+        # 3. Append Current Question WITH Image (downscaled, EXIF-rotated, metadata stripped)
+        image_data, mime_type = await normalize_image(image_data, mime_type)
         b64_image = base64.b64encode(image_data).decode('utf-8')
         
         contents.append({
@@ -175,55 +477,54 @@ class GeminiConsultantService:
                 }
             ]
         })
-        
-        try:
-            # Use gemini-2.5-flash model (multimodal)
-            url = f"{self.base_url}/gemini-2.5-flash:generateContent"
-            
-            response = requests.post(
-                url,
-                params={"key": self.api_key},
-                json={"contents": contents},
-                timeout=60 # Increased timeout for image processing
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Gemini API error: {response.status_code} - {response.text}")
-                raise Exception(f"Gemini API returned {response.status_code}")
-            
-            data = response.json()
-            
-            # Extract text
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    parts = candidate["content"]["parts"]
-                    if len(parts) > 0 and "text" in parts[0]:
-                        return parts[0]["text"]
-            
-            raise Exception("Invalid response format from Gemini API")
-            
-        except Exception as e:
-            logger.error(f"Gemini API error: {e}")
-            raise
 
-    def _build_system_prompt(
+        return contents
+
+    async def ask_with_image_stream(
         self,
+        question: str,
+        image_data: bytes,
+        mime_type: str,
         wardrobe: List[Dict[str, Any]],
         marketplace: List[Dict[str, Any]],
-        gender: str,
-        language: str = "ru"
-    ) -> str:
-        """Build the system context prompt."""
+        gender: str = "unknown",
+        history: List[Dict[str, Any]] = [],
+        language: str = "ru",
+        digest: str = ""
+    ) -> AsyncIterator[str]:
+        """Streaming variant of `ask_with_image`."""
+        if not self.api_key:
+            raise Exception("Gemini API not configured")
+
+        contents = await self._build_image_contents(question, image_data, mime_type, wardrobe, history, language, digest)
+        async for text in self._stream_consultant(self.router.choose("consultant_image"), contents, gender, language, timeout=60):
+            yield text
+
+    @staticmethod
+    def _persona_key(gender: str, language: str) -> Tuple[str, str]:
+        """Normalized (language, gender) key of the static persona prompt."""
+        language = language if language in ("en", "kk") else "ru"
+        gender = (gender or "unknown").lower()
+        if gender not in ("male", "female"):
+            gender = "unknown"
+        return language, gender
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _build_persona_prompt(language: str, gender: str) -> str:
+        """
+        Build the static persona + formatting rules for (language, gender).
+        Built once per key; pass a key from `_persona_key`.
+        """
         
         prompt = ""
         
         # --- ENGLISH PROMPT ---
         if language == 'en':
             gender_context = ""
-            if gender.lower() == 'male':
+            if gender == 'male':
                 gender_context = "You are consulting a man. Consider men's trends, fits, and styles."
-            elif gender.lower() == 'female':
+            elif gender == 'female':
                 gender_context = "You are consulting a woman. Consider women's trends, styling, and combinations."
 
             prompt = f"""You are a professional, friendly, and wise AI Stylist in the Outfit Assistant app. Your mission is to be the perfect personal style consultant.
@@ -234,11 +535,6 @@ The user has asked for your advice. Your task is to provide a detailed, helpful,
 You must NOT sell products or recommend specific items from the app store.
 Focus on your expertise: color combinations, fits for occasions, trends, and creating a cohesive look.
 """
-            if wardrobe:
-                prompt += "👗 USER'S WARDROBE (Consider these items if helpful):\n"
-                for item in wardrobe[:15]:
-                    prompt += f"- {item.get('name', 'Untitled')} ({item.get('category', 'Uncategorized')})\n"
-                prompt += "\n"
 
             prompt += """
 FORMATTING INSTRUCTIONS (Markdown):
@@ -262,16 +558,16 @@ IMPORTANT:
 
 VISUAL EXAMPLES (MANDATORY):
 If the user asks to "show", "photo", "look", "example", "ideas" or describes a specific style:
-You MUST add an image search tag at the VERY END of your response.
+You MUST put an image search tag on the FIRST line of your response, before any other text.
 Format: [SEARCH: exact search query in English]
 
 Examples:
-- Q: "Show wedding ideas" -> A: ...text... [SEARCH: mens summer wedding guest suit expert styling]
-- Q: "Grunge style" -> A: ...text... [SEARCH: grunge style outfits aesthetic men women 90s]
-- Q: "Green dress" -> A: ...text... [SEARCH: green dress outfit fashion street style]
+- Q: "Show wedding ideas" -> A: [SEARCH: mens summer wedding guest suit expert styling]\n...text...
+- Q: "Grunge style" -> A: [SEARCH: grunge style outfits aesthetic men women 90s]\n...text...
+- Q: "Green dress" -> A: [SEARCH: green dress outfit fashion street style]\n...text...
 
 RULES:
-1. Tag must be LAST in the message.
+1. Tag must be the FIRST line of the message, alone on that line.
 2. Query inside tag MUST be in ENGLISH.
 3. Don't say "Here are images", just insert the tag.
 4. ALWAYS add [SEARCH: ...] if the question implies visual examples.
@@ -280,9 +576,9 @@ RULES:
         # --- KAZAKH PROMPT ---
         elif language == 'kk':
             gender_context = ""
-            if gender.lower() == 'male':
+            if gender == 'male':
                 gender_context = "Сіз ер адамға кеңес беріп тұрсыз. Ерлер сәні мен трендтерін ескеріңіз."
-            elif gender.lower() == 'female':
+            elif gender == 'female':
                 gender_context = "Сіз әйел адамға кеңес беріп тұрсыз. Әйелдер сәні мен үйлесімдерін ескеріңіз."
 
             prompt = f"""Сіз - Outfit Assistant қосымшасындағы кәсіби, достық пейілді және данышпан AI-стилистсіз. Сіздің миссияңыз - мінсіз жеке стиль кеңесшісі болу.
@@ -293,11 +589,6 @@ RULES:
 Сіз тауарларды сатпауыңыз керек немесе дүкеннен нақты заттарды ұсынбауыңыз керек.
 Өз сараптамаңызға назар аударыңыз: түстер үйлесімі, жағдайға сай киім таңдау, трендтер және тұтас образ жасау.
 """
-            if wardrobe:
-                prompt += "👗 ПАЙДАЛАНУШЫ ГАРДЕРОБЫ (Кеңес беруде осы заттарды ескеріңіз):\n"
-                for item in wardrobe[:15]:
-                    prompt += f"- {item.get('name', 'Атаусыз')} ({item.get('category', 'Санатсыз')})\n"
-                prompt += "\n"
 
             prompt += """
 РӘСІМДЕУ НҰСҚАУЛАРЫ (Markdown):
@@ -321,15 +612,15 @@ RULES:
 
 ВИЗУАЛДЫ МЫСАЛДАР (МІНДЕТТІ):
 Егер пайдаланушы "көрсет", "фото", "образ", "мысал", "идея" деп сұраса немесе нақты стильді сипаттаса:
-Жауаптың ЕҢ СОҢЫНДА сурет іздеу тегін қосуыңыз КЕРЕК.
+Жауаптың БІРІНШІ ЖОЛЫНА, кез келген мәтіннен бұрын, сурет іздеу тегін қоюыңыз КЕРЕК.
 Формат: [SEARCH: ағылшын тіліндегі нақты сұраныс]
 
 Мысалдар:
-- Сұрақ: "Тойға идеялар" -> Жауап: ...мәтін... [SEARCH: mens summer wedding guest suit expert styling]
-- Сұрақ: "Гранж стилі" -> Жауап: ...мәтін... [SEARCH: grunge style outfits aesthetic men women 90s]
+- Сұрақ: "Тойға идеялар" -> Жауап: [SEARCH: mens summer wedding guest suit expert styling]\n...мәтін...
+- Сұрақ: "Гранж стилі" -> Жауап: [SEARCH: grunge style outfits aesthetic men women 90s]\n...мәтін...
 
 ЕРЕЖЕЛЕР:
-1. Тег хабарламаның СОҢЫНДА болуы керек.
+1. Тег хабарламаның БІРІНШІ ЖОЛЫНДА жеке тұруы керек.
 2. Тег ішіндегі сұраныс АҒЫЛШЫН ТІЛІНДЕ болуы керек.
 3. "Міне суреттер" деп жазбаңыз, тек тегті қойыңыз.
 4. ӘРҚАШАН [SEARCH: ...] қосыңыз, егер сұрақ визуалды мысалдарды қажет етсе.
@@ -338,9 +629,9 @@ RULES:
         # --- RUSSIAN PROMPT (Default) ---
         else:
             gender_context = ""
-            if gender.lower() == 'male':
+            if gender == 'male':
                 gender_context = "Ты консультируешь мужчину. Учитывай мужские тренды, особенности мужского стиля и кроя."
-            elif gender.lower() == 'female':
+            elif gender == 'female':
                 gender_context = "Ты консультируешь женщину. Учитывай женские тренды, особенности женского стиля и сочетаний."
             
             prompt = f"""Ты - профессиональный, дружелюбный и мудрый AI-стилист в приложении Outfit Assistant. Твоя миссия - быть идеальным личным консультантом по стилю.
@@ -351,11 +642,6 @@ RULES:
 Ты НЕ должен продавать товары или рекомендовать конкретные вещи из магазина приложения.
 Ты должен сосредоточиться на своей экспертизе: сочетании цветов, подборе фасонов под ситуацию, трендах и создании целостного образа.
 """
-            if wardrobe:
-                prompt += "👗 ГАРДЕРОБ ПОЛЬЗОВАТЕЛЯ (Учитывай эти вещи, если они помогут в совете):\n"
-                for item in wardrobe[:15]:
-                    prompt += f"- {item.get('name', 'Без названия')} ({item.get('category', 'Без категории')})\n"
-                prompt += "\n"
         
             prompt += """
 ИНСТРУКЦИИ ПО ОФОРМЛЕНИЮ ОТВЕТА (Markdown):
@@ -379,16 +665,16 @@ RULES:
 
 ВИЗУАЛЬНЫЕ ПРИМЕРЫ (ОБЯЗАТЕЛЬНО):
 Если пользователь спрашивает "покажи", "фото", "образ", "примеры", "идеи" или описывает конкретный стиль:
-Ты ОБЯЗАН добавить в конце ответа (после всех слов) тег поиска изображений.
+Ты ОБЯЗАН поставить тег поиска изображений ПЕРВОЙ строкой ответа (до любого текста).
 Формат: [SEARCH: точный запрос на английском языке]
 
 Примеры:
-- Вопрос: "Покажи идеи для свадьбы" -> Ответ: ...текст... [SEARCH: mens summer wedding guest suit expert styling]
-- Вопрос: "Стиль гранж" -> Ответ: ...текст... [SEARCH: grunge style outfits aesthetic men women 90s]
-- Вопрос: "Зеленое платье" -> Ответ: ...текст... [SEARCH: green dress outfit fashion street style]
+- Вопрос: "Покажи идеи для свадьбы" -> Ответ: [SEARCH: mens summer wedding guest suit expert styling]\n...текст...
+- Вопрос: "Стиль гранж" -> Ответ: [SEARCH: grunge style outfits aesthetic men women 90s]\n...текст...
+- Вопрос: "Зеленое платье" -> Ответ: [SEARCH: green dress outfit fashion street style]\n...текст...
 
 ВАЖНО:
-1. Тег должен быть ПОСЛЕДНИМ в сообщении.
+1. Тег должен стоять ПЕРВОЙ строкой сообщения, отдельно от текста.
 2. Запрос внутри тега должен быть НА АНГЛИЙСКОМ.
 3. Не пиши "Вот изображения:", просто вставь тег.
 4. ВСЕГДА добавляй тег [SEARCH: ...] если вопрос про конкретный стиль, вещь или образ.
@@ -396,34 +682,100 @@ RULES:
         
         return prompt
 
+    @staticmethod
+    def _build_wardrobe_block(wardrobe: List[Dict[str, Any]], language: str = "ru") -> str:
+        """Per-request wardrobe context (not cached)."""
+        if not wardrobe:
+            return ""
+
+        if language == 'en':
+            header = "👗 USER'S WARDROBE (Consider these items if helpful):\n"
+            untitled, uncategorized = 'Untitled', 'Uncategorized'
+        elif language == 'kk':
+            header = "👗 ПАЙДАЛАНУШЫ ГАРДЕРОБЫ (Кеңес беруде осы заттарды ескеріңіз):\n"
+            untitled, uncategorized = 'Атаусыз', 'Санатсыз'
+        else:
+            header = "👗 ГАРДЕРОБ ПОЛЬЗОВАТЕЛЯ (Учитывай эти вещи, если они помогут в совете):\n"
+            untitled, uncategorized = 'Без названия', 'Без категории'
+
+        block = header
+        for item in wardrobe[:15]:
+            block += f"- {item.get('name', untitled)} ({item.get('category', uncategorized)})\n"
+        return block
+
+    @staticmethod
+    def _build_digest_block(digest: str, language: str = "ru") -> str:
+        """Rolling summary of older session turns (see chat_session_store)."""
+        if not digest:
+            return ""
+        if language == 'en':
+            header = "📝 EARLIER IN THIS CONVERSATION (summary):\n"
+        elif language == 'kk':
+            header = "📝 ОСЫ ДИАЛОГТА БҰРЫН (қысқаша):\n"
+        else:
+            header = "📝 РАНЕЕ В ЭТОМ ДИАЛОГЕ (кратко):\n"
+        return header + digest.strip() + "\n"
+
+    def _context_contents(
+        self,
+        wardrobe: List[Dict[str, Any]],
+        language: str,
+        digest: str = "",
+    ) -> List[Dict[str, Any]]:
+        """Leading user turn with the wardrobe/digest blocks, or nothing if both are empty."""
+        block = "\n".join(
+            b for b in (self._build_wardrobe_block(wardrobe, language), self._build_digest_block(digest, language)) if b
+        )
+        if not block:
+            return []
+        return [{"role": "user", "parts": [{"text": block}]}]
+
+    async def summarize_turns(self, digest: str, turns: List[Dict[str, Any]], language: str = "ru") -> str:
+        """
+        Fold `turns` into the running conversation `digest`.
+        Returns the new digest (a few sentences, in the conversation language).
+        """
+        if not self.api_key:
+            raise Exception("Gemini API not configured")
+
+        lang_name = {"en": "English", "kk": "Kazakh"}.get(language, "Russian")
+        transcript = "\n".join(
+            f"{'User' if t.get('isUser') else 'Stylist'}: {t.get('text', '')}" for t in turns
+        )
+        prompt = (
+            f"You maintain a running summary of a conversation between a user and an AI stylist.\n"
+            f"Current summary:\n{digest or '(empty)'}\n\n"
+            f"New turns:\n{transcript}\n\n"
+            f"Write the updated summary in {lang_name}, at most 8 short sentences. Keep the user's "
+            f"preferences, body/size details, occasions, items discussed and advice already given. "
+            f"Return only the summary text."
+        )
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": 0.2, "maxOutputTokens": 400},
+        }
+        data = await self._generate_content(self.router.choose("summary"), payload, timeout=30)
+        return (self._extract_text(data) or "").strip()
+
     async def describe_image(self, image_url: str, prompt_text: str = "Describe this image") -> str:
         """
-        Analyze an image using Gemini Vision (gemini-1.5-flash).
+        Analyze an image using Gemini Vision (light model, see `model_router`).
         Useful for generating prompts for other models based on an image.
         """
         if not self.api_key:
              return "clothing"
 
         try:
-            # 1. Download image (non-blocking)
-            import base64
-            import asyncio
-            
-            def download_and_encode():
-                resp = requests.get(image_url)
-                if resp.status_code != 200:
-                    return None, None
-                b64 = base64.b64encode(resp.content).decode('utf-8')
-                return b64, "image/jpeg"
-
-            b64_data, mime_type = await asyncio.to_thread(download_and_encode)
-            
-            if not b64_data:
-                 return "clothing item"
+            # 1. Download image (shared fetcher: size/type checks, URL cache)
+            try:
+                raw, raw_mime = await image_fetcher.fetch(image_url)
+            except ImageFetchError as e:
+                logger.warning(f"describe_image download failed: {e}")
+                return "clothing item"
+            image_data, mime_type = await normalize_image(raw, raw_mime)
+            b64_data = base64.b64encode(image_data).decode('utf-8')
 
-            # 2. Call Gemini (non-blocking)
-            url = f"{self.base_url}/gemini-1.5-flash:generateContent"
-            
+            # 2. Call Gemini
             payload = {
                 "contents": [{
                     "parts": [
@@ -438,26 +790,16 @@ RULES:
                 }]
             }
 
-            def call_gemini():
-                return requests.post(
-                    url,
-                    params={"key": self.api_key},
-                    json=payload,
-                    timeout=30
-                )
-
-            response = await asyncio.to_thread(call_gemini)
-            
-            if response.status_code != 200:
-                logger.error(f"Gemini Vision error: {response.status_code} - {response.text}")
+            try:
+                data = await self._generate_content(self.router.choose("describe_image"), payload, timeout=30, hedge=True)
+            except Exception as e:
+                logger.error(f"Gemini Vision error: {e}")
                 return "clothing item"
 
-            data = response.json()
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                     return candidate["content"]["parts"][0]["text"]
-            
+            text = self._extract_text(data)
+            if text is not None:
+                return text
+
             return "clothing item"
 
         except Exception as e:
@@ -469,13 +811,27 @@ RULES:
         """
         Analyze an outfit image and detect clothing items using Gemini Vision.
         Returns a structured list of items.
+
+        Results are cached by perceptual hash + color signature, so re-uploads
+        of the same photo (recompressed / resized) skip the Gemini call.
         """
         if not self.api_key:
             return []
 
+        h = await image_signature_b64(image_b64)
+        cached = await phash_cache.get("analyze", h)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        items = await self._analyze_outfit_image(image_b64)
+        await phash_cache.set("analyze", h, items, (time.perf_counter() - start) * 1000)
+        return items
+
+    async def _analyze_outfit_image(self, image_b64: str) -> List[Dict[str, Any]]:
+        """Uncached Gemini Vision call behind `analyze_outfit_image`."""
+
         try:
-            url = f"{self.base_url}/gemini-2.5-flash:generateContent"
-            
             prompt = """
             Analyze this outfit image. Identifiy the main clothing items (e.g. Jacket, Shirt, Pants, Shoes, Bag, Accessories).
             For each item, provide:
@@ -493,6 +849,8 @@ RULES:
             Do not wrap in Markdown code blocks. Just the JSON.
             """
 
+            image_b64 = await normalize_image_b64(image_b64)
+
             payload = {
                 "contents": [{
                     "parts": [
@@ -507,41 +865,26 @@ RULES:
                 }]
             }
 
-            def call_gemini():
-                return requests.post(
-                    url,
-                    params={"key": self.api_key},
-                    json=payload,
-                    timeout=30
-                )
-
-            import asyncio
-            # print(f"DEBUG: Gemini URL: {url}") # REMOVED DEBUG
-            response = await asyncio.to_thread(call_gemini)
-            
-            if response.status_code != 200:
-                logger.error(f"Gemini Vision error: {response.status_code} - {response.text}")
+            try:
+                data = await self._generate_content(self.router.choose("analyze_outfit"), payload, timeout=30)
+            except Exception as e:
+                logger.error(f"Gemini Vision error: {e}")
                 return []
 
-            data = response.json()
-            # print(f"Gemini Raw Response: {data}") 
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    text = candidate["content"]["parts"][0]["text"]
-                    print(f"Gemini Vision Text: {text[:100]}...") # Log first 100 chars
-                    
-                    # Clean up Markdown check
-                    if text.startswith("```json"):
-                        text = text.replace("```json", "").replace("```", "")
-                    
-                    try:
-                        import json
-                        items = json.loads(text)
-                        return items
-                    except:
-                        logger.error(f"Failed to parse Gemini Vision JSON: {text}")
-                        return []
+            text = self._extract_text(data)
+            if text is not None:
+                print(f"Gemini Vision Text: {text[:100]}...") # Log first 100 chars
+
+                # Clean up Markdown check
+                if text.startswith("```json"):
+                    text = text.replace("```json", "").replace("```", "")
+                
+                try:
+                    items = json.loads(text)
+                    return items
+                except:
+                    logger.error(f"Failed to parse Gemini Vision JSON: {text}")
+                    return []
             
             return []
 
@@ -549,26 +892,18 @@ RULES:
             logger.error(f"Gemini Vision exception: {e}")
             return []
 
-    async def auto_tag_item(self, image_b64: str, language: str = 'ru') -> Dict[str, Any]:
-        """
-        Analyze a single clothing item image and generate tags/attributes.
-        Returns a structured dictionary with values in the requested language.
-        """
-        if not self.api_key:
-            return {}
-
+    @staticmethod
+    def _auto_tag_lang_instruction(language: str) -> str:
         lang_instruction = "IN RUSSIAN"
         if language == 'en':
             lang_instruction = "IN ENGLISH"
         elif language == 'kk':
             lang_instruction = "IN KAZAKH (Cyrillic)"
+        return lang_instruction
 
-        try:
-            url = f"{self.base_url}/gemini-2.5-flash:generateContent"
-            
-            prompt = f"""
-            Analyze this clothing item image. Your task is to extract attributes for a digital wardrobe.
-            Provide the following fields in JSON format:
+    @staticmethod
+    def _auto_tag_fields(lang_instruction: str) -> str:
+        return f"""
             1. "name": A short, descriptive title {lang_instruction} (e.g. "Синяя льняная рубашка").
             2. "category": The main category MUST BE ONE OF THESE ENGLISH KEYS: ["top", "bottom", "shoes", "outerwear", "accessory", "dress", "hat", "bag", "other"].
             3. "subCategory": Specific type {lang_instruction} (e.g. "футболка", "джинсы", "кроссовки", "пиджак").
@@ -576,74 +911,176 @@ RULES:
             5. "season": Best season(s) {lang_instruction} (e.g. ["Лето", "Весна"]).
             6. "style": Style keywords {lang_instruction} (e.g. ["Кэжуал", "Минимализм"]).
             7. "tags": A list of 5-7 descriptive tags {lang_instruction} (material, pattern, vibe).
+"""
 
-            Return ONLY valid JSON.
-            Example:
-            {{
-              "name": "...", 
-              "category": "outerwear", 
-              "subCategory": "...",
-              "color": "...",
-              "season": ["..."],
-              "style": ["..."],
-              "tags": ["..."]
-            }}
-            """
-
-            payload = {
-                "contents": [{
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": "image/jpeg",
-                                "data": image_b64
-                            }
-                        }
-                    ]
-                }]
-            }
-
-            def call_gemini():
-                return requests.post(
-                    url,
-                    params={"key": self.api_key},
-                    json=payload,
-                    timeout=30
-                )
+    @staticmethod
+    def _strip_json_fences(text: str) -> str:
+        # Clean up Markdown
+        if text.startswith("```json"):
+            text = text.replace("```json", "").replace("```", "")
+        elif text.startswith("```"):
+            text = text.replace("```", "")
+        return text
 
-            import asyncio
-            response = await asyncio.to_thread(call_gemini)
-            
-            if response.status_code != 200:
-                logger.error(f"Gemini Auto-Tag error: {response.status_code} - {response.text}")
-                return {}
-
-            data = response.json()
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    text = candidate["content"]["parts"][0]["text"]
-                    
-                    # Clean up Markdown
-                    if text.startswith("```json"):
-                        text = text.replace("```json", "").replace("```", "")
-                    elif text.startswith("```"):
-                        text = text.replace("```", "")
-                    
-                    try:
-                        import json
-                        result = json.loads(text)
-                        return result
-                    except:
-                        logger.error(f"Failed to parse Gemini Auto-Tag JSON: {text}")
-                        return {}
-            
+    async def auto_tag_item(self, image_b64: str, language: str = 'ru') -> Dict[str, Any]:
+        """
+        Analyze a single clothing item image and generate tags/attributes.
+        Returns a structured dictionary with values in the requested language.
+        Cached by perceptual hash + color signature + language.
+        """
+        if not self.api_key:
             return {}
 
+        namespace = f"auto_tag:{language}"
+        h = await image_signature_b64(image_b64)
+        cached = await phash_cache.get(namespace, h)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        try:
+            result = await self._auto_tag_item(image_b64, language)
         except Exception as e:
-            logger.error(f"Gemini Auto-Tag exception: {e}")
+            logger.error(f"Gemini Auto-Tag error: {e}")
             return {}
+        await phash_cache.set(namespace, h, result, (time.perf_counter() - start) * 1000)
+        return result
+
+    async def _auto_tag_item(self, image_b64: str, language: str = 'ru') -> Dict[str, Any]:
+        """Uncached Gemini call behind `auto_tag_item`; raises if the item could not be tagged."""
+        lang_instruction = self._auto_tag_lang_instruction(language)
+
+        prompt = f"""
+        Analyze this clothing item image. Your task is to extract attributes for a digital wardrobe.
+        Provide the following fields in JSON format:
+{self._auto_tag_fields(lang_instruction)}
+        Return ONLY valid JSON.
+        Example:
+        {{
+          "name": "...", 
+          "category": "outerwear", 
+          "subCategory": "...",
+          "color": "...",
+          "season": ["..."],
+          "style": ["..."],
+          "tags": ["..."]
+        }}
+        """
+
+        image_b64 = await normalize_image_b64(image_b64)
+
+        payload = {
+            "contents": [{
+                "parts": [
+                    {"text": prompt},
+                    {
+                        "inline_data": {
+                            "mime_type": "image/jpeg",
+                            "data": image_b64
+                        }
+                    }
+                ]
+            }]
+        }
+
+        data = await self._generate_content(self.router.choose("auto_tag"), payload, timeout=30, hedge=True)
+
+        text = self._extract_text(data)
+        if text is None:
+            raise ValueError("Empty Auto-Tag answer from Gemini")
+        text = self._strip_json_fences(text)
+        try:
+            result = json.loads(text)
+        except ValueError:
+            logger.error(f"Failed to parse Gemini Auto-Tag JSON: {text}")
+            raise ValueError("Invalid Auto-Tag JSON from Gemini")
+        if not isinstance(result, dict):
+            raise ValueError("Invalid Auto-Tag JSON from Gemini")
+        return result
+
+    async def auto_tag_items(self, images_b64: List[str], language: str = 'ru') -> List[Optional[Dict[str, Any]]]:
+        """
+        Auto-tag several clothing images in ONE Gemini request.
+        Returns one dict per image, in input order, with the same schema as
+        `auto_tag_item`, or None for an image the model could not tag.
+        Images found in the pHash cache are not sent. Raises when the
+        Gemini call itself fails (nothing was tagged).
+        """
+        if not self.api_key:
+            raise Exception("Gemini API not configured")
+
+        namespace = f"auto_tag:{language}"
+        hashes = await asyncio.gather(*[image_signature_b64(b64) for b64 in images_b64])
+        results: List[Optional[Dict[str, Any]]] = [
+            await phash_cache.get(namespace, h) for h in hashes
+        ]
+        missing = [i for i, r in enumerate(results) if r is None]
+        if not missing:
+            return results
+
+        start = time.perf_counter()
+        fresh = await self._auto_tag_items([images_b64[i] for i in missing], language)
+        per_item_ms = (time.perf_counter() - start) * 1000 / len(missing)
+        for i, result in zip(missing, fresh):
+            results[i] = result
+            if result is not None:
+                await phash_cache.set(namespace, hashes[i], result, per_item_ms)
+        return results
+
+    async def _auto_tag_items(self, images_b64: List[str], language: str = 'ru') -> List[Optional[Dict[str, Any]]]:
+        """
+        Uncached batch call behind `auto_tag_items`. Upstream failures
+        (transport, 429/5xx, open circuit) raise for the whole batch; only
+        when the model answers with a mismatched or unparsable array are
+        the images re-tagged one by one (None where that fails too).
+        """
+        if len(images_b64) == 1:
+            return [await self._auto_tag_item(images_b64[0], language=language)]
+
+        lang_instruction = self._auto_tag_lang_instruction(language)
+        count = len(images_b64)
+
+        prompt = f"""
+            You will receive {count} images, each showing ONE clothing item, in order (image 1 .. image {count}).
+            Analyze each image separately. Your task is to extract attributes for a digital wardrobe.
+            For every image provide the following fields:
+{self._auto_tag_fields(lang_instruction)}
+            Return ONLY a valid JSON array with exactly {count} objects, in the same order as the images.
+            Do not wrap in Markdown code blocks.
+            """
+
+        normalized = await asyncio.gather(*[normalize_image_b64(b64) for b64 in images_b64])
+        parts: List[Dict[str, Any]] = [{"text": prompt}]
+        for i, b64 in enumerate(normalized, start=1):
+            parts.append({"text": f"Image {i}:"})
+            parts.append({"inline_data": {"mime_type": "image/jpeg", "data": b64}})
+
+        data = await self._generate_content(
+            self.router.choose("auto_tag"),
+            {"contents": [{"parts": parts}]},
+            timeout=30 + 10 * count,
+        )
+        text = self._extract_text(data)
+        try:
+            results = json.loads(self._strip_json_fences(text or ""))
+        except ValueError:
+            results = None
+        if isinstance(results, list) and len(results) == count and all(isinstance(r, dict) for r in results):
+            return results
+        logger.warning(f"Gemini Auto-Tag batch returned {type(results).__name__} for {count} images, retrying singly")
+
+        singles = await asyncio.gather(
+            *[self._auto_tag_item(b64, language=language) for b64 in normalized],
+            return_exceptions=True,
+        )
+        out: List[Optional[Dict[str, Any]]] = []
+        for result in singles:
+            if isinstance(result, BaseException):
+                logger.error(f"Gemini Auto-Tag error: {result}")
+                out.append(None)
+            else:
+                out.append(result)
+        return out
 
 
 # Initialize singleton
@@ -0,0 +1,162 @@
+"""Gemini explicit context caching (cachedContents) for static prompt prefixes."""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiContextCache:
+    """
+    Keeps one `cachedContents` entry per static prompt prefix.
+
+    The persona prompt is uploaded once as the system instruction of a
+    cached content; requests then reference it by name instead of resending
+    it. If creation fails (e.g. the prefix is below the model's minimum
+    cacheable size) the key is skipped for a while and callers fall back
+    to sending the prefix inline.
+    """
+
+    # Refresh this long before Gemini expires the entry
+    REFRESH_MARGIN = 60
+    # How long to stop retrying a key whose creation failed
+    FAILURE_BACKOFF = 600
+
+    def __init__(self, base_url: str, ttl_seconds: int = 3600, enabled: bool = True):
+        self.base_url = base_url.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries: Dict[Hashable, Tuple[str, float]] = {}  # key -> (name, expires_at)
+        self._failed_until: Dict[Hashable, float] = {}
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+        self.stats: Dict[str, Any] = {
+            "created": 0,
+            "create_failures": 0,
+            "calls_cached": 0,
+            "calls_uncached": 0,
+            "cached_tokens_total": 0,
+            "prompt_tokens_cached_calls": 0,
+            "prompt_tokens_uncached_calls": 0,
+            "latency_ms_cached_total": 0.0,
+            "latency_ms_uncached_total": 0.0,
+        }
+
+    async def get(
+        self,
+        client: httpx.AsyncClient,
+        api_key: str,
+        model: str,
+        key: Hashable,
+        system_text: str,
+    ) -> Optional[str]:
+        """Return a cachedContents name for `key`, creating it if needed."""
+        if not self.enabled:
+            return None
+
+        cache_key = (model, key)
+        now = time.time()
+        entry = self._entries.get(cache_key)
+        if entry and entry[1] - self.REFRESH_MARGIN > now:
+            return entry[0]
+        if self._failed_until.get(cache_key, 0) > now:
+            return None
+
+        lock = self._locks.setdefault(cache_key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(cache_key)
+            if entry and entry[1] - self.REFRESH_MARGIN > time.time():
+                return entry[0]
+
+            name = await self._create(client, api_key, model, system_text)
+            if name is None:
+                self._failed_until[cache_key] = time.time() + self.FAILURE_BACKOFF
+                return None
+
+            self._entries[cache_key] = (name, time.time() + self.ttl_seconds)
+            return name
+
+    async def _create(self, client: httpx.AsyncClient, api_key: str, model: str, system_text: str) -> Optional[str]:
+        try:
+            response = await client.post(
+                f"{self.base_url}/cachedContents",
+                params={"key": api_key},
+                json={
+                    "model": f"models/{model}",
+                    "systemInstruction": {"parts": [{"text": system_text}]},
+                    "ttl": f"{self.ttl_seconds}s",
+                },
+                timeout=15,
+            )
+        except httpx.HTTPError as e:
+            logger.warning(f"Gemini context cache create failed: {e}")
+            self.stats["create_failures"] += 1
+            return None
+
+        if response.status_code != 200:
+            logger.warning(f"Gemini context cache create error: {response.status_code} - {response.text[:300]}")
+            self.stats["create_failures"] += 1
+            return None
+
+        try:
+            data = response.json()
+        except ValueError:
+            logger.warning("Gemini context cache create returned a non-JSON body")
+            self.stats["create_failures"] += 1
+            return None
+
+        name = data.get("name")
+        if name:
+            self.stats["created"] += 1
+            tokens = (data.get("usageMetadata") or {}).get("totalTokenCount")
+            logger.info(f"✅ Gemini context cache created: {name} ({tokens} tokens)")
+        return name
+
+    def invalidate(self, model: str, key: Hashable) -> None:
+        """Forget an entry (e.g. Gemini reported it as expired/unknown)."""
+        self._entries.pop((model, key), None)
+
+    def record(self, cached: bool, usage: Dict[str, Any], elapsed_ms: float) -> None:
+        """Account one generateContent call using its usageMetadata."""
+        prompt_tokens = int(usage.get("promptTokenCount") or 0)
+        if cached:
+            cached_tokens = int(usage.get("cachedContentTokenCount") or 0)
+            self.stats["calls_cached"] += 1
+            self.stats["cached_tokens_total"] += cached_tokens
+            self.stats["prompt_tokens_cached_calls"] += prompt_tokens
+            self.stats["latency_ms_cached_total"] += elapsed_ms
+            logger.info(
+                f"Gemini context cache: {cached_tokens}/{prompt_tokens} prompt tokens from cache, {elapsed_ms:.0f} ms"
+            )
+        else:
+            self.stats["calls_uncached"] += 1
+            self.stats["prompt_tokens_uncached_calls"] += prompt_tokens
+            self.stats["latency_ms_uncached_total"] += elapsed_ms
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-call averages: cached tokens and latency difference vs. uncached calls."""
+        s = self.stats
+        cached_calls = s["calls_cached"]
+        uncached_calls = s["calls_uncached"]
+
+        avg_cached_ms = s["latency_ms_cached_total"] / cached_calls if cached_calls else None
+        avg_uncached_ms = s["latency_ms_uncached_total"] / uncached_calls if uncached_calls else None
+
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "created": s["created"],
+            "create_failures": s["create_failures"],
+            "calls_cached": cached_calls,
+            "calls_uncached": uncached_calls,
+            "avg_cached_tokens_per_call": round(s["cached_tokens_total"] / cached_calls, 1) if cached_calls else 0,
+            "avg_latency_ms_cached": round(avg_cached_ms, 1) if avg_cached_ms is not None else None,
+            "avg_latency_ms_uncached": round(avg_uncached_ms, 1) if avg_uncached_ms is not None else None,
+            "avg_ms_saved_per_call": (
+                round(avg_uncached_ms - avg_cached_ms, 1)
+                if avg_cached_ms is not None and avg_uncached_ms is not None else None
+            ),
+        }
@@ -0,0 +1,153 @@
+"""Latency-aware choice between the full and light Gemini models."""
+import logging
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Task -> tier. Open-ended styling gets the full model; short or
+# structured outputs (JSON tags, summaries, captions) get the light one.
+TASK_TIERS: Dict[str, str] = {
+    "consultant": "full",
+    "consultant_image": "full",
+    "analyze_outfit": "full",
+    "auto_tag": "light",
+    "summary": "light",
+    "describe_image": "light",
+}
+
+
+class ModelStats:
+    """Rolling window of (timestamp, latency_ms, ok) for one model."""
+
+    def __init__(self, window: int, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.samples: Deque[Tuple[float, float, bool]] = deque(maxlen=window)
+
+    def add(self, latency_ms: float, ok: bool) -> None:
+        self.samples.append((time.time(), latency_ms, ok))
+
+    def _recent(self) -> List[Tuple[float, float, bool]]:
+        cutoff = time.time() - self.window_seconds
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+        return list(self.samples)
+
+    def snapshot(self) -> Dict[str, Any]:
+        recent = self._recent()
+        latencies = sorted(s[1] for s in recent if s[2])
+        errors = sum(1 for s in recent if not s[2])
+
+        def pct(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+        return {
+            "samples": len(recent),
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "error_rate": round(errors / len(recent), 3) if recent else 0.0,
+        }
+
+
+class GeminiModelRouter:
+    """
+    Picks a model per task and moves traffic off a degraded model.
+
+    Each task has a preferred tier (full/light). A model counts as degraded
+    when, over the rolling window and with enough samples, its error rate
+    or p95 latency is above the configured limit; its traffic then goes to
+    the other tier's model, except a small probe share that lets it recover.
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, str],
+        max_error_rate: float,
+        max_p95_ms: Dict[str, float],
+        min_samples: int,
+        probe_rate: float,
+        window: int = 200,
+        window_seconds: float = 300,
+    ):
+        self.models = models
+        self.max_error_rate = max_error_rate
+        self.max_p95_ms = max_p95_ms
+        self.min_samples = min_samples
+        self.probe_rate = probe_rate
+        self._stats: Dict[str, ModelStats] = {
+            model: ModelStats(window, window_seconds) for model in set(models.values())
+        }
+        self._window = window
+        self._window_seconds = window_seconds
+        self.decisions: Counter = Counter()
+
+    def _tier_of(self, model: str) -> str:
+        for tier, name in self.models.items():
+            if name == model:
+                return tier
+        return "full"
+
+    def health(self, model: str) -> Tuple[bool, str]:
+        """(healthy, reason) for `model` from its rolling stats."""
+        snap = self._stats[model].snapshot()
+        if snap["samples"] < self.min_samples:
+            return True, "warming_up"
+        if snap["error_rate"] > self.max_error_rate:
+            return False, "error_rate"
+        limit = self.max_p95_ms.get(self._tier_of(model))
+        if limit and snap["p95_ms"] is not None and snap["p95_ms"] > limit:
+            return False, "p95"
+        return True, "ok"
+
+    def choose(self, task: str) -> str:
+        tier = TASK_TIERS.get(task, "full")
+        primary = self.models[tier]
+        alternate = self.models["light" if tier == "full" else "full"]
+
+        reason = "preferred"
+        model = primary
+        if alternate != primary:
+            healthy, why = self.health(primary)
+            if not healthy and self.health(alternate)[0]:
+                if random.random() < self.probe_rate:
+                    reason = "probe"
+                else:
+                    model, reason = alternate, f"shifted:{why}"
+
+        self.decisions[(task, model, reason)] += 1
+        if reason.startswith("shifted") and self.decisions[(task, model, reason)] == 1:
+            logger.warning(f"Gemini router: {primary} degraded ({reason}), routing '{task}' to {model}")
+        return model
+
+    def record(self, model: str, latency_ms: float, ok: bool) -> None:
+        stats = self._stats.get(model)
+        if stats is None:
+            stats = self._stats[model] = ModelStats(self._window, self._window_seconds)
+        stats.add(latency_ms, ok)
+
+    def summary(self) -> Dict[str, Any]:
+        models = {}
+        for model, stats in self._stats.items():
+            healthy, why = self.health(model)
+            models[model] = {**stats.snapshot(), "healthy": healthy, "status": why}
+
+        decisions: Dict[str, Dict[str, int]] = {}
+        for (task, model, reason), count in sorted(self.decisions.items()):
+            decisions.setdefault(task, {})[f"{model} ({reason})"] = count
+
+        return {"tiers": dict(self.models), "models": models, "decisions": decisions}
+
+
+model_router = GeminiModelRouter(
+    models={"full": settings.GEMINI_MODEL_FULL, "light": settings.GEMINI_MODEL_LIGHT},
+    max_error_rate=settings.GEMINI_ROUTER_MAX_ERROR_RATE,
+    max_p95_ms={"full": settings.GEMINI_ROUTER_MAX_P95_MS_FULL, "light": settings.GEMINI_ROUTER_MAX_P95_MS_LIGHT},
+    min_samples=settings.GEMINI_ROUTER_MIN_SAMPLES,
+    probe_rate=settings.GEMINI_ROUTER_PROBE_RATE,
+)
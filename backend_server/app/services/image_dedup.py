@@ -0,0 +1,311 @@
+"""Collapse duplicate images across search sources: URL canonicalization + perceptual hashes of thumbnails."""
+import asyncio
+import logging
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+from app.config import settings
+from app.services.image_fetcher import ImageFetchError, image_fetcher
+from app.services.image_normalizer import run_in_image_pool
+from app.services.perceptual_cache import ImageSignature, _to_signed, _to_unsigned, color_distance, signature_bytes
+from app.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Query params that only select a size/format/cache version of the same
+# picture. Only stripped on image CDNs known to use them that way: on other
+# hosts `img.php?s=123` may be what identifies the image, so the params stay
+# and near-duplicates there are left to the perceptual hash.
+_VARIANT_PARAMS = {
+    "w", "h", "width", "height", "size", "sz", "s", "resize", "fit", "crop", "dpr",
+    "quality", "qlt", "q", "fm", "format", "auto", "imwidth", "imheight", "sw", "sh",
+    "v", "ver", "version", "cb", "t", "ts", "_", "timestamp", "ssl", "strip", "zoom",
+}
+_VARIANT_PARAM_HOSTS = (
+    "wp.com", "wordpress.com",                 # Jetpack Photon / wordpress.com media
+    "shopify.com", "myshopify.com",            # cdn.shopify.com, shop domains' /cdn/shop
+    "imgix.net",
+    "ctfassets.net",                           # Contentful images API
+    "cdn.sanity.io",
+    "squarespace-cdn.com",
+)
+# i0.wp.com/example.com/a.jpg -> example.com/a.jpg
+_PROXY_HOST_RE = re.compile(r"^i\d\.wp\.com$")
+# Size markers in file names: WordPress "-300x200", Shopify "_600x600"/"_large", Amazon "._AC_SX679_"
+_PATH_VARIANT_RES = (
+    re.compile(r"-\d{2,4}x\d{2,4}(?=\.\w{3,4}$)"),
+    re.compile(r"_(?:\d{2,4}x\d{0,4}|\d{0,4}x\d{2,4}|pico|icon|thumb|small|compact|medium|large|grande|master)(?:@\dx)?(?=\.\w{3,4}$)"),
+    re.compile(r"\._[A-Z0-9_,]+_(?=\.\w{3,4}$)"),
+)
+
+
+def _is_variant_param_host(host: str) -> bool:
+    return any(host == h or host.endswith("." + h) for h in _VARIANT_PARAM_HOSTS)
+
+
+def canonical_image_url(url: str) -> str:
+    """
+    One key for CDN variants of the same image: scheme/www/fragment dropped,
+    size and cache-buster params removed on known image CDNs, size suffixes
+    stripped from the file name.
+    """
+    try:
+        parsed = urlparse((url or "").strip())
+    except ValueError:
+        return url or ""
+    host = (parsed.hostname or "").lower()
+    path = parsed.path or "/"
+    strip_params = _is_variant_param_host(host) or "/cdn/shop/" in path
+
+    if _PROXY_HOST_RE.match(host) and path.count("/") >= 2:
+        host, _, path = path.lstrip("/").partition("/")
+        path = "/" + path
+    if host.startswith("www."):
+        host = host[4:]
+
+    path = re.sub(r"/{2,}", "/", path)
+    for pattern in _PATH_VARIANT_RES:
+        path = pattern.sub("", path)
+
+    params = parse_qsl(parsed.query, keep_blank_values=True)
+    if strip_params:
+        params = [(k, v) for k, v in params if k.lower() not in _VARIANT_PARAMS]
+    query = sorted(params)
+    return urlunparse(("", host, path, "", urlencode(query), ""))
+
+
+class ImageDeduper:
+    """
+    `dedupe` keeps the first item of every group of duplicates, in order.
+
+    1. exact match on `canonical_image_url`
+    2. perceptual hash of the provider thumbnail (Google thumbnailLink /
+       DDG thumbnail) within `max_distance` bits and color signature within
+       `max_color_distance`, which catches the same photo re-hosted under
+       unrelated URLs but keeps color variants of one product shot (pHash
+       alone is grayscale: red, navy and black versions hash alike)
+
+    Signatures are cached by canonical URL in memory and SQLite, so repeat
+    queries don't download anything. Hashing has a time budget: items whose
+    hash isn't ready in time are kept as they are.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_distance: int,
+        max_color_distance: float,
+        ttl: float,
+        concurrency: int,
+        wait: float,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.max_color_distance = max_color_distance
+        self.ttl = ttl
+        self.wait = wait
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._memory = TTLCache(maxsize=50000, ttl=ttl)
+        self._failed = TTLCache(maxsize=10000, ttl=3600)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path = db_path
+
+        self.stats: Dict[str, int] = {
+            "items": 0,
+            "url_duplicates": 0,
+            "phash_duplicates": 0,
+            "color_variants_kept": 0,
+            "hash_memory_hits": 0,
+            "hash_disk_hits": 0,
+            "hashes_computed": 0,
+            "hash_errors": 0,
+            "hash_timeouts": 0,
+        }
+
+    # --- disk tier -----------------------------------------------------------
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and self._db_path:
+            try:
+                Path(self._db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+                # Rows of the pHash-only table have no color signature: start over
+                self._db.execute("DROP TABLE IF EXISTS image_hashes")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS image_signatures ("
+                    " url TEXT PRIMARY KEY, hash INTEGER NOT NULL, color BLOB NOT NULL, created REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Image hash cache disk tier disabled: {e}")
+                self._db_path = ""
+                self._db = None
+        return self._db
+
+    def _disk_read(self, urls: List[str]) -> Dict[str, ImageSignature]:
+        with self._db_lock:
+            db = self._connect()
+            if db is None or not urls:
+                return {}
+            marks = ",".join("?" * len(urls))
+            rows = db.execute(
+                f"SELECT url, hash, color FROM image_signatures WHERE url IN ({marks}) AND created > ?",
+                (*urls, time.time() - self.ttl),
+            ).fetchall()
+        return {url: ImageSignature(_to_unsigned(h), bytes(color)) for url, h, color in rows}
+
+    def _disk_write(self, url: str, sig: ImageSignature) -> None:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO image_signatures (url, hash, color, created) VALUES (?, ?, ?, ?)",
+                    (url, _to_signed(sig.phash), sig.color, time.time()),
+                )
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Image hash cache write failed: {e}")
+
+    # --- hashing -------------------------------------------------------------
+
+    async def _compute(self, key: str, thumb_url: str) -> Optional[ImageSignature]:
+        async with self._semaphore:
+            try:
+                data, _ = await image_fetcher.fetch(thumb_url)
+            except ImageFetchError as e:
+                self.stats["hash_errors"] += 1
+                self._failed.set(key, True)
+                logger.debug(f"Thumbnail for dedup not fetched: {e}")
+                return None
+            sig = await run_in_image_pool(signature_bytes, data)
+
+        if sig is None:
+            self.stats["hash_errors"] += 1
+            self._failed.set(key, True)
+            return None
+        self.stats["hashes_computed"] += 1
+        self._memory.set(key, sig)
+        await asyncio.to_thread(self._disk_write, key, sig)
+        return sig
+
+    def _schedule(self, key: str, thumb_url: str) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._compute(key, thumb_url))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return task
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()
+
+    async def _hashes(self, keyed: Dict[str, str], wait: float) -> Dict[str, ImageSignature]:
+        """canonical url -> signature for `keyed` (canonical url -> thumbnail url), within `wait` seconds."""
+        hashes: Dict[str, ImageSignature] = {}
+        for key in keyed:
+            h = self._memory.get(key)
+            if h is not None:
+                hashes[key] = h
+                self.stats["hash_memory_hits"] += 1
+
+        missing = [k for k in keyed if k not in hashes and k not in self._failed]
+        if missing:
+            found = await asyncio.to_thread(self._disk_read, missing)
+            for key, h in found.items():
+                self._memory.set(key, h)
+                hashes[key] = h
+            self.stats["hash_disk_hits"] += len(found)
+            missing = [k for k in missing if k not in found]
+
+        if missing and wait > 0:
+            tasks = {key: self._schedule(key, keyed[key]) for key in missing}
+            # shield: late hashes still land in the cache for the next request
+            await asyncio.wait([asyncio.shield(t) for t in tasks.values()], timeout=wait)
+            for key, task in tasks.items():
+                if task.done() and not task.cancelled() and task.exception() is None and task.result() is not None:
+                    hashes[key] = task.result()
+                elif not task.done():
+                    self.stats["hash_timeouts"] += 1
+        return hashes
+
+    # --- api -----------------------------------------------------------------
+
+    def dedupe_urls(self, items: List[Dict[str, Any]], url_key: str) -> List[Dict[str, Any]]:
+        """Step 1 only (sync, no I/O): drop items whose canonical URL was already seen."""
+        seen = set()
+        kept = []
+        for item in items:
+            key = canonical_image_url(item.get(url_key) or "")
+            if key in seen:
+                self.stats["url_duplicates"] += 1
+                continue
+            seen.add(key)
+            kept.append(item)
+        return kept
+
+    async def dedupe(
+        self,
+        items: List[Dict[str, Any]],
+        url_key: str,
+        thumb_key: str,
+        wait: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        if not self.enabled or not items:
+            return items
+        self.stats["items"] += len(items)
+        items = self.dedupe_urls(items, url_key)
+
+        keyed = {
+            canonical_image_url(item[url_key]): item[thumb_key]
+            for item in items
+            if item.get(url_key) and item.get(thumb_key)
+        }
+        hashes = await self._hashes(keyed, self.wait if wait is None else wait)
+
+        kept: List[Dict[str, Any]] = []
+        kept_sigs: List[ImageSignature] = []
+        for item in items:
+            sig = hashes.get(canonical_image_url(item.get(url_key) or ""))
+            if sig is not None:
+                similar = [other for other in kept_sigs if (sig.phash ^ other.phash).bit_count() <= self.max_distance]
+                if any(color_distance(sig.color, other.color) <= self.max_color_distance for other in similar):
+                    self.stats["phash_duplicates"] += 1
+                    continue
+                if similar:
+                    self.stats["color_variants_kept"] += 1
+                kept_sigs.append(sig)
+            kept.append(item)
+        return kept
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "max_distance": self.max_distance,
+            "max_color_distance": self.max_color_distance,
+            "inflight": len(self._inflight),
+            "hashes_in_memory": len(self._memory),
+        }
+
+
+image_deduper = ImageDeduper(
+    db_path=settings.IMAGE_DEDUP_CACHE_PATH,
+    max_distance=settings.IMAGE_DEDUP_MAX_DISTANCE,
+    max_color_distance=settings.IMAGE_DEDUP_MAX_COLOR_DISTANCE,
+    ttl=settings.IMAGE_DEDUP_CACHE_TTL,
+    concurrency=settings.IMAGE_DEDUP_CONCURRENCY,
+    wait=settings.IMAGE_DEDUP_WAIT,
+    enabled=settings.IMAGE_DEDUP_ENABLED,
+)
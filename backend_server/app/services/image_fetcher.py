@@ -0,0 +1,343 @@
+"""Shared async image downloader: pooled client, size/type limits, URL cache, single-flight."""
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from app.config import settings
+from app.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Magic bytes for servers that send no/incorrect Content-Type
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_MAX_REDIRECTS = 5
+_REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class ImageFetchError(Exception):
+    """Download failed, was too large, or the body is not an image."""
+
+
+class UnsafeURLError(ImageFetchError):
+    """URL (or a redirect target) is not a public http(s) address."""
+
+
+def _is_public_ip(ip: ipaddress._BaseAddress) -> bool:
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def check_public_url(url: str) -> None:
+    """
+    Raise UnsafeURLError unless `url` is http(s) and its host resolves only
+    to public addresses: downloads must not reach into the local network
+    (cloud metadata, Meili, other services on the box).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise UnsafeURLError(f"Unsupported URL: {url}")
+    host = parsed.hostname.lower()
+    if host == "localhost" or host.endswith(".localhost") or host.endswith(".local") or host.endswith(".internal"):
+        raise UnsafeURLError(f"Host not allowed: {host}")
+
+    try:
+        addresses = [ipaddress.ip_address(host)]
+    except ValueError:
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, parsed.port or None, type=socket.SOCK_STREAM)
+        except (socket.gaierror, UnicodeError) as e:
+            raise ImageFetchError(f"Cannot resolve {host}: {e}") from e
+        addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    if not addresses or not all(_is_public_ip(ip) for ip in addresses):
+        raise UnsafeURLError(f"Host not allowed: {host}")
+
+
+def sniff_image_type(data: bytes) -> str:
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return ""
+
+
+@asynccontextmanager
+async def open_public(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    allow_private: bool = False,
+) -> AsyncIterator[httpx.Response]:
+    """
+    Streamed request with redirects followed by hand (the client must not
+    follow them itself): every hop goes through `check_public_url` first.
+    """
+    target = url
+    for _ in range(_MAX_REDIRECTS + 1):
+        if not allow_private:
+            await check_public_url(target)
+        async with client.stream(method, target, headers=headers) as response:
+            if response.status_code in _REDIRECT_CODES and "location" in response.headers:
+                target = urljoin(target, response.headers["location"])
+                continue
+            yield response
+            return
+    raise ImageFetchError(f"Too many redirects: {url}")
+
+
+class ImageFetcher:
+    """
+    Downloads images by URL for Gemini / fal calls.
+
+    - one keep-alive client for all callers
+    - Content-Length and streamed size capped at `max_bytes`
+    - non-image responses rejected (header, then magic bytes)
+    - only public hosts, checked again on every redirect hop (unless
+      `allow_private`, for local development)
+    - recent URLs served from memory, then from disk; both tiers are capped
+      in bytes (the disk tier is pruned only when a running byte count of
+      the directory passes `disk_max_bytes`, not scanned on every write)
+    - concurrent fetches of the same URL share one download
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        timeout: float,
+        memory_entries: int,
+        memory_max_bytes: int,
+        ttl: float,
+        cache_dir: str,
+        disk_max_bytes: int,
+        allow_private: bool = False,
+    ):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.ttl = ttl
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.allow_private = allow_private
+        self._memory = TTLCache(
+            maxsize=memory_entries,
+            ttl=ttl,
+            maxbytes=memory_max_bytes,
+            sizeof=lambda entry: len(entry[0]),
+        )
+        self._disk_bytes: Optional[int] = None  # running size of cache_dir, None until first scanned
+        self._disk_lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.stats: Dict[str, int] = {
+            "downloads": 0,
+            "download_errors": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "deduplicated": 0,
+            "bytes_downloaded": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+                timeout=httpx.Timeout(self.timeout, connect=5.0),
+                # Redirects are followed by open_public, which checks every hop
+                follow_redirects=False,
+                headers={"User-Agent": "Mozilla/5.0 (compatible; WAURA-image-fetcher)"},
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def fetch(self, url: str, use_cache: bool = True) -> Tuple[bytes, str]:
+        """
+        Return (bytes, mime_type) for `url`. Raises ImageFetchError.
+
+        `use_cache=False` skips both cache tiers (e.g. one-off result URLs)
+        but still joins an in-flight download of the same URL.
+        """
+        if use_cache:
+            cached = self._memory.get(url)
+            if cached is not None:
+                self.stats["memory_hits"] += 1
+                return cached
+
+        task = self._inflight.get(url)
+        if task is not None:
+            self.stats["deduplicated"] += 1
+        else:
+            task = asyncio.create_task(self._load(url, use_cache))
+            self._inflight[url] = task
+            task.add_done_callback(lambda t: self._finish(url, t))
+
+        # shield: one cancelled caller must not abort the download for the others
+        return await asyncio.shield(task)
+
+    def _finish(self, url: str, task: asyncio.Task) -> None:
+        self._inflight.pop(url, None)
+        # Mark the error as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    async def _load(self, url: str, use_cache: bool) -> Tuple[bytes, str]:
+        if use_cache and self.cache_dir is not None:
+            hit = await asyncio.to_thread(self._disk_read, url)
+            if hit is not None:
+                self.stats["disk_hits"] += 1
+                self._memory.set(url, hit)
+                return hit
+
+        result = await self._download(url)
+        if use_cache:
+            self._memory.set(url, result)
+            if self.cache_dir is not None:
+                await asyncio.to_thread(self._disk_write, url, *result)
+        return result
+
+    async def _download(self, url: str) -> Tuple[bytes, str]:
+        self.stats["downloads"] += 1
+        try:
+            return await self._download_checked(url)
+        except ImageFetchError:
+            self.stats["download_errors"] += 1
+            raise
+        except httpx.HTTPError as e:
+            self.stats["download_errors"] += 1
+            raise ImageFetchError(f"Download failed for {url}: {e}") from e
+
+    async def _download_checked(self, url: str) -> Tuple[bytes, str]:
+        async with open_public(self._get_client(), "GET", url, allow_private=self.allow_private) as response:
+            return await self._read_image(url, response)
+
+    async def _read_image(self, url: str, response: httpx.Response) -> Tuple[bytes, str]:
+        if response.status_code != 200:
+            raise ImageFetchError(f"HTTP {response.status_code} for {url}")
+
+        declared = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        if declared and not declared.startswith("image/") and declared != "application/octet-stream":
+            raise ImageFetchError(f"Not an image ({declared}): {url}")
+
+        length = response.headers.get("content-length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise ImageFetchError(f"Image too large ({length} bytes): {url}")
+
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise ImageFetchError(f"Image exceeds {self.max_bytes} bytes: {url}")
+            chunks.append(chunk)
+
+        data = b"".join(chunks)
+        mime = sniff_image_type(data) or (declared if declared.startswith("image/") else "")
+        if not mime:
+            raise ImageFetchError(f"Unrecognized image data: {url}")
+
+        self.stats["bytes_downloaded"] += size
+        return data, mime
+
+    # --- disk tier -----------------------------------------------------------
+
+    def _disk_path(self, url: str) -> Path:
+        return self.cache_dir / hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    def _disk_read(self, url: str) -> Optional[Tuple[bytes, str]]:
+        path = self._disk_path(url)
+        try:
+            if path.stat().st_mtime + self.ttl < time.time():
+                path.unlink(missing_ok=True)
+                return None
+            raw = path.read_bytes()
+        except OSError:
+            return None
+        mime, _, data = raw.partition(b"\n")
+        return data, mime.decode("ascii", "ignore")
+
+    def _disk_write(self, url: str, data: bytes, mime: str) -> None:
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            path = self._disk_path(url)
+            tmp = path.with_suffix(".tmp")
+            raw = mime.encode("ascii") + b"\n" + data
+            tmp.write_bytes(raw)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Image cache write failed: {e}")
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._disk_scan()[1]
+            else:
+                self._disk_bytes += len(raw)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._disk_bytes = self._disk_prune()
+
+    def _disk_scan(self) -> Tuple[list, int]:
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file():
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        return files, total
+
+    def _disk_prune(self) -> int:
+        """Drop the oldest files until the directory is under 90% of `disk_max_bytes`; returns its size."""
+        files, total = self._disk_scan()
+        if total <= self.disk_max_bytes:
+            return total
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.disk_max_bytes * 0.9:
+                break
+        return total
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, "inflight": len(self._inflight), "memory": self._memory.stats()}
+
+
+image_fetcher = ImageFetcher(
+    max_bytes=settings.IMAGE_FETCH_MAX_BYTES,
+    timeout=settings.IMAGE_FETCH_TIMEOUT,
+    memory_entries=settings.IMAGE_FETCH_MEMORY_ENTRIES,
+    memory_max_bytes=settings.IMAGE_FETCH_MEMORY_MAX_MB * 1024 * 1024,
+    ttl=settings.IMAGE_FETCH_CACHE_TTL,
+    cache_dir=settings.IMAGE_FETCH_CACHE_DIR,
+    disk_max_bytes=settings.IMAGE_FETCH_DISK_MAX_MB * 1024 * 1024,
+    allow_private=settings.IMAGE_FETCH_ALLOW_PRIVATE,
+)
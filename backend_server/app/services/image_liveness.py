@@ -0,0 +1,295 @@
+"""Liveness checks for external image URLs in inspiration feeds (HEAD/range probes, verdict cache, domain blocking)."""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from app.config import settings
+from app.services.image_fetcher import ImageFetchError, UnsafeURLError, open_public, sniff_image_type
+from app.services.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Same kind of request the Flutter app makes: no Referer, mobile UA
+_PROBE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Linux; Android 14) AppleWebKit/537.36 (KHTML, like Gecko) Mobile Safari/537.36",
+    "Accept": "image/avif,image/webp,image/*,*/*;q=0.8",
+}
+# HEAD is often refused or answered without headers; these fall back to a ranged GET
+_HEAD_RETRY_STATUSES = {400, 403, 405, 501}
+
+
+def _domain(url: str) -> str:
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+class DomainStats:
+    def __init__(self):
+        self.probes = 0
+        self.failures = 0
+        self.errors = 0  # timeouts / connection errors: not part of failure_rate
+        self.blocked_until = 0.0
+        self.last_error = ""
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.probes if self.probes else 0.0
+
+
+class ImageLivenessVerifier:
+    """
+    Drops dead image URLs (404, hotlink-blocked, not an image) from feeds.
+
+    - verdicts are cached per URL (alive / dead, with separate TTLs)
+    - unknown URLs are probed in the background: HEAD first, then a GET
+      for the first KB when HEAD is refused; only public hosts are probed,
+      checked on every redirect hop, and anything else is dropped; at most `concurrency` probes
+      run at once and excess URLs are skipped rather than queued forever
+    - `filter` waits up to `wait` seconds for fresh probes, then returns;
+      slower probes keep running and serve the next request
+    - per-domain failure stats; a domain with enough answered probes and a
+      high failure rate (error statuses, non-image bodies) is blocked for
+      `block_ttl` and its URLs are dropped without probing. Timeouts and
+      connection errors are counted apart and never block a domain: a slow
+      CDN still serves its images
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        timeout: float,
+        alive_ttl: float,
+        dead_ttl: float,
+        max_pending: int,
+        block_min_probes: int,
+        block_failure_rate: float,
+        block_ttl: float,
+        enabled: bool = True,
+        allow_private: bool = False,
+    ):
+        self.enabled = enabled
+        self.allow_private = allow_private
+        self.timeout = timeout
+        self.alive_ttl = alive_ttl
+        self.dead_ttl = dead_ttl
+        self.max_pending = max_pending
+        self.block_min_probes = block_min_probes
+        self.block_failure_rate = block_failure_rate
+        self.block_ttl = block_ttl
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._verdicts = TTLCache(maxsize=50000, ttl=alive_ttl)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._domains: Dict[str, DomainStats] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+        self.stats: Dict[str, int] = {
+            "checked": 0,
+            "dropped_dead": 0,
+            "dropped_blocked_domain": 0,
+            "probes": 0,
+            "probe_failures": 0,
+            "probe_errors": 0,
+            "skipped_queue_full": 0,
+            "domains_blocked": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 3.0)),
+                # Redirects are followed by open_public, which checks every hop
+                follow_redirects=False,
+                headers=_PROBE_HEADERS,
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    # --- probing -------------------------------------------------------------
+
+    async def _probe(self, url: str) -> Optional[str]:
+        """None if `url` serves an image, otherwise the reason it's dead."""
+        client = self._get_client()
+        async with open_public(client, "HEAD", url, allow_private=self.allow_private) as response:
+            pass
+        if response.status_code in _HEAD_RETRY_STATUSES or (
+            response.status_code == 200 and not response.headers.get("content-type")
+        ):
+            async with open_public(
+                client, "GET", url, headers={"Range": "bytes=0-1023"}, allow_private=self.allow_private
+            ) as response:
+                head = b""
+                async for chunk in response.aiter_bytes():
+                    head += chunk
+                    if len(head) >= 1024:
+                        break
+            if response.status_code not in (200, 206):
+                return f"HTTP {response.status_code}"
+            declared = response.headers.get("content-type", "").split(";")[0].strip().lower()
+            if declared.startswith("image/") or sniff_image_type(head):
+                return None
+            return f"not an image ({declared or 'unknown'})"
+
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        declared = response.headers.get("content-type", "").split(";")[0].strip().lower()
+        if declared.startswith("image/") or declared == "application/octet-stream":
+            return None
+        return f"not an image ({declared})"
+
+    async def _verify(self, url: str) -> bool:
+        async with self._semaphore:
+            self.stats["probes"] += 1
+            try:
+                reason = await self._probe(url)
+            except UnsafeURLError as e:
+                # Never reported as alive: the verdict must not reveal anything about internal hosts
+                self._verdicts.set(url, False, ttl=self.dead_ttl)
+                logger.debug(f"Image URL not probed: {e}")
+                return False
+            except (httpx.HTTPError, ImageFetchError) as e:
+                # Timeouts / resets: neither the URL nor the domain is condemned
+                self.stats["probe_errors"] += 1
+                stats = self._domains.setdefault(_domain(url), DomainStats())
+                stats.errors += 1
+                stats.last_error = type(e).__name__
+                return True
+
+        alive = reason is None
+        self._verdicts.set(url, alive, ttl=self.alive_ttl if alive else self.dead_ttl)
+        if not alive:
+            self.stats["probe_failures"] += 1
+            logger.debug(f"Dead image {url}: {reason}")
+        self._record_domain(url, reason)
+        return alive
+
+    def _schedule(self, url: str) -> Optional[asyncio.Task]:
+        task = self._inflight.get(url)
+        if task is not None:
+            return task
+        if len(self._inflight) >= self.max_pending:
+            self.stats["skipped_queue_full"] += 1
+            return None
+        task = asyncio.create_task(self._verify(url))
+        self._inflight[url] = task
+        task.add_done_callback(lambda t: self._finish(url, t))
+        return task
+
+    def _finish(self, url: str, task: asyncio.Task) -> None:
+        self._inflight.pop(url, None)
+        if not task.cancelled():
+            task.exception()
+
+    # --- domains -------------------------------------------------------------
+
+    def _record_domain(self, url: str, error: Optional[str]) -> None:
+        domain = _domain(url)
+        stats = self._domains.setdefault(domain, DomainStats())
+        stats.probes += 1
+        if error is None:
+            return
+        stats.failures += 1
+        stats.last_error = error
+        if (
+            stats.probes >= self.block_min_probes
+            and stats.failure_rate >= self.block_failure_rate
+            and stats.blocked_until < time.time()
+        ):
+            stats.blocked_until = time.time() + self.block_ttl
+            self.stats["domains_blocked"] += 1
+            logger.warning(
+                f"Image domain {domain} blocked for {self.block_ttl / 3600:.0f}h: "
+                f"{stats.failures}/{stats.probes} probes failed (last: {error})"
+            )
+            # Start over after the block, so a fixed site gets another chance
+            stats.probes = stats.failures = 0
+
+    def is_blocked(self, url: str) -> bool:
+        stats = self._domains.get(_domain(url))
+        return stats is not None and stats.blocked_until > time.time()
+
+    # --- api -----------------------------------------------------------------
+
+    async def filter(self, items: List[Dict[str, Any]], url_key: str, wait: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        `items` without those whose `item[url_key]` is known dead or on a
+        blocked domain. Unknown URLs are probed; the ones that finish
+        within `wait` seconds (default IMAGE_LIVENESS_WAIT) are applied
+        to this response too.
+        """
+        if not self.enabled or not items:
+            return items
+        wait = settings.IMAGE_LIVENESS_WAIT if wait is None else wait
+
+        pending: Dict[str, asyncio.Task] = {}
+        for item in items:
+            url = item.get(url_key) or ""
+            if url and url not in self._verdicts and not self.is_blocked(url):
+                task = self._schedule(url)
+                if task is not None:
+                    pending[url] = task
+
+        if pending and wait > 0:
+            # shield: probes that miss the deadline keep running for the next request
+            await asyncio.wait([asyncio.shield(t) for t in pending.values()], timeout=wait)
+
+        kept = []
+        for item in items:
+            url = item.get(url_key) or ""
+            self.stats["checked"] += 1
+            if url and self.is_blocked(url):
+                self.stats["dropped_blocked_domain"] += 1
+                continue
+            if url and self._verdicts.get(url) is False:
+                self.stats["dropped_dead"] += 1
+                continue
+            kept.append(item)
+        return kept
+
+    def summary(self, top: int = 20) -> Dict[str, Any]:
+        now = time.time()
+        worst = sorted(
+            (d for d in self._domains.items() if d[1].failures or d[1].errors or d[1].blocked_until > now),
+            key=lambda d: (d[1].blocked_until > now, d[1].failures),
+            reverse=True,
+        )[:top]
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "inflight": len(self._inflight),
+            "verdicts_cached": len(self._verdicts),
+            "blocked_domains": sorted(d for d, s in self._domains.items() if s.blocked_until > now),
+            "domains": {
+                domain: {
+                    "probes": s.probes,
+                    "failures": s.failures,
+                    "failure_rate": round(s.failure_rate, 3),
+                    "errors": s.errors,
+                    "blocked_for_s": max(0, round(s.blocked_until - now)),
+                    "last_error": s.last_error,
+                }
+                for domain, s in worst
+            },
+        }
+
+
+image_liveness = ImageLivenessVerifier(
+    concurrency=settings.IMAGE_LIVENESS_CONCURRENCY,
+    timeout=settings.IMAGE_LIVENESS_TIMEOUT,
+    alive_ttl=settings.IMAGE_LIVENESS_ALIVE_TTL,
+    dead_ttl=settings.IMAGE_LIVENESS_DEAD_TTL,
+    max_pending=settings.IMAGE_LIVENESS_MAX_PENDING,
+    block_min_probes=settings.IMAGE_LIVENESS_BLOCK_MIN_PROBES,
+    block_failure_rate=settings.IMAGE_LIVENESS_BLOCK_FAILURE_RATE,
+    block_ttl=settings.IMAGE_LIVENESS_BLOCK_TTL,
+    enabled=settings.IMAGE_LIVENESS_ENABLED,
+    allow_private=settings.IMAGE_FETCH_ALLOW_PRIVATE,
+)
@@ -0,0 +1,99 @@
+"""Image ingestion: EXIF orientation, downscale, re-encode before sending to Gemini."""
+import asyncio
+import base64
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pillow releases the GIL for decode/resize/encode, so a small thread pool
+# keeps this work off the event loop without process start-up costs.
+_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS, thread_name_prefix="image-normalize")
+
+# img.info keys that carry metadata (EXIF/GPS, colour profile, XMP, comments)
+_METADATA_KEYS = ("exif", "icc_profile", "xmp", "comment", "photoshop")
+
+
+async def run_in_image_pool(func, *args):
+    """Run a CPU-bound image function on the shared image worker pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, func, *args)
+
+
+def normalize_image_bytes(
+    data: bytes,
+    max_edge: Optional[int] = None,
+    quality: Optional[int] = None,
+) -> Tuple[bytes, str]:
+    """
+    Apply EXIF orientation, shrink to `max_edge` on the long side and
+    re-encode as JPEG without metadata. Returns (bytes, mime_type).
+
+    Small JPEGs without any metadata (so no rotation either) are passed
+    through untouched; input Pillow cannot decode is returned as-is so
+    the caller can still try.
+    """
+    max_edge = max_edge or settings.IMAGE_MAX_EDGE
+    quality = quality or settings.IMAGE_JPEG_QUALITY
+
+    try:
+        img = Image.open(io.BytesIO(data))
+
+        if (
+            img.format == "JPEG"
+            and max(img.size) <= max_edge
+            and len(data) <= settings.IMAGE_PASSTHROUGH_BYTES
+            and not any(key in img.info for key in _METADATA_KEYS)
+            and not img.getexif()
+        ):
+            return data, "image/jpeg"
+
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        out = io.BytesIO()
+        # No exif/icc passed: metadata is dropped
+        img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        result = out.getvalue()
+        logger.debug(f"Normalized image {len(data) // 1024} KB -> {len(result) // 1024} KB, {img.size[0]}x{img.size[1]}")
+        return result, "image/jpeg"
+
+    except Exception as e:
+        logger.warning(f"Image normalization skipped: {e}")
+        return data, ""
+
+
+async def normalize_image(data: bytes, mime_type: str = "image/jpeg") -> Tuple[bytes, str]:
+    """Async wrapper running `normalize_image_bytes` on the worker pool."""
+    result, new_mime = await run_in_image_pool(normalize_image_bytes, data)
+    return result, new_mime or mime_type
+
+
+def _normalize_b64_sync(image_b64: str) -> str:
+    try:
+        data = base64.b64decode(image_b64)
+    except Exception:
+        return image_b64
+    result, _ = normalize_image_bytes(data)
+    if result is data:
+        return image_b64
+    return base64.b64encode(result).decode("utf-8")
+
+
+async def normalize_image_b64(image_b64: str) -> str:
+    """Same as `normalize_image` for base64 payloads (decode/encode also off-loop)."""
+    return await run_in_image_pool(_normalize_b64_sync, image_b64)
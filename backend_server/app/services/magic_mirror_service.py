@@ -2,7 +2,9 @@ import os
 from typing import Any, Dict
 from fastapi import HTTPException
 from dotenv import load_dotenv
-import fal_client
+
+from app.services.fal_gateway import fal_run
+from app.services.resilience import UpstreamUnavailable
 
 load_dotenv()
 
@@ -25,13 +27,13 @@ class MagicMirrorService:
         # 🔥 AUTO-PROMPT LOGIC (Gemini)
         if not final_prompt:
              try:
-                 from app.services.gemini_consultant_service import gemini_consultant_service
+                 from app.services.gemini_consultant_service import gemini_service
                  print(f"DEBUG: Auto-captioning clothing from {clothing_image_url}...")
                  
                  # Ask Gemini to describe the item + category hint
-                 caption = await gemini_consultant_service.describe_image(
+                 caption = await gemini_service.describe_image(
                      image_url=clothing_image_url, 
-                     prompt="Describe this clothing item. Is it a top (shirt/jacket), bottom (pants/skirt), or full body (dress/suit)? format: 'Category: [Top/Bottom/Full]. Description: [Detail]'"
+                     prompt_text="Describe this clothing item. Is it a top (shirt/jacket), bottom (pants/skirt), or full body (dress/suit)? format: 'Category: [Top/Bottom/Full]. Description: [Detail]'"
                  )
                  # Simplify for VTON prompt
                  final_prompt = caption or "clothing item"
@@ -59,7 +61,7 @@ class MagicMirrorService:
         try:
             print(f"DEBUG: Removing background from clothing image: {clothing_image_url}")
             # Identify the main object (clothing)
-            biref_result = fal_client.run("fal-ai/birefnet", arguments={"image_url": clothing_image_url})
+            biref_result = await fal_run("fal-ai/birefnet", arguments={"image_url": clothing_image_url})
             if biref_result and "image" in biref_result and "url" in biref_result["image"]:
                 clean_clothing_url = biref_result["image"]["url"]
                 print(f"DEBUG: Clean clothing URL: {clean_clothing_url}")
@@ -82,9 +84,12 @@ class MagicMirrorService:
         try:
              # Switching to the proven 'fal-ai/idm-vton'
              print(f"DEBUG: MagicMirror calling fal-ai/idm-vton...")
-             result = fal_client.run("fal-ai/idm-vton", arguments=payload)
+             result = await fal_run("fal-ai/idm-vton", arguments=payload)
              return result
 
+        except UpstreamUnavailable as e:
+            print(f"MagicMirror unavailable: {e}")
+            raise HTTPException(status_code=503, detail=f"Generation temporarily unavailable: {e}")
         except Exception as e:
             print(f"MagicMirror Error: {e}")
             raise HTTPException(status_code=500, detail=f"Generation failed: {e}")
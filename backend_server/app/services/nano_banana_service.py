@@ -5,10 +5,14 @@ from typing import Any, Dict
 from fastapi import HTTPException, UploadFile
 from dotenv import load_dotenv
 
-import fal_client
+from app.services.fal_gateway import fal_run, fal_upload, fal_video
+from app.services.resilience import UpstreamUnavailable, upstream
 
 load_dotenv()
 
+FALLBACK_EDIT_MODEL = "fal-ai/nano-banana/edit"
+VIDEO_TRYON_MODEL = "fal-ai/kling-video/v2.5-turbo/pro/image-to-video"
+
 
 class NanoBananaService:
     def __init__(self) -> None:
@@ -36,8 +40,7 @@ class NanoBananaService:
             # ВАЖНО: для разных версий fal_client сигнатура может отличаться,
             # но самый совместимый вариант — передать bytes и content_type.
             
-            # Reverting async wrapper - keeping it simple to rule out threading issues
-            url = fal_client.upload(
+            url = await fal_upload(
                 data,
                 content_type=file.content_type or "application/octet-stream"
             )
@@ -45,9 +48,24 @@ class NanoBananaService:
 
         except HTTPException:
             raise
+        except UpstreamUnavailable as e:
+            raise HTTPException(status_code=503, detail=f"upload_to_fal unavailable: {e}")
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"upload_to_fal failed: {e}")
 
+    def check_available(self, video: bool = False) -> None:
+        """
+        Raise 503 up front if the try-on pipeline's last-resort model (or the
+        video model) has an open circuit, so callers don't charge credits for
+        a request that would be rejected.
+        """
+        try:
+            upstream(f"fal:{FALLBACK_EDIT_MODEL}").raise_if_open()
+            if video:
+                upstream(f"fal_video:{VIDEO_TRYON_MODEL}").raise_if_open()
+        except UpstreamUnavailable as e:
+            raise HTTPException(status_code=503, detail=f"Generation temporarily unavailable: {e}")
+
     async def edit(self, user_image_url: str, clothing_image_url: str, prompt: str, category: str = None, is_premium: bool = False, is_vip: bool = False) -> Dict[str, Any]:
         """
         Virtual Try-On using Nano Banana PRO.
@@ -65,7 +83,7 @@ class NanoBananaService:
         elif is_premium:
             primary_model = "fal-ai/nano-banana-2/edit"
         else:
-            primary_model = "fal-ai/nano-banana/edit"
+            primary_model = FALLBACK_EDIT_MODEL
         print(f"DEBUG: VTON starting (is_premium={is_premium}, is_vip={is_vip}, model={primary_model})")
 
         try:
@@ -90,13 +108,18 @@ class NanoBananaService:
             print(f"DEBUG: Payload ready, calling model...")
 
             try:
-                result = fal_client.run(primary_model, arguments=nano_payload)
+                result = await fal_run(primary_model, arguments=nano_payload)
                 return result
             except Exception as e:
+                if primary_model == FALLBACK_EDIT_MODEL:
+                    raise
                 print(f"WARNING: {primary_model} failed ({e}). Falling back to nano-banana/edit...")
-                result = fal_client.run("fal-ai/nano-banana/edit", arguments=nano_payload)
+                result = await fal_run(FALLBACK_EDIT_MODEL, arguments=nano_payload)
                 return result
 
+        except UpstreamUnavailable as e:
+            print(f"Try-On unavailable: {e}")
+            raise HTTPException(status_code=503, detail=f"Generation temporarily unavailable: {e}")
         except Exception as e:
             print(f"Try-On Error: {e}")
             raise HTTPException(status_code=500, detail=f"Generation failed: {e}")
@@ -134,10 +157,10 @@ class NanoBananaService:
             }
 
             try:
-                edit_result = fal_client.run("fal-ai/nano-banana-pro/edit", arguments=nano_payload)
+                edit_result = await fal_run("fal-ai/nano-banana-pro/edit", arguments=nano_payload)
             except Exception as pro_error:
                 print(f"WARNING: nano-banana-pro/edit failed ({pro_error}), falling back to standard...")
-                edit_result = fal_client.run("fal-ai/nano-banana/edit", arguments=nano_payload)
+                edit_result = await fal_run(FALLBACK_EDIT_MODEL, arguments=nano_payload)
 
             # Extract static image URL from edit result
             static_url = None
@@ -170,11 +193,14 @@ class NanoBananaService:
                 "aspect_ratio": "9:16",
             }
 
-            kling_result = fal_client.run("fal-ai/kling-video/v2.5-turbo/pro/image-to-video", arguments=kling_payload)
+            kling_result = await fal_video(VIDEO_TRYON_MODEL, arguments=kling_payload)
 
             print(f"DEBUG: Kling result: {kling_result}")
             return kling_result
 
+        except UpstreamUnavailable as e:
+            print(f"Video Try-On unavailable: {e}")
+            raise HTTPException(status_code=503, detail=f"Video generation temporarily unavailable: {e}")
         except Exception as e:
             print(f"Video Try-On Error: {e}")
             raise HTTPException(status_code=500, detail=f"Video generation failed: {e}")
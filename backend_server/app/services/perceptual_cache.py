@@ -0,0 +1,323 @@
+"""Perceptual-hash keyed result cache for image analysis (memory + SQLite)."""
+import asyncio
+import base64
+import io
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.config import settings
+from app.services.image_normalizer import run_in_image_pool
+
+logger = logging.getLogger(__name__)
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+_COLOR_GRID = 4  # color signature: mean RGB of a 4x4 grid (48 bytes)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2 / n)
+    m[0, :] = np.sqrt(1 / n)
+    return m
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+_BIT_WEIGHTS = (np.uint64(1) << np.arange(_HASH_SIZE * _HASH_SIZE, dtype=np.uint64))
+
+
+def phash_image(img: Image.Image) -> int:
+    """64-bit DCT perceptual hash (robust to resizing and recompression)."""
+    gray = img.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    dct = _DCT @ pixels @ _DCT.T
+    low = dct[:_HASH_SIZE, :_HASH_SIZE].flatten()
+    # Median without the DC term, which only reflects overall brightness
+    bits = low > np.median(low[1:])
+    return int((bits.astype(np.uint64) * _BIT_WEIGHTS).sum())
+
+
+def color_signature(img: Image.Image) -> bytes:
+    """
+    Mean RGB of a coarse grid. pHash works on luminance only, so the same
+    cut in red and in navy hashes alike; this tells them apart.
+    """
+    if img.mode in ("RGBA", "LA", "P", "PA"):
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    return img.convert("RGB").resize((_COLOR_GRID, _COLOR_GRID), Image.BOX).tobytes()
+
+
+def color_distances(colors: np.ndarray, color: bytes) -> np.ndarray:
+    """
+    Distance (0-255) between `color` and every row of `colors`: the largest
+    per-cell mean channel difference, so a garment that changes color
+    counts even on a mostly white background.
+    """
+    target = np.frombuffer(color, dtype=np.uint8).astype(np.int16)
+    diff = np.abs(colors.astype(np.int16) - target).reshape(len(colors), -1, 3)
+    return diff.mean(axis=2).max(axis=1)
+
+
+def color_distance(a: bytes, b: bytes) -> float:
+    """`color_distances` for a single pair of signatures."""
+    return float(color_distances(np.frombuffer(a, dtype=np.uint8)[None, :], b)[0])
+
+
+class ImageSignature(NamedTuple):
+    phash: int
+    color: bytes
+
+
+def image_signature(img: Image.Image) -> ImageSignature:
+    img.seek(0)
+    return ImageSignature(phash_image(img), color_signature(img))
+
+
+def signature_bytes(data: bytes) -> Optional[ImageSignature]:
+    try:
+        return image_signature(Image.open(io.BytesIO(data)))
+    except Exception as e:
+        logger.debug(f"Image signature failed: {e}")
+        return None
+
+
+def _signature_b64(image_b64: str) -> Optional[ImageSignature]:
+    try:
+        return signature_bytes(base64.b64decode(image_b64))
+    except Exception:
+        return None
+
+
+async def image_signature_b64(image_b64: str) -> Optional[ImageSignature]:
+    """pHash + color signature of a base64 image, computed on the image worker pool."""
+    return await run_in_image_pool(_signature_b64, image_b64)
+
+
+def hamming_distances(hashes: np.ndarray, h: int) -> np.ndarray:
+    """Hamming distance between `h` and every uint64 in `hashes`."""
+    x = np.bitwise_xor(hashes, np.uint64(h))
+    return np.unpackbits(x.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def _to_signed(h: int) -> int:
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+def _to_unsigned(h: int) -> int:
+    return h + (1 << 64) if h < 0 else h
+
+
+class _Namespace:
+    def __init__(self):
+        self.hashes: List[int] = []
+        self.colors: List[bytes] = []
+        self.values: List[Any] = []
+        self.created: List[float] = []
+        self._arrays: Optional[tuple] = None
+
+    def arrays(self) -> tuple:
+        """(hashes as uint64, colors as an n x 48 uint8 matrix, created)"""
+        if self._arrays is None:
+            self._arrays = (
+                np.array(self.hashes, dtype=np.uint64),
+                np.frombuffer(b"".join(self.colors), dtype=np.uint8).reshape(len(self.colors), -1),
+                np.array(self.created, dtype=np.float64),
+            )
+        return self._arrays
+
+    def add(self, sig: ImageSignature, value: Any, created: float) -> None:
+        self.hashes.append(sig.phash)
+        self.colors.append(sig.color)
+        self.values.append(value)
+        self.created.append(created)
+        self._arrays = None
+
+    def drop_oldest(self, n: int) -> None:
+        del self.hashes[:n], self.colors[:n], self.values[:n], self.created[:n]
+        self._arrays = None
+
+
+class PerceptualHashCache:
+    """
+    Result cache keyed by image signature within a namespace (e.g. "auto_tag:ru").
+
+    A lookup hits when a stored, unexpired entry is within `max_distance`
+    pHash bits and `max_color_distance` of its color signature, so the
+    same photo re-uploaded after recompression or resizing still matches
+    but the same garment in another color doesn't.
+    Entries are kept in memory and written through to SQLite so they
+    survive restarts.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_distance: int,
+        max_color_distance: float,
+        ttl: float,
+        max_entries: int,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.max_distance = max_distance
+        self.max_color_distance = max_color_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._ns: Dict[str, _Namespace] = {}
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_path = db_path
+
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    # --- storage -------------------------------------------------------------
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and self._db_path:
+            try:
+                Path(self._db_path).parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+                # Entries of the pHash-only table have no color: start over
+                self._db.execute("DROP TABLE IF EXISTS phash_cache")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS image_result_cache ("
+                    " namespace TEXT NOT NULL, hash INTEGER NOT NULL, color BLOB NOT NULL,"
+                    " value TEXT NOT NULL, created REAL NOT NULL,"
+                    " PRIMARY KEY (namespace, hash, color))"
+                )
+                self._db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"pHash cache disk tier disabled: {e}")
+                self._db_path = ""
+                self._db = None
+        return self._db
+
+    def _load(self, namespace: str) -> _Namespace:
+        ns = self._ns.get(namespace)
+        if ns is not None:
+            return ns
+
+        ns = _Namespace()
+        with self._db_lock:
+            db = self._connect()
+            if db is not None:
+                rows = db.execute(
+                    "SELECT hash, color, value, created FROM image_result_cache WHERE namespace = ? AND created > ?"
+                    " ORDER BY created",
+                    (namespace, time.time() - self.ttl),
+                ).fetchall()
+                for h, color, value, created in rows[-self.max_entries:]:
+                    ns.add(ImageSignature(_to_unsigned(h), bytes(color)), json.loads(value), created)
+        self._ns[namespace] = ns
+        return ns
+
+    def _persist(self, namespace: str, sig: ImageSignature, value: Any, created: float) -> None:
+        with self._db_lock:
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO image_result_cache (namespace, hash, color, value, created)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (namespace, _to_signed(sig.phash), sig.color, json.dumps(value, ensure_ascii=False), created),
+                )
+                db.execute("DELETE FROM image_result_cache WHERE created < ?", (time.time() - self.ttl,))
+                db.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"pHash cache write failed: {e}")
+
+    # --- api -----------------------------------------------------------------
+
+    def _stat(self, namespace: str) -> Dict[str, float]:
+        return self.stats.setdefault(namespace, {"hits": 0, "misses": 0, "miss_ms_total": 0.0, "saved_ms": 0.0})
+
+    def _find(self, namespace: str, sig: ImageSignature) -> Optional[Any]:
+        """Value of the closest unexpired entry matching both pHash and color, if any."""
+        ns = self._load(namespace)
+        if not ns.hashes:
+            return None
+        hashes, colors, created = ns.arrays()
+        bits = hamming_distances(hashes, sig.phash)
+        candidates = np.flatnonzero((bits <= self.max_distance) & (created + self.ttl >= time.time()))
+        if not candidates.size:
+            return None
+        color = color_distances(colors[candidates], sig.color)
+        matching = color <= self.max_color_distance
+        if not matching.any():
+            return None
+        # Closest by pHash bits first, color breaks ties
+        order = np.lexsort((color[matching], bits[candidates][matching]))
+        return ns.values[int(candidates[matching][order[0]])]
+
+    async def get(self, namespace: str, sig: Optional[ImageSignature]) -> Optional[Any]:
+        if not self.enabled or sig is None:
+            return None
+        stat = self._stat(namespace)
+        if namespace not in self._ns:
+            await asyncio.to_thread(self._load, namespace)
+        value = self._find(namespace, sig)
+        if value is None:
+            stat["misses"] += 1
+            return None
+
+        stat["hits"] += 1
+        # Credit the average cost of a miss (the upstream call we skipped)
+        if stat["misses"]:
+            stat["saved_ms"] += stat["miss_ms_total"] / stat["misses"]
+        return value
+
+    async def set(self, namespace: str, sig: Optional[ImageSignature], value: Any, elapsed_ms: float = 0.0) -> None:
+        """Store a result; `elapsed_ms` is the upstream latency this entry will save."""
+        if not self.enabled:
+            return
+        self._stat(namespace)["miss_ms_total"] += elapsed_ms
+        if sig is None or not value:
+            return
+
+        if namespace not in self._ns:
+            await asyncio.to_thread(self._load, namespace)
+        ns = self._ns[namespace]
+        created = time.time()
+        ns.add(sig, value, created)
+        if len(ns.hashes) > self.max_entries:
+            ns.drop_oldest(len(ns.hashes) - self.max_entries)
+        await asyncio.to_thread(self._persist, namespace, sig, value, created)
+
+    def summary(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {
+            "enabled": self.enabled,
+            "max_distance": self.max_distance,
+            "max_color_distance": self.max_color_distance,
+        }
+        for namespace, stat in self.stats.items():
+            lookups = stat["hits"] + stat["misses"]
+            out[namespace] = {
+                "entries": len(self._ns[namespace].hashes) if namespace in self._ns else 0,
+                "hits": int(stat["hits"]),
+                "misses": int(stat["misses"]),
+                "hit_rate": round(stat["hits"] / lookups, 3) if lookups else 0.0,
+                "avg_miss_ms": round(stat["miss_ms_total"] / stat["misses"], 1) if stat["misses"] else None,
+                "saved_ms_total": round(stat["saved_ms"], 1),
+            }
+        return out
+
+
+phash_cache = PerceptualHashCache(
+    db_path=settings.PHASH_CACHE_PATH,
+    max_distance=settings.PHASH_MAX_DISTANCE,
+    max_color_distance=settings.PHASH_MAX_COLOR_DISTANCE,
+    ttl=settings.PHASH_CACHE_TTL,
+    max_entries=settings.PHASH_CACHE_MAX_ENTRIES,
+    enabled=settings.PHASH_CACHE_ENABLED,
+)
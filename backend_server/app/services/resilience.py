@@ -0,0 +1,279 @@
+"""Circuit breakers, bulkheads and hedged requests for upstream AI calls (Gemini, fal.ai)."""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UpstreamUnavailable(Exception):
+    """Call rejected without reaching the upstream (circuit open or bulkhead full)."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures;
+    open -> half-open after `reset_timeout`, letting one trial call through;
+    half-open -> closed on success, back to open on failure.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def on_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._trial_running = False
+
+    def on_failure(self) -> None:
+        self._trial_running = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class Upstream:
+    """
+    Resilience policy for one upstream.
+
+    - circuit breaker: after repeated failures calls fail immediately with
+      CircuitOpenError instead of waiting for the upstream timeout
+    - bulkhead: at most `max_concurrent` calls in flight; callers wait up
+      to `queue_timeout` for a slot, then get BulkheadFullError
+    - hedging (opt-in per call, for cheap idempotent requests): if the first
+      attempt is still running after the observed p95, a duplicate is started
+      and whichever finishes first wins
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        queue_timeout: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        call_timeout: Optional[float] = None,
+        hedge_min_samples: int = 20,
+    ):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._in_flight = 0
+        self._latencies: Deque[float] = deque(maxlen=200)
+
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "rejected_open": 0,
+            "rejected_full": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+        }
+
+    # --- state ---------------------------------------------------------------
+
+    def raise_if_open(self) -> None:
+        """Fail fast before doing side effects (e.g. charging credits) for a call that would be rejected."""
+        if self.breaker.state == "open" and self.breaker.retry_after() > 0:
+            self.stats["rejected_open"] += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, retry in {self.breaker.retry_after():.0f}s")
+
+    def p95(self) -> Optional[float]:
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def _record(self, started: float, error: Optional[BaseException], is_failure: Callable[[BaseException], bool]) -> None:
+        if error is None:
+            self.stats["successes"] += 1
+            self._latencies.append(time.monotonic() - started)
+            self.breaker.on_success()
+        elif isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+            # Caller went away (or lost a hedge race): says nothing about upstream health
+            self.breaker._trial_running = False
+        elif is_failure(error):
+            self.stats["failures"] += 1
+            was_open = self.breaker.state == "open"
+            self.breaker.on_failure()
+            if self.breaker.state == "open" and not was_open:
+                logger.warning(f"Circuit for {self.name} opened after {self.breaker.failures} failures: {error}")
+        else:
+            # The upstream answered (e.g. a 4xx for a bad request): it is alive
+            self.breaker.on_success()
+
+    @asynccontextmanager
+    async def slot(self, is_failure: Callable[[BaseException], bool] = lambda e: True):
+        """
+        Breaker check + bulkhead slot around one upstream call; the outcome
+        of the block is recorded. Suited to streams, where `call` can't wrap
+        the whole exchange.
+        """
+        if not self.breaker.allow():
+            self.stats["rejected_open"] += 1
+            raise CircuitOpenError(f"{self.name} is unavailable, retry in {self.breaker.retry_after():.0f}s")
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.breaker._trial_running = False
+            self.stats["rejected_full"] += 1
+            raise BulkheadFullError(f"{self.name} is at capacity ({self.max_concurrent} calls in flight)")
+
+        self.stats["calls"] += 1
+        self._in_flight += 1
+        started = time.monotonic()
+        error: Optional[BaseException] = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+            self._record(started, error, is_failure)
+
+    async def _attempt(self, fn: Callable[[], Awaitable[T]], is_failure) -> T:
+        async with self.slot(is_failure):
+            if self.call_timeout:
+                return await asyncio.wait_for(fn(), timeout=self.call_timeout)
+            return await fn()
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        hedge: bool = False,
+        is_failure: Callable[[BaseException], bool] = lambda e: True,
+    ) -> T:
+        """
+        Run `fn()` under the breaker, bulkhead and timeout. With `hedge=True`
+        `fn` must be safe to run twice.
+        """
+        delay = self.p95() if hedge and settings.UPSTREAM_HEDGING_ENABLED else None
+        if delay is None:
+            return await self._attempt(fn, is_failure)
+
+        first = asyncio.create_task(self._attempt(fn, is_failure))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        # No spare capacity: don't let a hedge push real requests out
+        if done or self._in_flight >= self.max_concurrent:
+            return await first
+
+        self.stats["hedges"] += 1
+        second = asyncio.create_task(self._attempt(fn, is_failure))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def summary(self) -> Dict[str, Any]:
+        p95 = self.p95()
+        return {
+            **self.stats,
+            "state": self.breaker.state,
+            "times_opened": self.breaker.times_opened,
+            "in_flight": self._in_flight,
+            "max_concurrent": self.max_concurrent,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+_POLICIES: Dict[str, Dict[str, Any]] = {
+    "gemini": dict(
+        max_concurrent=settings.GEMINI_MAX_CONCURRENT,
+        queue_timeout=settings.UPSTREAM_QUEUE_TIMEOUT,
+        failure_threshold=settings.UPSTREAM_FAILURE_THRESHOLD,
+        reset_timeout=settings.UPSTREAM_RESET_TIMEOUT,
+    ),
+    "fal": dict(
+        max_concurrent=settings.FAL_MAX_CONCURRENT,
+        queue_timeout=settings.UPSTREAM_QUEUE_TIMEOUT,
+        failure_threshold=settings.UPSTREAM_FAILURE_THRESHOLD,
+        reset_timeout=settings.UPSTREAM_RESET_TIMEOUT,
+        call_timeout=settings.FAL_CALL_TIMEOUT,
+    ),
+    # Video jobs run for minutes: own small pool so they can't starve photo try-on
+    "fal_video": dict(
+        max_concurrent=settings.FAL_VIDEO_MAX_CONCURRENT,
+        queue_timeout=settings.UPSTREAM_QUEUE_TIMEOUT,
+        failure_threshold=settings.UPSTREAM_FAILURE_THRESHOLD,
+        reset_timeout=settings.UPSTREAM_RESET_TIMEOUT,
+        call_timeout=settings.FAL_VIDEO_CALL_TIMEOUT,
+    ),
+}
+
+_upstreams: Dict[str, Upstream] = {}
+
+
+def upstream(name: str) -> Upstream:
+    """
+    Shared Upstream by name. "family:detail" names (e.g. "gemini:gemini-2.5-flash")
+    get the family's policy but their own breaker and bulkhead.
+    """
+    up = _upstreams.get(name)
+    if up is None:
+        policy = _POLICIES[name.split(":", 1)[0]]
+        up = _upstreams[name] = Upstream(name, **policy)
+    return up
+
+
+def upstreams_summary() -> Dict[str, Any]:
+    return {name: up.summary() for name, up in sorted(_upstreams.items())}
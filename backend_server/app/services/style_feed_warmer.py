@@ -0,0 +1,217 @@
+"""Background warmer for /styles/search: prebuilt image pools per gender x category, served as random pages."""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.services.image_liveness import image_liveness
+from app.services.style_search_service import style_search_service
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str]  # (gender, category)
+
+
+def pool_key(gender: str, category: str) -> PoolKey:
+    # Same split as StyleSearchService.build_style_query
+    return ("male" if gender.strip().lower().startswith("m") else "female", category.strip().lower())
+
+
+class StyleFeedWarmer:
+    """
+    Keeps a pool of up to `pool_size` verified images for every configured
+    gender x category and refreshes it every `refresh_interval`.
+
+    Pools are rebuilt one at a time (DuckDuckGo rate-limits bursts), dead
+    links are removed before a pool is published, and pools are saved to
+    disk so a restart serves from them immediately. `/styles/search` then
+    answers from memory; only categories outside the configured set (or
+    not warmed yet) go to live search.
+    """
+
+    def __init__(
+        self,
+        genders: List[str],
+        categories: List[str],
+        pool_size: int,
+        refresh_interval: float,
+        pause: float,
+        verify_wait: float,
+        path: str,
+        enabled: bool = True,
+    ):
+        self.enabled = enabled
+        self.genders = genders
+        self.categories = categories
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.pause = pause
+        self.verify_wait = verify_wait
+        self.path = Path(path) if path else None
+        self._pools: Dict[PoolKey, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._warming: Dict[PoolKey, asyncio.Task] = {}
+
+        self.stats: Dict[str, int] = {"served_from_pool": 0, "pool_misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    @property
+    def combinations(self) -> List[PoolKey]:
+        return [pool_key(g, c) for g in self.genders for c in self.categories]
+
+    # --- persistence ---------------------------------------------------------
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            raw = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Style pools not loaded: {e}")
+            return
+        for entry in raw:
+            self._pools[(entry["gender"], entry["category"])] = {
+                "items": entry["items"],
+                "refreshed_at": entry["refreshed_at"],
+            }
+        logger.info(f"Loaded {len(self._pools)} style pools from {self.path}")
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        data = [
+            {"gender": g, "category": c, **pool}
+            for (g, c), pool in self._pools.items()
+        ]
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Style pools not saved: {e}")
+
+    # --- warming -------------------------------------------------------------
+
+    async def refresh(self, gender: str, category: str) -> int:
+        """Rebuild one pool; the old pool keeps serving until the new one is ready."""
+        key = pool_key(gender, category)
+        items = await style_search_service.collect_pool(key[0], category, self.pool_size, wait=self.verify_wait)
+        items = await image_liveness.filter(items, url_key="imageUrl", wait=self.verify_wait)
+        if not items:
+            raise RuntimeError("no images")
+
+        self._pools[key] = {"items": items, "refreshed_at": time.time()}
+        self.stats["refreshes"] += 1
+        await asyncio.to_thread(self._save)
+        logger.info(f"Style pool {key[0]}/{category}: {len(items)} images")
+        return len(items)
+
+    def _refresh_soon(self, gender: str, category: str) -> None:
+        """Background refresh of one pool (deduplicated), e.g. on a pool miss."""
+        key = pool_key(gender, category)
+        if key in self._warming or not self.enabled:
+            return
+        task = asyncio.create_task(self.refresh(gender, category))
+        self._warming[key] = task
+        task.add_done_callback(lambda t: self._finish(key, t))
+
+    def _finish(self, key: PoolKey, task: asyncio.Task) -> None:
+        self._warming.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["refresh_errors"] += 1
+            logger.warning(f"Style pool {key[0]}/{key[1]} refresh failed: {task.exception()}")
+
+    async def _run(self) -> None:
+        while True:
+            started = time.time()
+            for gender in self.genders:
+                for category in self.categories:
+                    key = pool_key(gender, category)
+                    pool = self._pools.get(key)
+                    if key in self._warming or (pool and pool["refreshed_at"] + self.refresh_interval > time.time()):
+                        continue
+                    try:
+                        await self.refresh(gender, category)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        self.stats["refresh_errors"] += 1
+                        logger.warning(f"Style pool {gender}/{category} refresh failed: {e}")
+                    await asyncio.sleep(self.pause)
+            # Wake up when the oldest pool is due again (sooner if some pool failed to build)
+            due = [p["refreshed_at"] + self.refresh_interval for p in self._pools.values()]
+            if len(self._pools) < len(self.combinations):
+                due.append(time.time() + 600)
+            await asyncio.sleep(max(60.0, (min(due) if due else started + self.refresh_interval) - time.time()))
+
+    def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        self._load()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._task, *self._warming.values()] if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+
+    # --- serving -------------------------------------------------------------
+
+    def page(self, gender: str, category: str, limit: int, seed: Optional[int] = None, page: int = 0) -> Optional[List[Dict[str, Any]]]:
+        """
+        `limit` images from the pool, or None if there is no pool.
+
+        Without `seed` every call is a fresh random sample. With `seed`
+        the pool is shuffled deterministically and `page` walks through it
+        without repeats (wrapping around at the end).
+        """
+        key = pool_key(gender, category)
+        pool = self._pools.get(key)
+        if not pool or not pool["items"]:
+            self.stats["pool_misses"] += 1
+            if key[1] in {c.lower() for c in self.categories}:
+                self._refresh_soon(gender, category)
+            return None
+
+        self.stats["served_from_pool"] += 1
+        items = pool["items"]
+        limit = min(limit, len(items))
+        if seed is None:
+            return [dict(i) for i in random.sample(items, limit)]
+
+        order = list(range(len(items)))
+        random.Random(seed).shuffle(order)
+        start = (page * limit) % len(items)
+        return [dict(items[order[(start + i) % len(items)]]) for i in range(limit)]
+
+    def summary(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "running": self._task is not None and not self._task.done(),
+            "pools": {
+                f"{g}/{c}": {"images": len(p["items"]), "age_s": round(now - p["refreshed_at"])}
+                for (g, c), p in sorted(self._pools.items())
+            },
+            "missing": [f"{g}/{c}" for g, c in self.combinations if (g, c) not in self._pools],
+        }
+
+
+style_feed_warmer = StyleFeedWarmer(
+    genders=settings.STYLE_POOL_GENDERS,
+    categories=settings.STYLE_POOL_CATEGORIES,
+    pool_size=settings.STYLE_POOL_SIZE,
+    refresh_interval=settings.STYLE_POOL_REFRESH_INTERVAL,
+    pause=settings.STYLE_POOL_PAUSE,
+    verify_wait=settings.STYLE_POOL_VERIFY_WAIT,
+    path=settings.STYLE_POOL_PATH,
+    enabled=settings.STYLE_POOL_ENABLED,
+)
@@ -1,33 +1,38 @@
+import asyncio
 import os
 import random
 import logging
-import requests
+
 from duckduckgo_search import DDGS
 
+from app.config import settings
+from app.search.cse_budget import BACKGROUND, INTERACTIVE
+from app.search.cse_cache import cse_cache, CSERequestError
+from app.services.image_dedup import image_deduper
+
 logger = logging.getLogger(__name__)
 
 class StyleSearchService:
     def __init__(self):
         self.google_api_key = os.getenv("GOOGLE_CSE_API_KEY")
         self.google_cx = os.getenv("GOOGLE_CSE_CX")
-        
+
         if self.google_api_key and self.google_cx:
             logger.info("✅ Google Custom Search configured")
         else:
             logger.warning("⚠️ Google Custom Search NOT configured. Using DuckDuckGo fallback.")
 
-    def _search_google(self, query: str, limit: int = 10) -> list:
+    async def _search_google(self, query: str, limit: int = 10, priority: str = INTERACTIVE) -> list:
         """Search using Google Custom Search API (Reliable on Server)."""
         if not self.google_api_key or not self.google_cx:
             return []
-            
+
         results = []
         try:
-            # Google allows max 10 results per page. 
+            # Google allows max 10 results per page.
             # We'll make just 1 request to save quota, or 2 if limit > 10.
-            check_limit = min(limit, 10) 
-            
-            url = "https://www.googleapis.com/customsearch/v1"
+            check_limit = min(limit, 10)
+
             params = {
                 "key": self.google_api_key,
                 "cx": self.google_cx,
@@ -37,107 +42,162 @@ class StyleSearchService:
                 "safe": "active",
                 "imgSize": "large" # Prefer quality
             }
-            
-            resp = requests.get(url, params=params, timeout=10)
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                items = data.get("items", [])
-                for item in items:
-                    link = item.get("link")
-                    if link:
-                        results.append({
-                            "imageUrl": link,
-                            "title": item.get("title", query),
-                            "category": "Inspiration",
-                            "tags": ["Google Search"]
-                        })
-                logger.info(f"Google Search found {len(results)} images for '{query}'")
-            else:
-                logger.error(f"Google Search API error: {resp.status_code} - {resp.text}")
-                
+
+            # Shared CSE cache: repeated queries don't spend quota. No DDG
+            # fallback there: DuckDuckGo is already queried alongside
+            data = await cse_cache.get(params, priority=priority, fallback=False)
+            items = data.get("items", [])
+            for item in items:
+                link = item.get("link")
+                if link:
+                    results.append({
+                        "imageUrl": link,
+                        "thumbnailUrl": (item.get("image") or {}).get("thumbnailLink"),
+                        "title": item.get("title", query),
+                        "category": "Inspiration",
+                        "tags": ["Google Search"]
+                    })
+            logger.info(f"Google Search found {len(results)} images for '{query}'")
+
+        except CSERequestError as e:
+            logger.error(f"Google Search API error: {e.status_code} - {e.message}")
+
         except Exception as e:
             logger.error(f"Google Search exception: {e}")
-            
+
         return results
 
-    def search_styles(self, gender: str, category: str, limit: int = 20) -> list:
+    async def _search(self, query: str, limit: int) -> list:
         """
-        Search for style images. Tries Google first, then falls back to DuckDuckGo.
-        Query format: "{category} fashion" or "{gender} {category} ..."
+        Run Google CSE and DuckDuckGo concurrently.
+
+        Returns as soon as one source has a good result set (at least
+        STYLE_SEARCH_GOOD_RESULTS items, or `limit` if smaller); otherwise
+        merges whatever both returned by STYLE_SEARCH_DEADLINE, Google first.
         """
+        good_enough = min(limit, settings.STYLE_SEARCH_GOOD_RESULTS)
+        tasks = {
+            asyncio.create_task(self._search_google(query, limit=limit)): "google",
+            asyncio.create_task(self._search_ddg(query, limit)): "ddg",
+        }
+        found = {"google": [], "ddg": []}
+        pending = set(tasks)
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + settings.STYLE_SEARCH_DEADLINE
+            while pending:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    source = tasks[task]
+                    found[source] = task.result() if not task.exception() else []
+                    if len(found[source]) >= good_enough:
+                        logger.info(f"Style search '{query}': {source} answered first ({len(found[source])} images)")
+                        return (await self._dedupe(found[source]))[:limit]
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if pending:
+            logger.warning(f"Style search '{query}': deadline hit, {[tasks[t] for t in pending]} still running")
+
+        merged = await self._dedupe(found["google"] + found["ddg"])
+        return merged[:limit]
+
+    @staticmethod
+    async def _dedupe(items: list) -> list:
+        """Same photo from both sources / CDN variants -> one item (see image_dedup)."""
+        return await image_deduper.dedupe(items, url_key="imageUrl", thumb_key="thumbnailUrl")
+
+    @staticmethod
+    def build_style_query(gender: str, category: str) -> str:
+        """Query format: "{category} fashion" or "{gender} {category} ..." """
         # Normalize inputs
         gender_term = "Men's" if gender.lower().startswith('m') else "Women's"
-        
+
         # Construct Query
         if len(category.split()) >= 2:
-            query = f"{category} {gender_term} fashion"
+            return f"{category} {gender_term} fashion"
         elif any(x in category.lower() for x in ['bag', 'shoes', 'boots', 'sneakers', 'hat', 'watch', 'сумка', 'обувь', 'кроссовки', 'часы']):
-            query = f"{category} fashion"
-        else:
-            query = f"{gender_term} {category} fashion outfit style"
-        
+            return f"{category} fashion"
+        return f"{gender_term} {category} fashion outfit style"
+
+    async def search_styles(self, gender: str, category: str, limit: int = 20) -> list:
+        """
+        Search for style images (Google and DuckDuckGo raced, see `_search`).
+        """
+        query = self.build_style_query(gender, category)
         logger.info(f"Searching styles for: {query}")
-        
-        # 1. Try Google First (Reliable)
-        results = self._search_google(query, limit=limit)
-        
-        # 2. Fallback to DuckDuckGo if Google failed or returned 0
-        if not results:
-            logger.info("Google search yielded 0 results. Falling back to DuckDuckGo...")
-            results = self._search_ddg(query, limit)
-            
+
+        results = await self._search(query, limit)
+
         # RANDOMIZATION: Shuffle results to keep the feed fresh
         random.shuffle(results)
         return results
 
-    def search_by_query(self, query: str, limit: int = 5) -> list:
+    async def collect_pool(self, gender: str, category: str, size: int, wait: float) -> list:
+        """
+        Large result set for the style feed warmer: one Google page (via the
+        CSE cache) plus up to `size` DuckDuckGo images, deduplicated with a
+        generous hashing budget (`wait`), since nobody is waiting on it.
+        """
+        query = self.build_style_query(gender, category)
+        google, ddg = await asyncio.gather(
+            self._search_google(query, limit=10, priority=BACKGROUND),
+            self._search_ddg(query, size),
+        )
+        items = await image_deduper.dedupe(google + ddg, url_key="imageUrl", thumb_key="thumbnailUrl", wait=wait)
+        return items[:size]
+
+    async def search_by_query(self, query: str, limit: int = 5) -> list:
         """Raw search by query string."""
         logger.info(f"Raw style search: {query}")
-        
-        # 1. Try Google First
-        results = self._search_google(query, limit=limit)
-        
-        # 2. Fallback
-        if not results:
-             results = self._search_ddg(query, limit)
-             
-        return results
+        return await self._search(query, limit)
 
-    def _search_ddg(self, query: str, limit: int) -> list:
-        """DuckDuckGo Search (Fallback)."""
+    @staticmethod
+    def _ddg_images(query: str, limit: int) -> list:
+        """One blocking DDGS call (run in a worker thread)."""
         results = []
+        with DDGS() as ddgs:
+            ddg_results = ddgs.images(
+                query,
+                region="wt-wt",
+                safesearch="on",
+                max_results=limit * 2
+            )
+
+            for r in ddg_results:
+                image_url = r.get('image')
+                title = r.get('title', 'Style Idea')
+
+                if image_url:
+                    results.append({
+                        "imageUrl": image_url,
+                        "thumbnailUrl": r.get('thumbnail'),
+                        "title": title,
+                        "category": "Inspiration",
+                        "tags": ["AI Suggested"]
+                    })
+
+                if len(results) >= limit:
+                    break
+        return results
+
+    async def _search_ddg(self, query: str, limit: int) -> list:
+        """DuckDuckGo Search (DDGS is sync-only, so it runs in a thread)."""
         # RETRY LOGIC (2 attempts)
         for attempt in range(2):
             try:
-                with DDGS() as ddgs:
-                    ddg_results = ddgs.images(
-                        query,
-                        region="wt-wt",
-                        safesearch="on",
-                        max_results=limit * 2 
-                    )
-                    
-                    for r in ddg_results:
-                        image_url = r.get('image')
-                        title = r.get('title', 'Style Idea')
-                        
-                        if image_url:
-                            results.append({
-                                "imageUrl": image_url,
-                                "title": title,
-                                "category": "Inspiration",
-                                "tags": ["AI Suggested"]
-                            })
-                            
-                        if len(results) >= limit:
-                            break
-                
-                if results: break
-                
+                results = await asyncio.to_thread(self._ddg_images, query, limit)
+                if results:
+                    return results
             except Exception as e:
                 logger.warning(f"DDG Search Error (Attempt {attempt+1}): {e}")
-                import time
-                time.sleep(1)
-        
-        return results
+                await asyncio.sleep(1)
+
+        return []
+
+
+style_search_service = StyleSearchService()
@@ -0,0 +1,217 @@
+"""WebP thumbnails of external images at fixed widths, cached on disk under STATIC_DIR."""
+import asyncio
+import hashlib
+import hmac
+import io
+import logging
+import os
+import secrets
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.services.image_fetcher import image_fetcher
+from app.services.image_normalizer import run_in_image_pool
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailError(Exception):
+    """The image could not be decoded."""
+
+
+def load_signing_key(key: str, path: str) -> str:
+    """
+    `key` if configured, otherwise a random key kept at `path`: unsigned
+    thumbnail URLs are never served, and workers on one host share the file.
+    """
+    if key:
+        return key
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(p, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(32))
+        logger.info(f"THUMB_SIGNING_KEY not set, generated one at {p}")
+    for _ in range(50):
+        key = p.read_text(encoding="utf-8").strip()
+        if key:
+            return key
+        time.sleep(0.01)  # another worker is still writing it
+    raise RuntimeError(f"Thumbnail signing key file is empty: {p}")
+
+
+def render_webp(data: bytes, width: int, quality: int) -> bytes:
+    """Resize to `width` (never upscale), keep alpha, encode WebP without metadata."""
+    img = Image.open(io.BytesIO(data))
+    img.seek(0)  # animated GIF/WebP: first frame
+    img = ImageOps.exif_transpose(img)
+    if img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+
+    if img.mode in ("RGBA", "LA", "P", "PA"):
+        img = img.convert("RGBA")
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+
+    out = io.BytesIO()
+    img.save(out, format="WEBP", quality=quality, method=4)
+    return out.getvalue()
+
+
+class ThumbnailService:
+    """
+    Fetches an external (or fal CDN) image once, renders it at one of the
+    fixed `widths` and keeps the WebP under `cache_dir`. The directory is
+    size-capped (oldest files go first). Concurrent requests for the same
+    thumbnail share one render.
+    """
+
+    def __init__(self, cache_dir: str, widths: List[int], quality: int, max_bytes: int, signing_key: str):
+        self.cache_dir = Path(cache_dir)
+        self.widths = sorted(widths)
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.signing_key = signing_key.encode("utf-8")
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._writes_since_prune = 0
+
+        self.stats: Dict[str, int] = {
+            "hits": 0,
+            "renders": 0,
+            "render_errors": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+        }
+
+    # --- urls ----------------------------------------------------------------
+
+    def snap_width(self, width: Optional[int]) -> int:
+        """Smallest fixed width >= `width` (the largest one if none is)."""
+        if not width:
+            return settings.THUMB_DEFAULT_WIDTH
+        for w in self.widths:
+            if w >= width:
+                return w
+        return self.widths[-1]
+
+    def _sign(self, url: str) -> str:
+        # Only the URL is signed: widths are snapped to a fixed set, so clients may pick any `w`
+        return hmac.new(self.signing_key, url.encode("utf-8"), hashlib.sha256).hexdigest()[:16]
+
+    def check_signature(self, url: str, sig: Optional[str]) -> bool:
+        return bool(sig) and hmac.compare_digest(self._sign(url), sig)
+
+    def thumb_url(self, url: str, width: Optional[int] = None) -> str:
+        width = self.snap_width(width)
+        params = {"url": url, "w": width, "sig": self._sign(url)}
+        return f"{settings.PUBLIC_BASE_URL.rstrip('/')}{settings.API_PREFIX}/thumb?{urlencode(params)}"
+
+    def with_thumbnails(self, items: List[Dict[str, Any]], url_key: str, thumb_key: str) -> List[Dict[str, Any]]:
+        """Add `item[thumb_key]` (default-width thumbnail URL) to every item that has `item[url_key]`."""
+        for item in items:
+            if item.get(url_key):
+                item[thumb_key] = self.thumb_url(item[url_key])
+        return items
+
+    # --- cache ---------------------------------------------------------------
+
+    @staticmethod
+    def etag(url: str, width: int) -> str:
+        return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}_{width}"
+
+    def _path(self, url: str, width: int) -> Path:
+        return self.cache_dir / f"{self.etag(url, width)}.webp"
+
+    async def get(self, url: str, width: int) -> Path:
+        """Path of the cached WebP for (`url`, `width`), rendering it first if needed."""
+        path = self._path(url, width)
+        try:
+            # Bump mtime so pruning evicts the least recently used files
+            os.utime(path)
+            self.stats["hits"] += 1
+            return path
+        except FileNotFoundError:
+            pass
+
+        key = path.name
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._render(url, width, path))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()
+
+    async def _render(self, url: str, width: int, path: Path) -> Path:
+        # Originals go through the shared fetcher cache, so other widths reuse the download
+        data, _ = await image_fetcher.fetch(url)
+        try:
+            webp = await run_in_image_pool(render_webp, data, width, self.quality)
+        except Exception as e:
+            self.stats["render_errors"] += 1
+            raise ThumbnailError(f"Cannot render {url}: {e}") from e
+
+        self.stats["renders"] += 1
+        self.stats["bytes_in"] += len(data)
+        self.stats["bytes_out"] += len(webp)
+        await asyncio.to_thread(self._write, path, webp)
+        return path
+
+    def _write(self, path: Path, data: bytes) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        # Thumbnails are small: scanning the directory on every write would cost more than they do
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 50:
+            self._writes_since_prune = 0
+            self._prune()
+
+    def _prune(self) -> None:
+        """Drop the oldest thumbnails once the directory exceeds `max_bytes`."""
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".webp"):
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes * 0.9:
+                break
+
+    def summary(self) -> Dict[str, Any]:
+        out = {**self.stats, "inflight": len(self._inflight), "widths": self.widths}
+        if self.stats["bytes_in"]:
+            out["size_ratio"] = round(self.stats["bytes_out"] / self.stats["bytes_in"], 3)
+        return out
+
+
+thumbnail_service = ThumbnailService(
+    cache_dir=settings.THUMB_CACHE_DIR,
+    widths=settings.THUMB_WIDTHS,
+    quality=settings.THUMB_WEBP_QUALITY,
+    max_bytes=settings.THUMB_CACHE_MAX_MB * 1024 * 1024,
+    signing_key=load_signing_key(settings.THUMB_SIGNING_KEY, settings.THUMB_SIGNING_KEY_PATH),
+)
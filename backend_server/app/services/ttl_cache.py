@@ -0,0 +1,97 @@
+"""Small in-process TTL + LRU cache."""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class TTLCache:
+    """
+    Dict-like cache with per-entry expiry and LRU eviction above `maxsize`
+    entries, or above `maxbytes` total when a `sizeof(value)` is given
+    (values larger than `maxbytes` are not stored at all).
+
+    Not thread-safe; meant for use from the event loop.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600,
+        maxbytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes if sizeof is not None else None
+        self._sizeof = sizeof
+        self.bytes = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._drop(key)
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if key in self._data:
+            self._drop(key)
+        if self.maxbytes is not None:
+            size = self._sizeof(value)
+            if size > self.maxbytes:
+                return
+            self.bytes += size
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        while len(self._data) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+            self._drop(next(iter(self._data)))
+            self.evictions += 1
+
+    def _drop(self, key: Hashable) -> Optional[tuple]:
+        item = self._data.pop(key, None)
+        if item is not None and self.maxbytes is not None:
+            self.bytes -= self._sizeof(item[1])
+        return item
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._drop(key)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        out = {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+        if self.maxbytes is not None:
+            out["bytes"] = self.bytes
+            out["maxbytes"] = self.maxbytes
+        return out
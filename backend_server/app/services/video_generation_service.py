@@ -4,7 +4,8 @@ from typing import Any, Dict, Optional
 from fastapi import HTTPException
 from dotenv import load_dotenv
 
-import fal_client
+from app.services.fal_gateway import fal_video
+from app.services.resilience import UpstreamUnavailable
 
 load_dotenv()
 
@@ -30,7 +31,8 @@ class VideoGenerationService:
         try:
             print(f"DEBUG: Calling Kling Video (Standard)... Image={image_url[:50]}...")
             
-            handler = fal_client.submit(
+            # submit + wait in the fal thread pool, behind the video bulkhead/breaker
+            result = await fal_video(
                 "fal-ai/kling-video/v1/standard/image-to-video",
                 arguments={
                     "image_url": image_url,
@@ -40,16 +42,12 @@ class VideoGenerationService:
                 },
             )
             
-            # Request log
-            request_id = handler.request_id
-            print(f"DEBUG: Kling Request ID: {request_id}")
-
-            # Wait for result
-            result = handler.get()
-            
             print(f"DEBUG: Kling Result: {result}")
             return result
 
+        except UpstreamUnavailable as e:
+            print(f"Kling Video unavailable: {e}")
+            raise HTTPException(status_code=503, detail=f"Video generation temporarily unavailable: {e}")
         except Exception as e:
             print(f"Kling Video Error: {e}")
             raise HTTPException(status_code=500, detail=f"Video generation failed: {e}")
@@ -0,0 +1,106 @@
+"""
+Benchmark: per-request cost of the /search/images result filters.
+
+    python bench_image_filters.py --items 100 --rounds 2000
+
+Runs `_extract_and_filter` on N synthetic CSE items (a mix of clean
+results, banned domains, logo/icon URLs and banned keywords) and compares
+it with the previous per-pattern loop (re.search for every BAD_IMG_PATTERN,
+substring scan for every BANNED_KEYWORD / BANNED_DOMAIN).
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+
+from app.search import internet_images as ii
+
+
+def _legacy_extract_and_filter(raw_items):
+    def banned_domain(s):
+        u = (s or "").lower()
+        return any(d in u for d in ii.BANNED_DOMAINS)
+
+    def bad_image_url(url):
+        u = (url or "").lower()
+        return any(re.search(p, u) for p in ii.BAD_IMG_PATTERNS)
+
+    def banned_keyword(*parts):
+        text = " ".join([p or "" for p in parts]).lower()
+        return any(k in text for k in ii.BANNED_KEYWORDS)
+
+    cleaned = []
+    for it in raw_items:
+        image_url = (it.get("link") or "").strip()
+        page_url = ((it.get("image") or {}).get("contextLink") or "").strip()
+        title = (it.get("title") or "").strip()
+        site = (it.get("displayLink") or "").strip()
+        if not image_url:
+            continue
+        if banned_domain(site) or banned_domain(page_url):
+            continue
+        if bad_image_url(image_url):
+            continue
+        if banned_keyword(title, site, page_url, image_url):
+            continue
+        cleaned.append({"image_url": image_url, "page_url": page_url, "title": title, "site": site})
+    return cleaned
+
+
+def _make_items(n, seed=42):
+    rnd = random.Random(seed)
+    sites = ["www.zara.com", "lamoda.ru", "www.asos.com", "shop.hm.com", "www.pinterest.com", "vk.com"]
+    titles = [
+        "Женское пальто оверсайз из шерсти — купить в интернет-магазине",
+        "Men's linen shirt relaxed fit summer collection 2024",
+        "Платье миди с цветочным принтом, повседневный образ",
+        "Brand logo vector illustration",
+        "Tactical rifle sling accessory",
+    ]
+    items = []
+    for i in range(n):
+        site = rnd.choice(sites)
+        path = rnd.choice(["images/products", "static/media", "assets/icon", "upload/catalog"])
+        items.append({
+            "link": f"https://{site}/{path}/{i:05d}_{rnd.randrange(10**6)}.jpg",
+            "title": rnd.choice(titles),
+            "displayLink": site,
+            "image": {"contextLink": f"https://{site}/product/{i}-{rnd.randrange(10**6)}"},
+        })
+    return items
+
+
+def _time(fn, items, rounds):
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(items)
+        samples.append((time.perf_counter() - t0) * 1e6)
+    return samples
+
+
+def main(args):
+    items = _make_items(args.items)
+    legacy = _legacy_extract_and_filter(items)
+    current = ii._extract_and_filter(items)
+    assert [i["image_url"] for i in legacy] == [i["image_url"] for i in current], "filters disagree"
+    print(f"{args.items} items, {len(current)} kept, {args.rounds} rounds")
+
+    results = {}
+    for label, fn in (("legacy loop", _legacy_extract_and_filter), ("compiled", ii._extract_and_filter)):
+        samples = sorted(_time(fn, items, args.rounds))
+        results[label] = statistics.median(samples)
+        print(
+            f"{label:<12} p50={results[label]:8.1f}us  "
+            f"p95={samples[int(0.95 * (len(samples) - 1))]:8.1f}us  "
+            f"per item={results[label] / args.items:6.2f}us"
+        )
+    print(f"speedup: x{results['legacy loop'] / results['compiled']:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=2000)
+    main(parser.parse_args())
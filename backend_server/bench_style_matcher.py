@@ -0,0 +1,110 @@
+"""
+Benchmark: per-query cost of style detection with a large taxonomy.
+
+    python bench_style_matcher.py --synonyms 1000 --queries 500 --rounds 20
+
+Builds a synthetic taxonomy (--synonyms synonyms over --styles styles, made
+of pseudo-words in Latin and Cyrillic) and a set of catalog-like queries,
+a third of them mentioning one or two styles. Compares the previous
+`detect_style` (normalize + substring scan over every synonym, stopping at
+the first hit) with the compiled automaton (`StyleTaxonomy.find`, every
+style in one pass) and with the cached `expand` path /search uses.
+"""
+import argparse
+import random
+import re
+import statistics
+import time
+
+from app.search.style_map import StyleTaxonomy, normalize_query
+
+_SYLLABLES = [
+    "ka", "lo", "mi", "ran", "sto", "vel", "nor", "qui", "zen", "bri",
+    "ко", "ла", "ми", "стр", "ран", "вел", "нор", "зен", "бри", "тах",
+]
+_WORDS = ["пальто", "платье", "куртка", "джинсы", "кроссовки", "hoodie", "coat", "dress", "шерстяное", "оверсайз"]
+
+
+def _word(rnd, syllables):
+    return "".join(rnd.choice(_SYLLABLES) for _ in range(syllables))
+
+
+def _make_taxonomy(n_synonyms, n_styles, seed=7):
+    rnd = random.Random(seed)
+    styles = {f"style_{i}": {"synonyms": [], "tags": {f"tag{i}_{j}": round(1 - j / 10, 1) for j in range(6)}} for i in range(n_styles)}
+    seen = set()
+    while len(seen) < n_synonyms:
+        syn = " ".join(_word(rnd, rnd.randint(2, 4)) for _ in range(rnd.choice([1, 1, 2])))
+        if syn not in seen:
+            seen.add(syn)
+            styles[f"style_{len(seen) % n_styles}"]["synonyms"].append(syn)
+    return styles
+
+
+def _make_queries(styles, n, seed=11):
+    rnd = random.Random(seed)
+    synonyms = [s for spec in styles.values() for s in spec["synonyms"]]
+    queries = []
+    for i in range(n):
+        words = rnd.sample(_WORDS, 3)
+        if i % 3 == 0:
+            words.insert(rnd.randrange(4), rnd.choice(synonyms))
+            if i % 6 == 0:
+                words.append(rnd.choice(synonyms))
+        queries.append(" ".join(words))
+    return queries
+
+
+def _legacy_detect(flat_synonyms, q):
+    nq = q.strip().lower()
+    nq = re.sub(r"\s+", " ", nq)
+    for syn, key in flat_synonyms.items():
+        if syn in nq:
+            return key
+    return None
+
+
+def _time(fn, queries, rounds):
+    samples = []
+    for _ in range(rounds):
+        for q in queries:
+            t0 = time.perf_counter()
+            fn(q)
+            samples.append((time.perf_counter() - t0) * 1e6)
+    return sorted(samples)
+
+
+def main(args):
+    styles = _make_taxonomy(args.synonyms, args.styles)
+    t0 = time.perf_counter()
+    taxonomy = StyleTaxonomy(styles, max_boost_terms=10, cache_size=10000)
+    compile_ms = (time.perf_counter() - t0) * 1000
+    flat = dict(taxonomy.synonyms)
+    queries = [normalize_query(q) for q in _make_queries(styles, args.queries)]
+
+    with_style = sum(1 for q in queries if taxonomy.find(q))
+    print(
+        f"{len(flat)} synonyms / {len(styles)} styles, automaton {taxonomy.summary()['automaton_states']} states, "
+        f"compiled in {compile_ms:.1f}ms; {len(queries)} queries ({with_style} with a style), {args.rounds} rounds"
+    )
+
+    cases = (
+        ("legacy scan", lambda q: _legacy_detect(flat, q)),
+        ("automaton", taxonomy.find),
+        ("cached", taxonomy.expand),
+    )
+    results = {}
+    for label, fn in cases:
+        samples = _time(fn, queries, args.rounds)
+        results[label] = statistics.median(samples)
+        print(f"{label:<12} p50={results[label]:7.2f}us  p95={samples[int(0.95 * (len(samples) - 1))]:7.2f}us")
+    print(f"automaton speedup: x{results['legacy scan'] / results['automaton']:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synonyms", type=int, default=1000)
+    parser.add_argument("--styles", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+"""
+Load test: /suggest latency while consultant calls are in flight.
+
+Run the server first (uvicorn app.main:app --port 8000), then:
+
+    python loadtest_consultant.py --base-url http://localhost:8000 --consultant-calls 50
+
+The script measures /suggest latency on an idle worker, then again while
+N /api/v1/consultant/ask requests are pending. With a non-blocking Gemini
+client both distributions should be roughly the same.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def _pct(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def _report(label, samples):
+    print(
+        f"{label:<28} n={len(samples):<4} "
+        f"p50={_pct(samples, 50):7.1f}ms  p95={_pct(samples, 95):7.1f}ms  "
+        f"max={max(samples) if samples else 0:7.1f}ms"
+    )
+
+
+async def _sample_suggest(client, base_url, query, stop: asyncio.Event, interval: float):
+    samples = []
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        try:
+            await client.get(f"{base_url}/suggest", params={"q": query})
+        except httpx.HTTPError as e:
+            print(f"suggest error: {e}")
+        samples.append((time.perf_counter() - t0) * 1000)
+        await asyncio.sleep(interval)
+    return samples
+
+
+async def _consultant_call(client, base_url, question):
+    t0 = time.perf_counter()
+    try:
+        r = await client.post(
+            f"{base_url}/api/v1/consultant/ask",
+            json={"question": question, "context": {}, "history": [], "language": "ru"},
+        )
+        ok = r.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return ok, (time.perf_counter() - t0) * 1000
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.consultant_calls + 10)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        # 1. Baseline
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(
+            _sample_suggest(client, args.base_url, args.suggest_query, stop, args.interval)
+        )
+        await asyncio.sleep(args.baseline_seconds)
+        stop.set()
+        baseline = await sampler
+
+        # 2. Under load
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(
+            _sample_suggest(client, args.base_url, args.suggest_query, stop, args.interval)
+        )
+        consultant = await asyncio.gather(*[
+            _consultant_call(client, args.base_url, args.question)
+            for _ in range(args.consultant_calls)
+        ])
+        stop.set()
+        loaded = await sampler
+
+    print()
+    _report("/suggest idle", baseline)
+    _report(f"/suggest + {args.consultant_calls} consultant", loaded)
+    _report("/consultant/ask", [ms for _, ms in consultant])
+    ok = sum(1 for success, _ in consultant if success)
+    print(f"consultant ok: {ok}/{len(consultant)}")
+
+    if baseline and loaded:
+        ratio = statistics.median(loaded) / max(statistics.median(baseline), 0.001)
+        print(f"/suggest p50 slowdown under load: x{ratio:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--consultant-calls", type=int, default=50)
+    parser.add_argument("--question", default="Что надеть на свадьбу летом?")
+    parser.add_argument("--suggest-query", default="пальто")
+    parser.add_argument("--baseline-seconds", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.05)
+    asyncio.run(main(parser.parse_args()))
@@ -15,6 +15,9 @@ SUPER_ADMIN_IDS = [
 ]
 
 GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+# Full model for styling from photos, light model for short structured answers
+GEMINI_MODEL_FULL: str = os.getenv("GEMINI_MODEL_FULL", "gemini-2.5-flash")
+GEMINI_MODEL_LIGHT: str = os.getenv("GEMINI_MODEL_LIGHT", "gemini-2.5-flash-lite")
 
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN is not set")
@@ -4,7 +4,12 @@ Commands (owner-only):
   /addadmin <telegram_id>    — grant admin rights
   /removeadmin <telegram_id> — revoke admin rights
   /listadmins                — show current admins
+Commands (superadmin-only):
+  /addgen <owner_id> <amount> — add try-on generations
+  /aistats                    — Gemini model routing counters and health
 """
+import html
+
 from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
@@ -209,3 +214,26 @@ async def add_generations(message: Message, store: dict):
         )
     else:
         await message.answer("❌ Магазин с таким Telegram ID владельца не найден.")
+
+
+# ─── /aistats ─────────────────────────────────────────────────────────────────
+
+@router.message(Command("aistats"))
+async def ai_stats(message: Message):
+    from config import SUPER_ADMIN_IDS
+    if message.from_user.id not in SUPER_ADMIN_IDS:
+        await message.answer("⛔️ Только для суперадмина.")
+        return
+
+    from services.gemini_service import routing_summary
+    summary = routing_summary()
+
+    lines = ["🤖 <b>Gemini: выбор модели</b>"]
+    lines += [f"• {html.escape(key)}: <b>{n}</b>" for key, n in summary["decisions"].items()] or ["• запросов ещё не было"]
+    lines.append("\n<b>Здоровье моделей (5 мин)</b>")
+    for model, stats in summary["models"].items():
+        lines.append(
+            f"• {html.escape(model)}: {stats['samples']} запр., ошибки {stats['error_rate']:.0%}, "
+            f"p50 {stats['p50_ms'] or '—'} мс, p95 {stats['p95_ms'] or '—'} мс"
+        )
+    await message.answer("\n".join(lines), parse_mode="HTML")
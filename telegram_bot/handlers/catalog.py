@@ -234,26 +234,17 @@ async def ai_size_recommendation(callback: CallbackQuery, store: dict):
     """
     
     try:
-        import os
-        import httpx
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY is not set.")
-            
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={api_key}"
-        
+        from services.gemini_service import generate_content
+
         payload = {
             "contents": [{"parts": [{"text": prompt}]}],
             "generationConfig": {"temperature": 0.7, "maxOutputTokens": 1500}
         }
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            
-            data = response.json()
-            recommendation = data["candidates"][0]["content"]["parts"][0]["text"].strip()
-            
+
+        # Short structured answer: routed to the light model
+        data = await generate_content("size_recommendation", payload, timeout=30.0)
+        recommendation = data["candidates"][0]["content"]["parts"][0]["text"].strip()
+
         await callback.message.answer(
             f"🪄 <b>Рекомендация ИИ-Стилиста:</b>\n\n{recommendation}",
             parse_mode="HTML"
@@ -2,11 +2,132 @@ import httpx
 import base64
 import json
 import logging
-from typing import List, Dict, Any, Tuple
-from config import GEMINI_API_KEY
+import random
+import time
+from collections import Counter, deque
+from typing import List, Dict, Any, Optional, Tuple
+from config import GEMINI_API_KEY, GEMINI_MODEL_FULL, GEMINI_MODEL_LIGHT
+from services.image_utils import normalize_photo
 
 logger = logging.getLogger(__name__)
 
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+
+# Task -> tier: photo styling needs the full model, size advice is a
+# short structured answer the light model handles
+TASK_TIERS = {"suggest_outfit": "full", "size_recommendation": "light"}
+MODELS = {"full": GEMINI_MODEL_FULL, "light": GEMINI_MODEL_LIGHT}
+
+# Rolling health per model; a model is skipped while degraded
+ROUTER_WINDOW_SECONDS = 300
+ROUTER_MIN_SAMPLES = 5
+ROUTER_MAX_ERROR_RATE = 0.2
+ROUTER_MAX_P95_MS = {"full": 30000, "light": 10000}
+ROUTER_PROBE_RATE = 0.05
+
+_samples: Dict[str, deque] = {}
+routing_decisions: Counter = Counter()
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=60.0)
+    return _client
+
+
+def _record(model: str, latency_ms: float, ok: bool) -> None:
+    _samples.setdefault(model, deque(maxlen=200)).append((time.time(), latency_ms, ok))
+
+
+def model_stats(model: str) -> Dict[str, Any]:
+    """p50/p95 latency and error rate of `model` over the rolling window."""
+    window = _samples.setdefault(model, deque(maxlen=200))
+    cutoff = time.time() - ROUTER_WINDOW_SECONDS
+    while window and window[0][0] < cutoff:
+        window.popleft()
+    latencies = sorted(ms for _, ms, ok in window if ok)
+    errors = sum(1 for _, _, ok in window if not ok)
+
+    def pct(p: float):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))]) if latencies else None
+
+    return {
+        "samples": len(window),
+        "p50_ms": pct(0.5),
+        "p95_ms": pct(0.95),
+        "error_rate": round(errors / len(window), 3) if window else 0.0,
+    }
+
+
+def _is_healthy(tier: str) -> bool:
+    stats = model_stats(MODELS[tier])
+    if stats["samples"] < ROUTER_MIN_SAMPLES:
+        return True
+    if stats["error_rate"] > ROUTER_MAX_ERROR_RATE:
+        return False
+    return stats["p95_ms"] is None or stats["p95_ms"] <= ROUTER_MAX_P95_MS[tier]
+
+
+def choose_model(task: str) -> Tuple[str, str]:
+    """
+    (model, reason) for the task: the preferred tier unless it is degraded
+    and the other tier is not.
+    """
+    tier = TASK_TIERS.get(task, "full")
+    other = "light" if tier == "full" else "full"
+    model, reason = MODELS[tier], "preferred"
+    if not _is_healthy(tier) and _is_healthy(other):
+        if random.random() < ROUTER_PROBE_RATE:
+            reason = "probe"
+        else:
+            model, reason = MODELS[other], "shifted"
+            logger.warning(f"Gemini {MODELS[tier]} degraded {model_stats(MODELS[tier])}, '{task}' -> {model}")
+    routing_decisions[(task, model, reason)] += 1
+    return model, reason
+
+
+def routing_summary() -> Dict[str, Any]:
+    """Routing counters and model health, for the /aistats admin command."""
+    return {
+        "decisions": {f"{task} -> {model} ({reason})": n for (task, model, reason), n in routing_decisions.most_common()},
+        "models": {model: model_stats(model) for model in MODELS.values()},
+    }
+
+
+async def generate_content(task: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    """
+    POST generateContent on the model routed for `task` and return the JSON body.
+    Latency and failures (transport errors, 429, 5xx) feed the router.
+    """
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY не настроен. Обратитесь к администратору.")
+
+    model, reason = choose_model(task)
+    started = time.perf_counter()
+    try:
+        response = await _get_client().post(
+            f"{GEMINI_BASE_URL}/{model}:generateContent",
+            params={"key": GEMINI_API_KEY},
+            json=payload,
+            timeout=timeout,
+        )
+    except httpx.HTTPError:
+        _record(model, (time.perf_counter() - started) * 1000, ok=False)
+        raise
+
+    # 4xx other than 429 are request problems, not model health
+    _record(model, (time.perf_counter() - started) * 1000, ok=response.status_code < 500 and response.status_code != 429)
+    logger.debug(
+        f"Gemini {task} via {model} ({reason}): {response.status_code} in {(time.perf_counter() - started):.1f}s"
+    )
+
+    if response.status_code != 200:
+        logger.error(f"Gemini API Error ({model}): {response.text}")
+        raise Exception("Ошибка при обращении к AI-стилисту.")
+    return response.json()
+
 async def suggest_outfit(photo_bytes: bytes, store_products: List[Dict[str, Any]]) -> Tuple[str, List[str]]:
     """
     Sends the user's photo and the store's products to Gemini.
@@ -38,6 +159,7 @@ async def suggest_outfit(photo_bytes: bytes, store_products: List[Dict[str, Any]
     "recommended_ids": ["id_товара_1", "id_товара_2"]
 }}"""
 
+    photo_bytes = await normalize_photo(photo_bytes)
     b64_image = base64.b64encode(photo_bytes).decode('utf-8')
 
     payload = {
@@ -58,29 +180,20 @@ async def suggest_outfit(photo_bytes: bytes, store_products: List[Dict[str, Any]
         }
     }
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
+    data = await generate_content("suggest_outfit", payload, timeout=60.0)
 
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(url, json=payload)
+    try:
+        content_text = data["candidates"][0]["content"]["parts"][0]["text"]
+        result = json.loads(content_text)
+        
+        advice = result.get("text", "Вот что я подобрал для вас!")
+        recommended_ids = result.get("recommended_ids", [])
+        
+        # Filter IDs to ensure they actually exist in the store products
+        valid_ids = [str(pid) for pid in recommended_ids if any(str(p['id']) == str(pid) for p in store_products)]
         
-        if response.status_code != 200:
-            logger.error(f"Gemini API Error: {response.text}")
-            raise Exception("Ошибка при обращении к AI-стилисту.")
-            
-        data = response.json()
+        return advice, valid_ids
         
-        try:
-            content_text = data["candidates"][0]["content"]["parts"][0]["text"]
-            result = json.loads(content_text)
-            
-            advice = result.get("text", "Вот что я подобрал для вас!")
-            recommended_ids = result.get("recommended_ids", [])
-            
-            # Filter IDs to ensure they actually exist in the store products
-            valid_ids = [str(pid) for pid in recommended_ids if any(str(p['id']) == str(pid) for p in store_products)]
-            
-            return advice, valid_ids
-            
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
-            logger.error(f"Failed to parse Gemini response: {e}\nRaw text: {data}")
-            raise Exception("Не удалось расшифровать ответ от AI-стилиста.")
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to parse Gemini response: {e}\nRaw text: {data}")
+        raise Exception("Не удалось расшифровать ответ от AI-стилиста.")
@@ -0,0 +1,40 @@
+import asyncio
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1536"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Pillow work runs here, never on the bot's event loop
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-normalize")
+
+
+def _normalize(data: bytes) -> bytes:
+    try:
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        # exif is not passed to save(), so metadata is stripped
+        img.save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+    except Exception as e:
+        logger.warning(f"Image normalization skipped: {e}")
+        return data
+
+
+async def normalize_photo(data: bytes) -> bytes:
+    """
+    EXIF-rotate, downscale to IMAGE_MAX_EDGE and re-encode as JPEG
+    before the photo is inlined into a Gemini request.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _normalize, data)